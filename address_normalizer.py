@@ -0,0 +1,281 @@
+"""
+Canonical form of US street addresses, used as the geocode cache key.
+
+Two spellings of the same address ("123 Main St, Tampa FL 33601" and
+"123 MAIN STREET , Tampa, Fla 33601") canonicalize to the same string, so a
+result geocoded for one is reused for the other. The canonical form is only a
+key; the address sent to the geocoder is unchanged.
+"""
+import hashlib
+import re
+
+# USPS Publication 28 street suffix abbreviations (common forms)
+STREET_SUFFIXES = {
+    "ALLEY": "ALY", "ALLEE": "ALY", "ALLY": "ALY",
+    "AVENUE": "AVE", "AV": "AVE", "AVEN": "AVE", "AVENU": "AVE", "AVN": "AVE", "AVNUE": "AVE",
+    "BOULEVARD": "BLVD", "BOULV": "BLVD", "BOUL": "BLVD",
+    "CIRCLE": "CIR", "CIRC": "CIR", "CIRCL": "CIR", "CRCL": "CIR", "CRCLE": "CIR",
+    "COURT": "CT", "CRT": "CT",
+    "COVE": "CV",
+    "CROSSING": "XING", "CRSSNG": "XING",
+    "DRIVE": "DR", "DRIV": "DR", "DRV": "DR",
+    "EXPRESSWAY": "EXPY", "EXPRESS": "EXPY", "EXPW": "EXPY",
+    "FREEWAY": "FWY", "FRWY": "FWY",
+    "HIGHWAY": "HWY", "HIGHWY": "HWY", "HIWAY": "HWY", "HIWY": "HWY", "HWAY": "HWY",
+    "LANE": "LN",
+    "LOOP": "LOOP",
+    "PARKWAY": "PKWY", "PARKWY": "PKWY", "PKWAY": "PKWY", "PKY": "PKWY",
+    "PLACE": "PL",
+    "PLAZA": "PLZ", "PLZA": "PLZ",
+    "POINT": "PT",
+    "ROAD": "RD",
+    "SQUARE": "SQ", "SQR": "SQ", "SQRE": "SQ", "SQU": "SQ",
+    "STREET": "ST", "STRT": "ST", "STR": "ST",
+    "TERRACE": "TER", "TERR": "TER",
+    "TRAIL": "TRL", "TRAILS": "TRL", "TRLS": "TRL",
+    "TURNPIKE": "TPKE", "TRNPK": "TPKE", "TURNPK": "TPKE",
+    "WAY": "WAY",
+}
+
+DIRECTIONALS = {
+    "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W",
+    "NORTHEAST": "NE", "NORTHWEST": "NW", "SOUTHEAST": "SE", "SOUTHWEST": "SW",
+}
+
+# Unit designators; every unit is keyed as "# <identifier>" since the kind of unit
+# ("Suite 200" vs "#200") does not change where the building is
+UNIT_DESIGNATORS = {
+    "APARTMENT", "APT", "SUITE", "STE", "UNIT", "BUILDING", "BLDG", "FLOOR", "FL", "FLR",
+    "ROOM", "RM", "DEPARTMENT", "DEPT", "SPACE", "SPC", "LOT", "#",
+}
+
+STATE_CODES = {
+    "ALABAMA": "AL", "ALASKA": "AK", "ARIZONA": "AZ", "ARKANSAS": "AR", "CALIFORNIA": "CA",
+    "COLORADO": "CO", "CONNECTICUT": "CT", "DELAWARE": "DE", "DISTRICT OF COLUMBIA": "DC",
+    "FLORIDA": "FL", "GEORGIA": "GA", "HAWAII": "HI", "IDAHO": "ID", "ILLINOIS": "IL",
+    "INDIANA": "IN", "IOWA": "IA", "KANSAS": "KS", "KENTUCKY": "KY", "LOUISIANA": "LA",
+    "MAINE": "ME", "MARYLAND": "MD", "MASSACHUSETTS": "MA", "MICHIGAN": "MI", "MINNESOTA": "MN",
+    "MISSISSIPPI": "MS", "MISSOURI": "MO", "MONTANA": "MT", "NEBRASKA": "NE", "NEVADA": "NV",
+    "NEW HAMPSHIRE": "NH", "NEW JERSEY": "NJ", "NEW MEXICO": "NM", "NEW YORK": "NY",
+    "NORTH CAROLINA": "NC", "NORTH DAKOTA": "ND", "OHIO": "OH", "OKLAHOMA": "OK", "OREGON": "OR",
+    "PENNSYLVANIA": "PA", "PUERTO RICO": "PR", "RHODE ISLAND": "RI", "SOUTH CAROLINA": "SC",
+    "SOUTH DAKOTA": "SD", "TENNESSEE": "TN", "TEXAS": "TX", "UTAH": "UT", "VERMONT": "VT",
+    "VIRGINIA": "VA", "WASHINGTON": "WA", "WEST VIRGINIA": "WV", "WISCONSIN": "WI", "WYOMING": "WY",
+    # Common informal abbreviations
+    "ALA": "AL", "ARIZ": "AZ", "ARK": "AR", "CALIF": "CA", "CALI": "CA", "CAL": "CA", "CALF": "CA",
+    "COLO": "CO", "CONN": "CT", "DEL": "DE", "FLA": "FL", "FLAZ": "FL", "FLOR": "FL", "FLO": "FL",
+    "ILL": "IL", "ILLI": "IL", "IND": "IN", "KAN": "KS", "KANS": "KS", "MASS": "MA",
+    "MICH": "MI", "MINN": "MN", "MISS": "MS", "MONT": "MT", "NEB": "NE", "NEBR": "NE",
+    "NEV": "NV", "OKLA": "OK", "ORE": "OR", "PENN": "PA", "PENNA": "PA", "TENN": "TN",
+    "TEX": "TX", "WASH": "WA", "WIS": "WI", "WISC": "WI", "WYO": "WY",
+}
+STATE_ABBREVIATIONS = set(STATE_CODES.values())
+
+COUNTRY_SUFFIXES = {("USA",), ("US",), ("U", "S", "A"), ("U", "S"), ("UNITED", "STATES"),
+                    ("UNITED", "STATES", "OF", "AMERICA")}
+
+# Punctuation other than '#' (unit marker) and '-' (ZIP+4, hyphenated house numbers)
+_PUNCTUATION = re.compile(r"[^\w#\-]+")
+_ZIP = re.compile(r"^(\d{5})(?:-?\d{4})?$")
+_STATE_NAME_TOKENS = {tuple(name.split()): code for name, code in STATE_CODES.items()}
+_STATE_NAME_LENGTHS = sorted({len(name) for name in _STATE_NAME_TOKENS}, reverse=True)
+_COUNTRY_SUFFIXES_BY_LENGTH = sorted(COUNTRY_SUFFIXES, key=len, reverse=True)
+_STREET_SUFFIX_WORDS = set(STREET_SUFFIXES) | set(STREET_SUFFIXES.values())
+
+def is_unit_identifier(token):
+    """
+    Whether a word after a unit designator is a unit number rather than part of the street name.
+
+    "Suite 200", "Apt 4B" and "Unit C" are units; "Unit Rd" and "Building Ln"
+    are streets. An identifier holds a digit or is a single letter, and is
+    never a street suffix.
+
+    Args:
+        token: Word following the designator
+
+    Returns:
+        True if the word identifies a unit
+    """
+    token = token.upper()
+    if token in _STREET_SUFFIX_WORDS:
+        return False
+    return any(ch.isdigit() for ch in token) or (len(token) == 1 and token.isalpha())
+
+def _strip_country(tokens):
+    for suffix in _COUNTRY_SUFFIXES_BY_LENGTH:
+        if len(tokens) > len(suffix) and tuple(tokens[-len(suffix):]) == suffix:
+            return tokens[:-len(suffix)]
+    return tokens
+
+def _canonical_state(tokens, end):
+    """
+    Replace a state name ending just before position ``end`` with its code.
+
+    Returns:
+        Tuple (tokens, index of the state code or None)
+    """
+    for length in _STATE_NAME_LENGTHS:
+        start = end - length
+        code = _STATE_NAME_TOKENS.get(tuple(tokens[start:end])) if start >= 1 else None
+        if code:
+            return tokens[:start] + [code] + tokens[end:], start
+    if end >= 2 and tokens[end - 1] in STATE_ABBREVIATIONS:
+        return tokens, end - 1
+    return tokens, None
+
+def canonicalize_address(address):
+    """
+    Canonical form of a US address for cache lookups.
+
+    Upper-cases, drops punctuation, collapses whitespace, abbreviates street
+    suffixes and directionals (USPS style), turns state names into their
+    two-letter codes, keys every unit designator as "#", shortens ZIP+4 to the
+    5-digit ZIP and drops a trailing country.
+
+    Args:
+        address: Address string as extracted from the order
+
+    Returns:
+        Canonical address string ('' for an empty address)
+    """
+    if not address:
+        return ''
+
+    text = address.upper().replace("#", " # ")
+    tokens = [token.strip("-") for token in _PUNCTUATION.sub(" ", text).replace("_", " ").split()]
+    tokens = _strip_country([token for token in tokens if token])
+
+    # Trailing ZIP code, then the state right before it (or at the end)
+    state_end = len(tokens)
+    if tokens:
+        zip_match = _ZIP.match(tokens[-1])
+        if zip_match:
+            tokens[-1] = zip_match.group(1)
+            state_end -= 1
+    tokens, state_index = _canonical_state(tokens, state_end)
+
+    result = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if i == state_index:
+            # Left alone: "CT" is also the court suffix
+            result.append(token)
+            i += 1
+            continue
+        if token in UNIT_DESIGNATORS and 0 < i < len(tokens) - 1:
+            # "Suite 200", "Apt #4" and "#200" all become "# <identifier>"
+            j = i + 1
+            if tokens[j] == "#" and j + 1 < len(tokens):
+                j += 1
+            # "FL" followed by a ZIP code is Florida, not a floor
+            is_florida = token == "FL" and _ZIP.match(tokens[j])
+            if j != state_index and not is_florida and is_unit_identifier(tokens[j]):
+                result.extend(["#", tokens[j]])
+                i = j + 1
+                continue
+        token = STREET_SUFFIXES.get(token, token)
+        result.append(DIRECTIONALS.get(token, token))
+        i += 1
+
+    return " ".join(result)
+
+def address_cache_key(address):
+    """
+    Geocode cache key for an address, shared by all spellings of it.
+
+    Args:
+        address: Address string
+
+    Returns:
+        Cache key string
+    """
+    return "addr_" + hashlib.md5(canonicalize_address(address).encode()).hexdigest()
+
+# Unit designator with its candidate identifier, as whole words ("Suite 200", "Apt. #4B", "#12"),
+# built from the same UNIT_DESIGNATORS the canonical key uses; a match is only a unit if
+# is_unit_identifier accepts the identifier ("Building Ln" is a street)
+_UNIT_WORDS = sorted((d for d in UNIT_DESIGNATORS if d != "#"), key=len, reverse=True)
+_UNIT = re.compile(
+    r"(?:\b(?:" + "|".join(_UNIT_WORDS) + r")\b\.?\s*#?|#)\s*"
+    r"(?P<unit>[A-Z0-9][A-Z0-9\-]*)\b",
+    re.IGNORECASE
+)
+_ZIP_AT_END = re.compile(r"[\s,]*\b(?P<zip>\d{5})(?:-\d{4})?\s*$")
+_COUNTRY_AT_END = re.compile(r"[\s,]+(?:U\.?S\.?A?\.?|UNITED\s+STATES(?:\s+OF\s+AMERICA)?)\s*$", re.IGNORECASE)
+_WORD_AT_END = re.compile(r"[\s,]*\b([A-Za-z][A-Za-z.]*)\s*$")
+
+def _split_state(text):
+    """Split a trailing state name or abbreviation (up to three words) off the text, longest name first."""
+    stop = len(text)
+    words = []
+    starts = []
+    for _ in range(3):
+        match = _WORD_AT_END.search(text, 0, stop)
+        if not match:
+            break
+        words.insert(0, match.group(1).rstrip(".").upper())
+        starts.insert(0, match.start())
+        stop = match.start()
+        # A state name never spans a comma
+        if "," in text[match.start():match.start(1)]:
+            break
+
+    # "West Virginia" before "Virginia", "New York" before "York"
+    for length in range(len(words), 0, -1):
+        name = " ".join(words[-length:])
+        code = STATE_CODES.get(name) or (name if name in STATE_ABBREVIATIONS else None)
+        if code:
+            return text[:starts[-length]], code
+    return text, None
+
+def _split_unit(text):
+    """Split the first unit ("Suite 200") off the text; returns (rest, unit or None)."""
+    match = next((m for m in _UNIT.finditer(text) if is_unit_identifier(m.group("unit"))), None)
+    if not match:
+        return text, None
+    return " ".join((text[:match.start()] + " " + text[match.end():]).split()), match.group("unit")
+
+def parse_address(address):
+    """
+    Split a one-line US address into street, unit, city, state and ZIP in one pass.
+
+    Expects the usual "street[, unit], city, state zip" layout; components
+    that cannot be identified are None. The state is returned as its
+    two-letter code, and the unit is separated from the street so it can be
+    left out of geocoding queries.
+
+    Args:
+        address: Address string
+
+    Returns:
+        Dictionary with street, unit, city, state and zip keys
+    """
+    parsed = {"street": None, "unit": None, "city": None, "state": None, "zip": None}
+    if not address:
+        return parsed
+
+    text = _COUNTRY_AT_END.sub("", address.strip())
+    zip_match = _ZIP_AT_END.search(text)
+    if zip_match and zip_match.start() > 0:
+        parsed["zip"] = zip_match.group("zip")
+        text = text[:zip_match.start()]
+    text, parsed["state"] = _split_state(text)
+
+    parts = [part.strip() for part in text.split(",") if part.strip()]
+    city = parts.pop() if len(parts) >= 2 else None
+
+    street_parts = []
+    for part in parts:
+        if parsed["unit"] is None:
+            part, parsed["unit"] = _split_unit(part)
+        if part:
+            street_parts.append(part)
+    parsed["street"] = ", ".join(street_parts) or None
+
+    if city:
+        # A unit written without a comma before the city ("Suite 1200 Chicago")
+        city, unit = _split_unit(city)
+        parsed["unit"] = parsed["unit"] or unit
+        parsed["city"] = city or None
+    return parsed
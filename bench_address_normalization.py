@@ -0,0 +1,104 @@
+"""
+Benchmark the geocode cache hit rate of raw-address keys vs canonical-address keys.
+
+Every address in the corpus is treated as one geocoding request against an
+initially empty cache: the first request for a key is a miss, every later one
+a hit. The corpus is either a text file with one address per line, or the
+patient addresses found in a results directory.
+
+    python bench_address_normalization.py --corpus addresses.txt
+    python bench_address_normalization.py --results data/results
+"""
+import argparse
+import hashlib
+import json
+import time
+from pathlib import Path
+
+from address_normalizer import address_cache_key, canonicalize_address
+
+# Spelling variants of the same addresses, used when no corpus is given
+SAMPLE_ADDRESSES = [
+    "123 Main St, Tampa FL 33601",
+    "123 MAIN STREET , Tampa, Fla 33601",
+    "123 Main Street, Tampa, Florida 33601-1234",
+    "123 main st., tampa, fl. 33601",
+    "4500 North Dale Mabry Highway Suite 200, Tampa, FL 33614",
+    "4500 N Dale Mabry Hwy #200, Tampa FL 33614",
+    "4500 N. DALE MABRY HWY STE 200, TAMPA, FLORIDA 33614, USA",
+    "350 Fifth Avenue, New York, NY 10118",
+    "350 Fifth Ave, New York, New York 10118",
+    "1 Infinite Loop, Cupertino, CA 95014",
+    "1 Infinite Loop, Cupertino, Calif 95014",
+    "77 West Wacker Drive Floor 3, Chicago, Illinois 60601",
+    "77 W Wacker Dr, Fl 3, Chicago, IL 60601",
+]
+
+def load_results_addresses(results_dir):
+    """Patient addresses from every results JSON file in a directory."""
+    addresses = []
+    for path in sorted(Path(results_dir).glob("*.json")):
+        try:
+            with open(path, 'r') as f:
+                results = json.load(f)
+        except (OSError, ValueError):
+            continue
+        patient_address = (results.get("extracted_data", {})
+                           .get("patient_info", {})
+                           .get("patient_address", {}))
+        if isinstance(patient_address, dict) and patient_address.get("value"):
+            addresses.append(patient_address["value"])
+    return addresses
+
+def simulate_hit_rate(addresses, key_function):
+    """Fraction of requests served from cache when keyed by key_function."""
+    seen = set()
+    hits = 0
+    for address in addresses:
+        key = key_function(address)
+        if key in seen:
+            hits += 1
+        else:
+            seen.add(key)
+    return hits / len(addresses) if addresses else 0.0, len(seen)
+
+def main():
+    parser = argparse.ArgumentParser(description="Geocode cache key hit-rate benchmark")
+    parser.add_argument("--corpus", help="Text file with one address per line")
+    parser.add_argument("--results", help="Results directory to read patient addresses from")
+    parser.add_argument("--show", type=int, default=0, help="Print this many canonical forms")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, 'r') as f:
+            addresses = [line.strip() for line in f if line.strip()]
+    elif args.results:
+        addresses = load_results_addresses(args.results)
+    else:
+        addresses = SAMPLE_ADDRESSES
+
+    if not addresses:
+        print("No addresses found in the corpus")
+        return
+
+    raw_rate, raw_keys = simulate_hit_rate(addresses, lambda a: hashlib.md5(a.encode()).hexdigest())
+    canonical_rate, canonical_keys = simulate_hit_rate(addresses, address_cache_key)
+
+    start = time.perf_counter()
+    for address in addresses:
+        canonicalize_address(address)
+    per_address = (time.perf_counter() - start) / len(addresses)
+
+    print(f"Addresses:                {len(addresses)}")
+    print(f"Distinct raw keys:        {raw_keys}")
+    print(f"Distinct canonical keys:  {canonical_keys}")
+    print(f"Raw key hit rate:         {raw_rate:.1%}")
+    print(f"Canonical key hit rate:   {canonical_rate:.1%}")
+    print(f"Geocoder requests saved:  {raw_keys - canonical_keys}")
+    print(f"Canonicalization cost:    {per_address * 1e6:.1f} us/address")
+
+    for address in addresses[:args.show]:
+        print(f"  {address!r} -> {canonicalize_address(address)!r}")
+
+if __name__ == "__main__":
+    main()
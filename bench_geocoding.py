@@ -0,0 +1,93 @@
+"""
+Throughput benchmark for batch geocoding against any geocoder backend.
+
+Runs geocode_many over a corpus and reports wall time, addresses per second
+and how many lookups reached the backend. By default it starts the local
+fixture server (with artificial latency) so nothing touches a public service:
+
+    python bench_geocoding.py --count 500 --latency 0.05 --workers 8
+    python bench_geocoding.py --backend gazetteer --corpus addresses.txt
+    python bench_geocoding.py --backend self_hosted --corpus addresses.txt --warm
+
+Each run uses a fresh temporary geocode cache unless --warm is given.
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from referrals import config, geocoding_client
+from referrals.fixture_server import FixtureServer
+from referrals.geocode_cache import GeocodeCache
+
+STREETS = ["Main St", "Oak Ave", "Maple Dr", "Cedar Ln", "Park Blvd", "Elm St", "Pine Rd", "Lake Dr"]
+CITIES = [("Tampa", "FL", "336"), ("Orlando", "FL", "328"), ("Chicago", "IL", "606"),
+          ("Austin", "TX", "787"), ("Denver", "CO", "802"), ("Atlanta", "GA", "303")]
+
+def synthetic_corpus(count, duplicate_rate, seed=0):
+    """Made-up addresses, with roughly duplicate_rate of them repeating earlier ones."""
+    rng = random.Random(seed)
+    addresses = []
+    for _ in range(count):
+        if addresses and rng.random() < duplicate_rate:
+            addresses.append(rng.choice(addresses))
+            continue
+        city, state, zip_prefix = rng.choice(CITIES)
+        addresses.append(f"{rng.randint(1, 9999)} {rng.choice(STREETS)}, {city}, {state} "
+                         f"{zip_prefix}{rng.randint(0, 99):02d}")
+    return addresses
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch geocoding throughput benchmark")
+    parser.add_argument("--backend", default="fixture",
+                        help="Geocoder backend: nominatim, self_hosted, gazetteer or fixture (default)")
+    parser.add_argument("--corpus", help="Text file with one address per line")
+    parser.add_argument("--count", type=int, default=200, help="Synthetic addresses when no corpus is given")
+    parser.add_argument("--duplicates", type=float, default=0.3, help="Share of repeated synthetic addresses")
+    parser.add_argument("--workers", type=int, default=config.GEOCODE_MAX_WORKERS, help="Concurrent lookups")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fixture server response delay in seconds")
+    parser.add_argument("--warm", action="store_true", help="Use the real geocode cache instead of a fresh one")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, 'r') as f:
+            addresses = [line.strip() for line in f if line.strip()]
+    else:
+        addresses = synthetic_corpus(args.count, args.duplicates)
+
+    server = None
+    if args.backend == "fixture":
+        server = FixtureServer(latency=args.latency, synthesize=True)
+        config.GEOCODER_FIXTURE_URL = server.start()
+    config.GEOCODER_BACKEND = args.backend
+
+    if not args.warm:
+        cache_dir = Path(tempfile.mkdtemp(prefix="bench_geocode_"))
+        geocoding_client._geocode_cache = GeocodeCache(cache_dir / "geocode_cache.db",
+                                                       ttl_days=config.GEOCODE_CACHE_EXPIRY,
+                                                       lru_size=config.GEOCODE_CACHE_LRU_SIZE)
+
+    try:
+        start = time.perf_counter()
+        results = geocoding_client.geocode_many(addresses, max_workers=args.workers)
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        geocoding_client.geocode_many(addresses, max_workers=args.workers)
+        repeat_elapsed = time.perf_counter() - start
+    finally:
+        if server:
+            server.stop()
+
+    resolved = sum(1 for result in results if result)
+    print(f"Backend:                  {args.backend}")
+    print(f"Addresses:                {len(addresses)} ({resolved} resolved)")
+    print(f"Workers:                  {args.workers}")
+    if server:
+        print(f"Backend requests:         {server.request_count}")
+    print(f"First pass:               {elapsed:.2f}s ({len(addresses) / elapsed:.1f} addresses/s)")
+    print(f"Repeat pass (cached):     {repeat_elapsed:.3f}s ({len(addresses) / repeat_elapsed:.0f} addresses/s)")
+
+if __name__ == "__main__":
+    main()
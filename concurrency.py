@@ -0,0 +1,65 @@
+"""
+Per-service limits on concurrent calls, shared by every worker thread.
+
+    with service_slot("llm"):
+        response = client.chat.completions.create(...)
+
+Limits come from config.SERVICE_CONCURRENCY (services are "documentai",
+"llm" and HTTP host names); services not listed there are not limited.
+This bounds how many requests are in flight to each service when orders are
+processed concurrently; request rates are limited separately by
+rate_limiter.py.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from referrals import config
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Semaphores created so far, by service (None when the service is not limited)
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+def get_service_semaphore(service):
+    """
+    Get the semaphore limiting concurrent calls to a service.
+
+    Args:
+        service: Service name or HTTP host name
+
+    Returns:
+        BoundedSemaphore shared by every caller in this process, or None if unlimited
+    """
+    with _semaphores_lock:
+        if service not in _semaphores:
+            limit = config.SERVICE_CONCURRENCY.get(service)
+            _semaphores[service] = threading.BoundedSemaphore(limit) if limit else None
+        return _semaphores[service]
+
+@contextmanager
+def service_slot(service):
+    """
+    Hold one of a service's concurrent call slots for the duration of a block.
+
+    Args:
+        service: Service name or HTTP host name
+    """
+    semaphore = get_service_semaphore(service)
+    if semaphore is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    semaphore.acquire()
+    waited = time.perf_counter() - start
+    if waited > 1.0:
+        logger.debug(f"Waited {waited:.1f}s for a {service} slot")
+    try:
+        yield
+    finally:
+        semaphore.release()
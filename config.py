@@ -36,7 +36,70 @@ OSM_API_KEY = os.getenv("OSM_API_KEY", "")  # Optional commercial geocoding API
 # Mapping Configuration
 ENABLE_GEOCODING = True  # Flag to enable/disable geocoding functionality
 GEOCODE_CACHE_EXPIRY = 30  # Cache geocoding results for 30 days
+GEOCODE_NEGATIVE_CACHE_EXPIRY = 2  # Cache failed geocoding attempts for 2 days before retrying
+GEOCODE_CACHE_LRU_SIZE = 2048  # Geocoding results also kept in memory per process
+GEOCODE_MAX_WORKERS = 4  # Concurrent lookups in batch geocoding (per-host rate limits still apply)
+REVERSE_GEOCODE_CELL_PRECISION = 7  # Geohash precision of reverse geocoding cache cells (7 = about 150 m)
+REVERSE_GEOCODE_MAX_DISTANCE_METERS = 75  # Reuse a cached reverse lookup made this close to the requested point
+REVERSE_GEOCODE_CELL_ENTRIES = 16  # Cached reverse lookups kept per cell
 MAP_PROVIDER = "openstreetmap"  # Options: "openstreetmap", "google", "mapbox"
+ZIP_GAZETTEER_DB = BASE_DIR / "data" / "zip_gazetteer.db"  # Offline ZIP centroids, built with: python zip_gazetteer.py US.txt
+GEOCODER_BACKEND = "nominatim"  # Options: "nominatim", "self_hosted", "gazetteer", "fixture"
+NOMINATIM_URL = "https://nominatim.openstreetmap.org"  # Public Nominatim service
+SELF_HOSTED_NOMINATIM_URL = os.getenv("NOMINATIM_URL", "http://localhost:8080")  # Used by the "self_hosted" backend
+GEOCODER_FIXTURE_URL = "http://127.0.0.1:8765"  # Local stand-in (python fixture_server.py) used by the "fixture" backend
+MAP_RENDERER = "tiles"  # Options: "tiles" (compose from cached tiles locally), "staticmap" (STATIC_MAP_URL service)
+STATIC_MAP_URL = "https://staticmap.openstreetmap.de/staticmap.php"  # Static map service used by the "staticmap" renderer
+MAP_TILE_URL = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"  # Slippy-map tile server used by the "tiles" renderer
+MAP_TILE_CACHE_DIR = BASE_DIR / "data" / "tile_cache"  # Downloaded tiles, reused across runs
+MAP_TILE_CACHE_MAX_MB = 512  # Least recently used tiles are evicted above this size
+MAP_TILE_DIR = os.getenv("MAP_TILE_DIR")  # Optional local {z}/{x}/{y}.png tile directory, checked before the cache
+MAP_TILES_OFFLINE = False  # Never download tiles; a map with tiles missing offline is not rendered (MissingTilesError)
+MAP_CACHE_DIR = BASE_DIR / "data" / "map_cache"  # Rendered maps, keyed on coordinates, zoom, size and markers
+MAP_CACHE_MAX_MB = 256  # Least recently used map images are evicted above this size
+MAP_CACHE_COORD_DECIMALS = 5  # Coordinates are rounded to this many decimals (about 1 m) for map cache keys
+MAP_GENERATION_MODE = "inline"  # Options: "inline" (render before results are saved), "background" (render after saving, then rewrite the results)
+MAP_BACKGROUND_WORKERS = 2  # Threads rendering maps in "background" mode
+
+# Outbound Rate Limits (minimum seconds between requests per host, shared by all workers)
+RATE_LIMITS = {
+    "nominatim.openstreetmap.org": 1.0,  # Nominatim usage policy: at most 1 request per second
+    "staticmap.openstreetmap.de": 1.0,
+    "tile.openstreetmap.org": 0.1,  # OSM tile usage policy: no heavy bulk downloading
+}
+RATE_LIMIT_DEFAULT_INTERVAL = 0.0  # Hosts not listed above are not rate limited
+RATE_LIMIT_DB = BASE_DIR / "data" / "rate_limits.db"  # Slot reservations shared between processes
+
+# Outbound HTTP (geocoding and static map services)
+HTTP_CONNECT_TIMEOUT = 5  # Seconds to wait for a connection
+HTTP_READ_TIMEOUT = 20  # Seconds to wait for response data
+HTTP_MAX_RETRIES = 2  # Retries for connection errors, timeouts, 429 and 5xx responses
+HTTP_BACKOFF_BASE = 0.5  # Seconds; retry backoff doubles each attempt, with random jitter
+HTTP_BACKOFF_MAX = 8  # Longest single backoff in seconds
+HTTP_POOL_SIZE = 10  # Keep-alive connections per host
+HTTP_CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive failures before requests to a host fail fast
+HTTP_CIRCUIT_RESET_TIMEOUT = 60  # Seconds before a failing host is tried again
+
+# Concurrent Order Processing
+ORDER_WORKERS = 1  # Orders processed at once by main.py (override with --workers)
+SERVICE_CONCURRENCY = {  # Requests in flight per external service, shared by all order workers
+    "documentai": 4,  # Document AI OCR
+    "llm": 4,  # OpenAI chat completions
+    "nominatim.openstreetmap.org": 1,  # Nominatim usage policy: no parallel requests
+    "tile.openstreetmap.org": 2,  # OSM tile usage policy: at most 2 connections
+}
+
+# Provider Search Configuration
+PROVIDER_SEARCH_MODE = "kdtree"  # Options: "kdtree", "numpy", "rtree", "sharded", "scan"
+PROVIDER_RTREE_INITIAL_RADIUS_MILES = 25  # First search radius tried by the "rtree" and "sharded" search modes
+PROVIDER_SHARD_PRECISION = 3  # Geohash precision of "sharded" index cells (3 = roughly 100-mile cells)
+PROVIDER_SHARD_MAX_RADIUS_MILES = 200  # "sharded" searches that must reach further use the R*Tree search instead
+PROVIDER_SHARD_CACHE_SIZE = 256  # Shards kept in memory by the "sharded" search mode (least recently used dropped)
+PROVIDER_DB_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of the provider database to memory-map
+PROVIDER_DB_CACHED_STATEMENTS = 256  # Prepared statements cached per connection
+PROVIDER_SNAPSHOT_ENABLED = True  # Load providers from a compiled, memory-mapped snapshot next to the database
+PROVIDER_SNAPSHOT_CHECK_INTERVAL = 60  # Seconds between checks that the snapshot still matches the database
+PROVIDER_BULK_CHUNK_SIZE = 64  # Patients per distance block in bulk provider matching
 
 # LLM Settings
 OPENAI_MODEL = "gpt-3.5-turbo"
@@ -45,6 +108,7 @@ MAX_TOKENS = 4000
 # Document Processing
 SUPPORTED_EXTENSIONS = [".pdf", ".docx", ".doc", ".jpg", ".jpeg", ".png", ".eml", ".txt"]
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
+OCR_MAX_WORKERS = 4  # Documents of one order OCR'd at once (Document AI calls across all orders are capped by SERVICE_CONCURRENCY)
 
 # System prompt for the LLM with enhanced HCFA-like line item extraction
 SYSTEM_PROMPT = """
@@ -0,0 +1,183 @@
+"""
+Vectorized haversine distances between patients and providers using NumPy.
+
+Provider coordinates are held as radian arrays so a single pass computes the
+distance from one patient, or from many patients at once, to every provider.
+Results match provider_mapping_simple.calculate_distance, which stays the
+scalar reference implementation.
+"""
+import numpy as np
+
+from referrals.provider_rtree import EARTH_RADIUS_MILES
+
+def haversine_miles(lat1_rad, lon1_rad, lat2_rad, lon2_rad, cos_lat1=None, cos_lat2=None):
+    """
+    Haversine distance in miles between broadcastable arrays of radian coordinates.
+
+    Args:
+        lat1_rad: Latitudes of the first points in radians
+        lon1_rad: Longitudes of the first points in radians
+        lat2_rad: Latitudes of the second points in radians
+        lon2_rad: Longitudes of the second points in radians
+        cos_lat1: Optional precomputed cos(lat1_rad)
+        cos_lat2: Optional precomputed cos(lat2_rad)
+
+    Returns:
+        Array of distances in miles
+    """
+    if cos_lat1 is None:
+        cos_lat1 = np.cos(lat1_rad)
+    if cos_lat2 is None:
+        cos_lat2 = np.cos(lat2_rad)
+
+    dlat = lat2_rad - lat1_rad
+    dlon = lon2_rad - lon1_rad
+    a = np.sin(dlat / 2) ** 2 + cos_lat1 * cos_lat2 * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_MILES * c
+
+def _sorted_top_k(distances, k):
+    """Indices of the k smallest distances along the last axis, closest first."""
+    n = distances.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(distances.shape[:-1] + (0,), dtype=np.intp)
+    if k < n:
+        candidates = np.argpartition(distances, k - 1, axis=-1)[..., :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), distances.shape).copy()
+
+    candidate_distances = np.take_along_axis(distances, candidates, axis=-1)
+    # Order by distance, then by provider position so ties are deterministic
+    order = np.lexsort((candidates, candidate_distances), axis=-1)
+    return np.take_along_axis(candidates, order, axis=-1)
+
+class DistanceEngine:
+    """Batch distance calculator over a fixed set of provider coordinates."""
+
+    def __init__(self, latitudes, longitudes):
+        """
+        Build the engine.
+
+        Args:
+            latitudes: Provider latitudes in degrees
+            longitudes: Provider longitudes in degrees
+        """
+        self.lat_rad = np.radians(np.asarray(latitudes, dtype=np.float64))
+        self.lon_rad = np.radians(np.asarray(longitudes, dtype=np.float64))
+        self.cos_lat = np.cos(self.lat_rad)
+
+    @classmethod
+    def from_providers(cls, providers):
+        """Build an engine from provider dictionaries with numeric 'lat'/'lon'."""
+        return cls([p['lat'] for p in providers], [p['lon'] for p in providers])
+
+    @classmethod
+    def from_radians(cls, lat_rad, lon_rad, cos_lat=None):
+        """
+        Build an engine over existing radian arrays without copying them.
+
+        Args:
+            lat_rad: Provider latitudes in radians (e.g. a memory-mapped array)
+            lon_rad: Provider longitudes in radians
+            cos_lat: Optional precomputed cos(lat_rad)
+
+        Returns:
+            DistanceEngine sharing the given arrays
+        """
+        engine = cls.__new__(cls)
+        engine.lat_rad = lat_rad
+        engine.lon_rad = lon_rad
+        engine.cos_lat = np.cos(lat_rad) if cos_lat is None else cos_lat
+        return engine
+
+    def __len__(self):
+        return len(self.lat_rad)
+
+    def distances_from(self, latitude, longitude):
+        """
+        Distances from one location to every provider.
+
+        Args:
+            latitude: Patient latitude in degrees
+            longitude: Patient longitude in degrees
+
+        Returns:
+            1-D array of distances in miles, one per provider
+        """
+        lat_rad = np.radians(latitude)
+        return haversine_miles(lat_rad, np.radians(longitude), self.lat_rad, self.lon_rad,
+                               cos_lat1=np.cos(lat_rad), cos_lat2=self.cos_lat)
+
+    def distance_matrix(self, latitudes, longitudes):
+        """
+        Distances from many locations to every provider.
+
+        Args:
+            latitudes: Patient latitudes in degrees
+            longitudes: Patient longitudes in degrees
+
+        Returns:
+            2-D array of shape (patients, providers) in miles
+        """
+        lat_rad = np.radians(np.asarray(latitudes, dtype=np.float64))[:, np.newaxis]
+        lon_rad = np.radians(np.asarray(longitudes, dtype=np.float64))[:, np.newaxis]
+        return haversine_miles(lat_rad, lon_rad, self.lat_rad, self.lon_rad,
+                               cos_lat1=np.cos(lat_rad), cos_lat2=self.cos_lat)
+
+    def nearest(self, latitude, longitude, k=3, mask=None, max_distance=None):
+        """
+        The k providers closest to one location.
+
+        Args:
+            latitude: Patient latitude in degrees
+            longitude: Patient longitude in degrees
+            k: Number of providers to return
+            mask: Optional boolean array; providers where it is False are excluded
+            max_distance: Optional maximum distance in miles
+
+        Returns:
+            Tuple (indices, distances) ordered closest first
+        """
+        distances = self.distances_from(latitude, longitude)
+        if mask is not None or max_distance is not None:
+            excluded = np.zeros(len(distances), dtype=bool)
+            if mask is not None:
+                excluded |= ~np.asarray(mask, dtype=bool)
+            if max_distance is not None:
+                excluded |= distances > max_distance
+            distances = np.where(excluded, np.inf, distances)
+
+        indices = _sorted_top_k(distances, k)
+        indices = indices[np.isfinite(distances[indices])]
+        return indices, distances[indices]
+
+    def nearest_many(self, latitudes, longitudes, k=3, chunk_size=None):
+        """
+        The k providers closest to each of many locations.
+
+        Args:
+            latitudes: Patient latitudes in degrees
+            longitudes: Patient longitudes in degrees
+            k: Number of providers to return per patient
+            chunk_size: Optional number of patients per distance block; bounds
+                memory to chunk_size x providers distances at a time
+
+        Returns:
+            Tuple (indices, distances), each of shape (patients, k), closest first
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        count = len(latitudes)
+        chunk_size = chunk_size or count or 1
+
+        k = min(k, len(self))
+        indices = np.empty((count, k), dtype=np.intp)
+        distances = np.empty((count, k), dtype=np.float64)
+        for start in range(0, count, chunk_size):
+            end = min(start + chunk_size, count)
+            block = self.distance_matrix(latitudes[start:end], longitudes[start:end])
+            block_indices = _sorted_top_k(block, k)
+            indices[start:end] = block_indices
+            distances[start:end] = np.take_along_axis(block, block_indices, axis=-1)
+        return indices, distances
@@ -3,8 +3,10 @@ Document extraction functions using Google Document AI for OCR.
 """
 import os
 import logging
+import threading
 from pathlib import Path
 from google.cloud import documentai
+from referrals.concurrency import service_slot
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -19,6 +21,7 @@ CREDENTIALS_PATH = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\Document
 # Initialize Document AI Client
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = CREDENTIALS_PATH
 documentai_client = None
+_documentai_lock = threading.Lock()
 
 def initialize_documentai():
     """Initialize the Document AI client."""
@@ -30,6 +33,18 @@ def initialize_documentai():
         logger.error(f"Failed to initialize Document AI client: {str(e)}")
         raise
 
+def get_documentai_client():
+    """
+    Get the shared Document AI client, initializing it on first use.
+    
+    The client is thread-safe, so concurrent OCR requests share one client
+    and its connection.
+    """
+    with _documentai_lock:
+        if documentai_client is None:
+            initialize_documentai()
+        return documentai_client
+
 def extract_text_from_pdf(file_path):
     """
     Extract text from PDF using Google Document AI.
@@ -40,9 +55,7 @@ def extract_text_from_pdf(file_path):
     Returns:
         Extracted text as string
     """
-    global documentai_client
-    if documentai_client is None:
-        initialize_documentai()
+    client = get_documentai_client()
         
     try:
         logger.info(f"Processing PDF with Document AI: {file_path}")
@@ -60,8 +73,9 @@ def extract_text_from_pdf(file_path):
         # Create OCR request
         request = documentai.ProcessRequest(name=processor_name, raw_document=raw_document)
         
-        # Process document
-        result = documentai_client.process_document(request=request)
+        # Process document (limited to config.SERVICE_CONCURRENCY["documentai"] at once)
+        with service_slot("documentai"):
+            result = client.process_document(request=request)
         
         # Extract text from result
         return result.document.text
@@ -138,6 +152,7 @@ def extract_text_from_txt(file_path):
 def extract_text_from_image(file_path):
     """Extract text from images using Google Document AI."""
     try:
+        client = get_documentai_client()
         logger.info(f"Processing image with Document AI: {file_path}")
         
         # Determine the mime type based on file extension
@@ -163,8 +178,9 @@ def extract_text_from_image(file_path):
         # Create OCR request
         request = documentai.ProcessRequest(name=processor_name, raw_document=raw_document)
         
-        # Process document
-        result = documentai_client.process_document(request=request)
+        # Process document (limited to config.SERVICE_CONCURRENCY["documentai"] at once)
+        with service_slot("documentai"):
+            result = client.process_document(request=request)
         
         # Extract text from result
         return result.document.text
@@ -0,0 +1,210 @@
+"""
+Local stand-in for the Nominatim and static map services.
+
+Serves Nominatim-compatible /search and /reverse endpoints from a fixtures
+file, a /staticmap.php endpoint returning a blank PNG of the requested size
+and plain /tiles/{z}/{x}/{y}.png map tiles, so the geocoding and mapping
+stages can be load-tested and benchmarked without touching a public service:
+
+    python fixture_server.py --fixtures fixtures.json --port 8765 --latency 0.05
+
+Fixtures are a JSON list of {"query", "lat", "lon", "display_name", "address"}
+objects, matched on the canonical form of the query. With --synthesize,
+unknown queries get deterministic made-up coordinates inside the continental
+US instead of an empty result.
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+from referrals.address_normalizer import canonicalize_address
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Continental US bounding box used for synthesized coordinates
+SYNTHETIC_BOUNDS = (25.0, 49.0, -124.0, -67.0)
+
+def load_fixtures(path):
+    """
+    Load fixtures keyed by the canonical form of their query.
+
+    Args:
+        path: JSON file with a list of fixture objects
+
+    Returns:
+        Dictionary of canonical query to Nominatim-style result
+    """
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    fixtures = {}
+    for entry in entries:
+        fixtures[canonicalize_address(entry["query"])] = {
+            "lat": str(entry["lat"]),
+            "lon": str(entry["lon"]),
+            "display_name": entry.get("display_name", entry["query"]),
+            "address": entry.get("address", {}),
+            "importance": entry.get("importance", 0.5)
+        }
+    return fixtures
+
+def synthesize_result(query):
+    """Deterministic made-up Nominatim result for a query."""
+    digest = hashlib.md5(canonicalize_address(query).encode()).digest()
+    min_lat, max_lat, min_lon, max_lon = SYNTHETIC_BOUNDS
+    lat = min_lat + (max_lat - min_lat) * int.from_bytes(digest[:4], "big") / 2 ** 32
+    lon = min_lon + (max_lon - min_lon) * int.from_bytes(digest[4:8], "big") / 2 ** 32
+    return {
+        "lat": f"{lat:.7f}",
+        "lon": f"{lon:.7f}",
+        "display_name": query,
+        "address": {"country": "United States", "country_code": "us"},
+        "importance": 0.1
+    }
+
+class FixtureServer:
+    """Threaded HTTP server answering geocoding and static map requests from fixtures."""
+
+    def __init__(self, fixtures=None, host="127.0.0.1", port=0, latency=0.0, synthesize=False):
+        """
+        Set up the server (call start() or serve_forever() to run it).
+
+        Args:
+            fixtures: Dictionary from load_fixtures (or None for no fixtures)
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free port)
+            latency: Seconds to delay every response, to mimic a remote service
+            synthesize: Answer unknown queries with made-up coordinates
+        """
+        self.fixtures = fixtures or {}
+        self.latency = latency
+        self.synthesize = synthesize
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, value):
+                self._send(200, json.dumps(value).encode("utf-8"), "application/json")
+
+            def do_GET(self):
+                with server._count_lock:
+                    server.request_count += 1
+                if server.latency:
+                    time.sleep(server.latency)
+
+                parsed = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                if parsed.path == "/search":
+                    self._send_json(server.search(params))
+                elif parsed.path == "/reverse":
+                    self._send_json(server.reverse(params))
+                elif parsed.path == "/staticmap.php":
+                    self._send(200, server.static_map(params), "image/png")
+                elif parsed.path.startswith("/tiles/"):
+                    self._send(200, server.tile(parsed.path), "image/png")
+                else:
+                    self._send(404, b"not found", "text/plain")
+
+        return Handler
+
+    def search(self, params):
+        """Nominatim /search response for free-form (q) or structured parameters."""
+        query = params.get("q") or ", ".join(
+            params[key] for key in ("street", "city", "state", "postalcode") if params.get(key))
+        result = self.fixtures.get(canonicalize_address(query))
+        if result is None and self.synthesize and query:
+            result = synthesize_result(query)
+        return [result] if result else []
+
+    def reverse(self, params):
+        """Nominatim /reverse response; the nearest fixture, or a synthesized place."""
+        try:
+            lat, lon = float(params["lat"]), float(params["lon"])
+        except (KeyError, ValueError):
+            return {"error": "Unable to geocode"}
+        if self.fixtures:
+            nearest = min(self.fixtures.values(),
+                          key=lambda r: (float(r["lat"]) - lat) ** 2 + (float(r["lon"]) - lon) ** 2)
+            return nearest
+        if self.synthesize:
+            return {"lat": str(lat), "lon": str(lon), "display_name": f"{lat:.5f}, {lon:.5f}",
+                    "address": {"country": "United States", "country_code": "us"}}
+        return {"error": "Unable to geocode"}
+
+    def static_map(self, params):
+        """Blank PNG of the requested "WxH" size."""
+        try:
+            width, height = (int(v) for v in params.get("size", "600x400").split("x"))
+        except ValueError:
+            width, height = 600, 400
+        buffer = io.BytesIO()
+        Image.new("RGB", (width, height), (229, 227, 223)).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def tile(self, path):
+        """256x256 PNG tile for /tiles/{z}/{x}/{y}.png, shaded by its coordinates."""
+        try:
+            z, x, y = (int(part) for part in path[len("/tiles/"):].rsplit(".", 1)[0].split("/"))
+        except ValueError:
+            z, x, y = 0, 0, 0
+        shade = (x * 37 + y * 91 + z * 13) % 40
+        buffer = io.BytesIO()
+        Image.new("RGB", (256, 256), (215 + shade // 2, 225, 215 + shade)).save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def start(self):
+        """Serve in a background thread and return the base URL."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Fixture server listening on {self.url}")
+        return self.url
+
+    def serve_forever(self):
+        logger.info(f"Fixture server listening on {self.url}")
+        self._httpd.serve_forever()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Nominatim/static map stand-in")
+    parser.add_argument("--fixtures", help="JSON fixtures file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--synthesize", action="store_true", help="Make up coordinates for unknown queries")
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else {}
+    FixtureServer(fixtures, args.host, args.port, args.latency, args.synthesize).serve_forever()
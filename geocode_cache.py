@@ -0,0 +1,207 @@
+"""
+SQLite-backed geocoding cache with per-entry expiry and an in-process LRU tier.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+CACHE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_geocode_cache_expires ON geocode_cache (expires_at)",
+    """
+    CREATE TABLE IF NOT EXISTS cache_meta (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """,
+]
+
+class GeocodeCache:
+    """
+    Geocoding results keyed by string, stored in one SQLite file.
+
+    Entries expire after a TTL. Recent hits are also held in a bounded LRU so
+    repeated lookups skip SQLite entirely. The database runs in WAL mode with
+    a busy timeout, so several worker processes can read and write it at once.
+    """
+
+    def __init__(self, db_path, ttl_days=30, lru_size=2048, busy_timeout=30):
+        """
+        Open (and create if needed) the cache database.
+
+        Args:
+            db_path: Path to the SQLite cache file
+            ttl_days: Default lifetime of an entry in days
+            lru_size: Maximum number of entries kept in memory
+            busy_timeout: Seconds to wait for another process's write lock
+        """
+        self.db_path = Path(db_path)
+        self.ttl = ttl_days * SECONDS_PER_DAY
+        self.lru_size = lru_size
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lru = OrderedDict()
+        self._lru_lock = threading.Lock()
+
+        conn = self._connection()
+        with conn:
+            for statement in CACHE_SCHEMA:
+                conn.execute(statement)
+
+    def _connection(self):
+        """Get the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=self.busy_timeout, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key, value, expires_at):
+        with self._lru_lock:
+            self._lru[key] = (value, expires_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _forget(self, key):
+        with self._lru_lock:
+            self._lru.pop(key, None)
+
+    def get(self, key):
+        """
+        Look up an unexpired entry.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached value, or None if missing or expired
+        """
+        now = time.time()
+        with self._lru_lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._lru.move_to_end(key)
+                    return entry[0]
+                del self._lru[key]
+
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM geocode_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Error reading geocode cache: {str(e)}")
+            return None
+
+        if row is None:
+            return None
+        value = json.loads(row[0])
+        self._remember(key, value, row[1])
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store an entry, replacing any existing one.
+
+        Args:
+            key: Cache key
+            value: JSON-serializable value
+            ttl: Optional lifetime in seconds (defaults to the cache TTL)
+        """
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO geocode_cache (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, expires_at)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Error writing geocode cache: {str(e)}")
+            return
+        self._remember(key, value, expires_at)
+
+    def delete(self, key):
+        """Remove an entry."""
+        self._forget(key)
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM geocode_cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logger.error(f"Error deleting from geocode cache: {str(e)}")
+
+    def purge_expired(self):
+        """
+        Delete expired entries from the database.
+
+        Returns:
+            Number of entries removed
+        """
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute("DELETE FROM geocode_cache WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    def import_json_dir(self, cache_dir):
+        """
+        Import a legacy one-JSON-file-per-entry cache directory, once.
+
+        Each file's stem becomes its key and its modification time its creation
+        time, so entries keep their original age. Already-expired files are
+        skipped, and existing keys are never overwritten.
+
+        Args:
+            cache_dir: Directory of legacy *.json cache files
+
+        Returns:
+            Number of entries imported (0 if the import already ran)
+        """
+        conn = self._connection()
+        if conn.execute("SELECT 1 FROM cache_meta WHERE name = 'json_import_done'").fetchone():
+            return 0
+
+        now = time.time()
+        rows = []
+        for path in Path(cache_dir).glob("*.json"):
+            try:
+                created_at = path.stat().st_mtime
+                if created_at + self.ttl <= now:
+                    continue
+                with open(path, 'r') as f:
+                    value = json.load(f)
+                rows.append((path.stem, json.dumps(value), created_at, created_at + self.ttl))
+            except Exception as e:
+                logger.warning(f"Skipping unreadable geocode cache file {path}: {str(e)}")
+
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO geocode_cache (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            conn.execute("INSERT OR REPLACE INTO cache_meta (name, value) VALUES ('json_import_done', ?)", (str(now),))
+
+        logger.info(f"Imported {len(rows)} legacy geocode cache files from {cache_dir}")
+        return len(rows)
@@ -0,0 +1,256 @@
+"""
+Geocoder backends behind geocode_address, geocode_zipcode and reverse_geocode.
+
+Every backend returns results in the same shape, so the geocoding client's
+caching, fallbacks and batching work unchanged whichever service answers:
+
+- "nominatim": the public OpenStreetMap Nominatim service (rate limited)
+- "self_hosted": a Nominatim instance at config.SELF_HOSTED_NOMINATIM_URL
+- "gazetteer": the offline ZIP centroid gazetteer, ZIP-level precision only
+- "fixture": the local stand-in server in fixture_server.py, for load tests
+  and benchmarks that must not touch a public service
+"""
+import logging
+import re
+import threading
+from abc import ABC, abstractmethod
+
+from referrals import config
+from referrals.http_client import http_get
+from referrals.zip_gazetteer import centroid_result, get_gazetteer
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+NOMINATIM_HEADERS = {
+    "User-Agent": "WorkersCompProcessor/1.0",  # Required by Nominatim
+    "Accept": "application/json"
+}
+
+ZIPPOPOTAM_URL = "https://api.zippopotam.us/us/{zipcode}"
+
+# Last ZIP (or ZIP+4) in an address, not counting a leading house number
+_TRAILING_ZIP = re.compile(r'(?<=\D)(\d{5})(?:-\d{4})?(?!.*\d{5})')
+
+class GeocoderBackend(ABC):
+    """
+    Interface implemented by every geocoder backend.
+
+    Results are dictionaries with latitude, longitude, display_name,
+    address_components and importance, or None when nothing was found.
+    Network and service errors are raised, so callers can tell "not found"
+    (which is cached) from "could not ask" (which is not).
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def search(self, query, api_key=None):
+        """
+        Geocode a free-form address.
+
+        Args:
+            query: Address string
+            api_key: Optional API key for commercial services
+
+        Returns:
+            Result dictionary or None if not found
+        """
+
+    def search_structured(self, street=None, city=None, state=None, postalcode=None, api_key=None):
+        """
+        Geocode an address already split into components.
+
+        Args:
+            street: House number and street (without unit)
+            city: City name
+            state: State name or code
+            postalcode: 5-digit ZIP code
+            api_key: Optional API key for commercial services
+
+        Returns:
+            Result dictionary or None if not found
+        """
+        query = ", ".join(part for part in (street, city, f"{state or ''} {postalcode or ''}".strip()) if part)
+        return self.search(query, api_key)
+
+    def search_postcode(self, zipcode, api_key=None):
+        """Geocode a bare 5-digit US ZIP code."""
+        return self.search(f"{zipcode}, USA", api_key)
+
+    @abstractmethod
+    def reverse(self, lat, lon, api_key=None):
+        """
+        Convert coordinates to an address.
+
+        Args:
+            lat: Latitude
+            lon: Longitude
+            api_key: Optional API key for commercial services
+
+        Returns:
+            Result dictionary or None if not found
+        """
+
+class NominatimBackend(GeocoderBackend):
+    """Nominatim search/reverse API at a configurable base URL."""
+
+    def __init__(self, base_url, name="nominatim", use_zippopotam=False):
+        """
+        Set up the backend.
+
+        Args:
+            base_url: Nominatim base URL (without /search)
+            name: Backend name used in logs and cached failure records
+            use_zippopotam: Resolve bare ZIP codes through zippopotam.us first,
+                which finds the ZIP's city more reliably than the public
+                Nominatim's postcode search
+        """
+        self.base_url = base_url.rstrip("/")
+        self.name = name
+        self.use_zippopotam = use_zippopotam
+
+    def _search(self, params, api_key=None):
+        params = dict(params, format="json", limit=1, addressdetails=1)
+        if api_key:
+            params["key"] = api_key
+        response = http_get(f"{self.base_url}/search", params=params, headers=NOMINATIM_HEADERS)
+        response.raise_for_status()
+        results = response.json()
+        if not results:
+            return None
+        # Get the first (best) result
+        result = results[0]
+        return {
+            "latitude": float(result["lat"]),
+            "longitude": float(result["lon"]),
+            "display_name": result["display_name"],
+            "address_components": result.get("address", {}),
+            "importance": result.get("importance", 0)
+        }
+
+    def search(self, query, api_key=None):
+        return self._search({"q": query}, api_key)
+
+    def search_structured(self, street=None, city=None, state=None, postalcode=None, api_key=None):
+        params = {"street": street, "city": city, "state": state, "postalcode": postalcode}
+        params = {key: value for key, value in params.items() if value}
+        return self._search(dict(params, countrycodes="us"), api_key)
+
+    def search_postcode(self, zipcode, api_key=None):
+        if not self.use_zippopotam:
+            return self._search({"postalcode": zipcode, "countrycodes": "us"}, api_key)
+
+        response = http_get(ZIPPOPOTAM_URL.format(zipcode=zipcode))
+        response.raise_for_status()
+        data = response.json()
+        if not data.get('places'):
+            logger.warning(f"No location found for zip code: {zipcode}")
+            return None
+
+        # Get the first place (usually the main city for the zip code), then its coordinates
+        place = data['places'][0]
+        result = self.search(f"{place['place name']}, {place['state']}, {zipcode}, USA", api_key)
+        if not result:
+            return None
+        result["address_components"] = {
+            "city": place['place name'],
+            "state": place['state'],
+            "postcode": zipcode,
+            "country": "USA"
+        }
+        return result
+
+    def reverse(self, lat, lon, api_key=None):
+        params = {
+            "lat": lat,
+            "lon": lon,
+            "format": "json",
+            "addressdetails": 1
+        }
+        if api_key:
+            params["key"] = api_key
+        response = http_get(f"{self.base_url}/reverse", params=params, headers=NOMINATIM_HEADERS)
+        response.raise_for_status()
+        result = response.json()
+        if "error" in result:
+            logger.warning(f"Error in reverse geocoding response: {result['error']}")
+            return None
+        return {
+            "latitude": float(result["lat"]),
+            "longitude": float(result["lon"]),
+            "display_name": result["display_name"],
+            "address_components": result.get("address", {}),
+            "importance": result.get("importance", 0)
+        }
+
+class GazetteerBackend(GeocoderBackend):
+    """Offline backend answering every address with its ZIP code centroid."""
+
+    name = "gazetteer"
+
+    def _result(self, zipcode, centroid):
+        return dict(centroid_result(zipcode, centroid), importance=0)
+
+    def search(self, query, api_key=None):
+        match = _TRAILING_ZIP.search(query or "")
+        return self.search_postcode(match.group(1)) if match else None
+
+    def search_structured(self, street=None, city=None, state=None, postalcode=None, api_key=None):
+        return self.search_postcode(postalcode) if postalcode else None
+
+    def search_postcode(self, zipcode, api_key=None):
+        gazetteer = get_gazetteer()
+        centroid = gazetteer.lookup(zipcode) if gazetteer else None
+        return self._result(zipcode, centroid) if centroid else None
+
+    def reverse(self, lat, lon, api_key=None):
+        gazetteer = get_gazetteer()
+        nearest = gazetteer.nearest(lat, lon) if gazetteer else None
+        if not nearest:
+            return None
+        zipcode, centroid = nearest
+        return self._result(zipcode, centroid)
+
+def create_backend(name):
+    """
+    Create a geocoder backend by name.
+
+    Args:
+        name: "nominatim", "self_hosted", "gazetteer" or "fixture"
+
+    Returns:
+        GeocoderBackend instance
+    """
+    if name == "nominatim":
+        return NominatimBackend(config.NOMINATIM_URL, name="nominatim", use_zippopotam=True)
+    if name == "self_hosted":
+        return NominatimBackend(config.SELF_HOSTED_NOMINATIM_URL, name="self_hosted")
+    if name == "gazetteer":
+        return GazetteerBackend()
+    if name == "fixture":
+        return NominatimBackend(config.GEOCODER_FIXTURE_URL, name="fixture")
+    raise ValueError(f"Unknown geocoder backend: {name}")
+
+# Backends created so far, by name
+_backends = {}
+_backends_lock = threading.Lock()
+
+def get_geocoder_backend(name=None):
+    """
+    Get a geocoder backend, created on first use.
+
+    Args:
+        name: Backend name (defaults to config.GEOCODER_BACKEND)
+
+    Returns:
+        GeocoderBackend instance shared by every caller in this process
+    """
+    name = name or config.GEOCODER_BACKEND
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            backend = _backends[name] = create_backend(name)
+            logger.info(f"Using geocoder backend: {name}")
+        return backend
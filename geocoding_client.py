@@ -1,27 +1,118 @@
 """
-Client for geocoding addresses using OpenStreetMap Nominatim API.
+Client for geocoding addresses, by default with the OpenStreetMap Nominatim API.
+
+The service that answers is chosen by config.GEOCODER_BACKEND (see geocoder_backends).
 """
+import hashlib
 import logging
-import requests
-import time
-import json
+import math
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from referrals import config
+from referrals import config, geohash
+from referrals.address_normalizer import address_cache_key, is_unit_identifier, parse_address
+from referrals.geocode_cache import GeocodeCache
+from referrals.geocoder_backends import get_geocoder_backend
+from referrals.zip_gazetteer import centroid_result, lookup_zip
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Mean Earth radius, for distances between nearby reverse geocoding lookups
+EARTH_RADIUS_METERS = 6371000
+
 # Cache directory for geocoding results
 GEOCODE_CACHE_DIR = Path(config.BASE_DIR) / "data" / "geocode_cache"
 os.makedirs(GEOCODE_CACHE_DIR, exist_ok=True)
 
+# Single SQLite cache shared by all geocoding lookups, opened on first use
+GEOCODE_CACHE_DB = GEOCODE_CACHE_DIR / "geocode_cache.db"
+_geocode_cache = None
+_geocode_cache_lock = threading.Lock()
+
+def get_geocode_cache():
+    """
+    Get the process-wide geocoding cache, importing legacy JSON cache files on first use.
+    
+    Returns:
+        GeocodeCache backed by GEOCODE_CACHE_DB
+    """
+    global _geocode_cache
+    with _geocode_cache_lock:
+        if _geocode_cache is None:
+            cache = GeocodeCache(
+                GEOCODE_CACHE_DB,
+                ttl_days=config.GEOCODE_CACHE_EXPIRY,
+                lru_size=config.GEOCODE_CACHE_LRU_SIZE
+            )
+            try:
+                cache.import_json_dir(GEOCODE_CACHE_DIR)
+            except Exception as e:
+                logger.error(f"Error importing legacy geocode cache files: {str(e)}")
+            _geocode_cache = cache
+        return _geocode_cache
+
+def cache_failure(cache, cache_key, query, stages_tried):
+    """
+    Remember that geocoding a query failed, so repeats fail fast until the entry expires.
+    
+    Args:
+        cache: GeocodeCache to write to
+        cache_key: Cache key of the query
+        query: Address or zip code that could not be geocoded
+        stages_tried: Names of the lookup stages that were attempted
+    """
+    cache.set(cache_key, {
+        "geocode_failed": True,
+        "query": query,
+        "stages_tried": stages_tried,
+        "failed_at": time.time()
+    }, ttl=config.GEOCODE_NEGATIVE_CACHE_EXPIRY * 24 * 60 * 60)
+
+def is_cached_failure(cached):
+    """Whether a cache entry records a failed geocoding attempt rather than a result."""
+    return isinstance(cached, dict) and cached.get("geocode_failed", False)
+
+# Common state misspellings and informal abbreviations
+STATE_CORRECTIONS = {
+    "Flaz": "FL",
+    "Fla": "FL",
+    "Flor": "FL",
+    "Flo": "FL",
+    "Flaordia": "FL",
+    "Fla.": "FL",
+    "Cali": "CA",
+    "Cal": "CA",
+    "Calif": "CA",
+    "Calif.": "CA",
+    "Calf": "CA",
+    "Illi": "IL",
+    "Il": "IL",
+    "Ill": "IL",
+    "Ill.": "IL",
+    # Add more as needed
+}
+
+# Whole-word patterns, so "Community" or "Unity" are never touched
+STATE_CORRECTION_PATTERN = re.compile(
+    r"(?<![\w.])(" + "|".join(re.escape(k) for k in sorted(STATE_CORRECTIONS, key=len, reverse=True)) + r")(?![\w.])"
+)
+UNIT_PATTERN = re.compile(
+    r"\s*(?:\b(?:Suite|Ste|Apartment|Apt|Unit)\b\.?\s*#?|#)\s*(?P<unit>[A-Za-z0-9][A-Za-z0-9\-]*)?",
+    re.IGNORECASE
+)
+
 def preprocess_address(address):
     """
     Preprocess address to improve geocoding success rate.
     
+    Fixes common state misspellings, drops apostrophes and removes
+    apartment/suite/unit designators together with their numbers.
+    
     Args:
         address: The address to preprocess
         
@@ -31,60 +122,42 @@ def preprocess_address(address):
     if not address:
         return address
         
-    # Dictionary of common state abbreviation corrections
-    state_corrections = {
-        "Flaz": "FL",
-        "Fla": "FL",
-        "Flor": "FL",
-        "Flo": "FL",
-        "Flaordia": "FL",
-        "Fla.": "FL",
-        "Cali": "CA",
-        "Cal": "CA",
-        "Calif": "CA",
-        "Calif.": "CA",
-        "Calf": "CA",
-        "Illi": "IL",
-        "Il": "IL",
-        "Ill": "IL",
-        "Ill.": "IL",
-        # Add more as needed
-    }
-    
-    # Try to fix state abbreviations
+    # Try to fix state abbreviations in the parts that might contain the state
     parts = address.split(',')
-    if len(parts) >= 2:
-        # Check the part that might contain the state
-        for i in range(1, min(len(parts), 3)):
-            state_part = parts[i].strip().split()
-            if state_part:
-                for j, word in enumerate(state_part):
-                    if word in state_corrections:
-                        state_part[j] = state_corrections[word]
-                        parts[i] = ' '.join(state_part)
-    
+    for i in range(1, min(len(parts), 3)):
+        parts[i] = STATE_CORRECTION_PATTERN.sub(lambda m: STATE_CORRECTIONS[m.group(1)], parts[i])
     processed_address = ','.join(parts)
     
     # Replace special characters that might cause issues
     processed_address = processed_address.replace("'", "")
     
-    # Remove apartment/suite numbers
-    processed_address = processed_address.replace("Suite", "").replace("Apt", "").replace("Unit", "")
-    processed_address = processed_address.replace("suite", "").replace("apt", "").replace("unit", "")
-    processed_address = processed_address.replace("#", "")
+    # Remove apartment/suite numbers, but not street names like "Unit Rd"
+    processed_address = UNIT_PATTERN.sub(
+        lambda m: "" if not m.group("unit") or is_unit_identifier(m.group("unit")) else m.group(0),
+        processed_address
+    )
+    
+    # Tidy commas left empty by a removed unit
+    processed_address = re.sub(r"\s*,\s*(?:,\s*)*", ", ", processed_address)
+    
+    return processed_address.strip(" ,")
+
+def geocode_zip_offline(zipcode, original_address=None):
+    """
+    Resolve a zip code to its centroid using the offline gazetteer.
     
-    # Remove common address suffixes that might cause issues
-    for suffix in [" Suite", " Ste", " Apartment", " Apt", " Unit", " #"]:
-        if suffix in processed_address:
-            # Find the suffix and remove everything after it until the next comma
-            pos = processed_address.find(suffix)
-            end_pos = processed_address.find(",", pos)
-            if end_pos > pos:
-                processed_address = processed_address[:pos] + processed_address[end_pos:]
-            else:
-                processed_address = processed_address[:pos]
+    Args:
+        zipcode: US zip code (5 digits)
+        original_address: Address to report as the original (defaults to the zip code)
+        
+    Returns:
+        Dictionary in the same shape as geocode_zipcode, or None if the zip code is not in the gazetteer
+    """
+    centroid = lookup_zip(zipcode)
+    if not centroid:
+        return None
     
-    return processed_address.strip()
+    return dict(centroid_result(zipcode, centroid), original_address=original_address or zipcode)
 
 def geocode_zipcode(zipcode):
     """
@@ -103,73 +176,37 @@ def geocode_zipcode(zipcode):
         
     # Generate a cache key from the zip code
     cache_key = f"zip_{zipcode}"
-    cache_file = GEOCODE_CACHE_DIR / f"{cache_key}.json"
+    cache = get_geocode_cache()
     
     # Check if we have a cached result
-    if cache_file.exists():
-        try:
-            with open(cache_file, 'r') as f:
-                logger.info(f"Using cached zip code result for: {zipcode}")
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Error reading zip code cache: {str(e)}")
+    cached = cache.get(cache_key)
+    if cached is not None:
+        if is_cached_failure(cached):
+            logger.info(f"Zip code previously failed to geocode (tried {', '.join(cached['stages_tried'])}): {zipcode}")
+            return None
+        logger.info(f"Using cached zip code result for: {zipcode}")
+        # The cache hands out its own objects; callers get a copy they may change
+        return dict(cached)
+    
+    # Resolve from the offline gazetteer when possible
+    geocoded_data = geocode_zip_offline(zipcode)
+    if geocoded_data:
+        logger.info(f"Resolved zip code from offline gazetteer: {zipcode}")
+        return geocoded_data
     
+    backend = get_geocoder_backend()
     try:
-        # Use a more reliable US-specific geocoding service
-        url = f"https://api.zippopotam.us/us/{zipcode}"
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if not data.get('places'):
-            logger.warning(f"No location found for zip code: {zipcode}")
-            return None
-            
-        # Get the first place (usually the main city for the zip code)
-        place = data['places'][0]
-        
-        # Now use Nominatim to get precise coordinates
-        nominatim_url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            "q": f"{place['place name']}, {place['state']}, {zipcode}, USA",
-            "format": "json",
-            "limit": 1,
-            "addressdetails": 1
-        }
-        
-        headers = {
-            "User-Agent": "WorkersCompProcessor/1.0",
-            "Accept": "application/json"
-        }
-        
-        time.sleep(1)  # Respect rate limits
-        response = requests.get(nominatim_url, params=params, headers=headers)
-        response.raise_for_status()
-        
-        results = response.json()
-        if not results:
+        result = backend.search_postcode(zipcode)
+        if not result:
             logger.warning(f"No coordinates found for zip code: {zipcode}")
+            cache_failure(cache, cache_key, zipcode, ["gazetteer", backend.name])
             return None
-            
-        result = results[0]
         
-        geocoded_data = {
-            "latitude": float(result["lat"]),
-            "longitude": float(result["lon"]),
-            "display_name": result["display_name"],
-            "address_components": {
-                "city": place['place name'],
-                "state": place['state'],
-                "postcode": zipcode,
-                "country": "USA"
-            },
-            "original_address": zipcode
-        }
+        geocoded_data = dict(result, original_address=zipcode)
+        geocoded_data.pop("importance", None)
         
         # Cache the result
-        with open(cache_file, 'w') as f:
-            json.dump(geocoded_data, f, indent=2)
+        cache.set(cache_key, dict(geocoded_data))
             
         logger.info(f"Successfully geocoded zip code: {zipcode}")
         return geocoded_data
@@ -199,76 +236,67 @@ def geocode_address(address, api_key=None):
         
     original_address = address
         
-    # Generate a cache key from the address
-    import hashlib
-    cache_key = hashlib.md5(address.encode()).hexdigest()
-    cache_file = GEOCODE_CACHE_DIR / f"{cache_key}.json"
+    # Generate a cache key from the canonical form of the address
+    cache_key = address_cache_key(address)
+    cache = get_geocode_cache()
     
-    # Check if we have a cached result
-    if cache_file.exists():
-        try:
-            with open(cache_file, 'r') as f:
-                logger.info(f"Using cached geocoding result for: {address}")
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Error reading geocode cache: {str(e)}")
-    
-    # Use Nominatim API (OSM)
-    nominatim_url = "https://nominatim.openstreetmap.org/search"
+    # Check if we have a cached result, including one stored under the older raw-address key
+    cached = cache.get(cache_key)
+    if cached is None:
+        cached = cache.get(hashlib.md5(address.encode()).hexdigest())
+        if cached is not None:
+            cache.set(cache_key, cached)
+    if cached is not None:
+        if is_cached_failure(cached):
+            logger.info(f"Address previously failed to geocode (tried {', '.join(cached['stages_tried'])}): {address}")
+            return None
+        logger.info(f"Using cached geocoding result for: {address}")
+        # The cache hands out its own objects; callers get a copy they may change
+        return dict(cached)
     
-    headers = {
-        "User-Agent": "WorkersCompProcessor/1.0",  # Required by Nominatim
-        "Accept": "application/json"
-    }
+    backend = get_geocoder_backend()
     
     # Try with original address first
     def try_geocode(query_address):
-        params = {
-            "q": query_address,
-            "format": "json",
-            "limit": 1,
-            "addressdetails": 1
-        }
-        
-        # Add API key if provided
-        if api_key:
-            params["key"] = api_key
-        
-        # Respect Nominatim's usage policy (max 1 request per second)
-        time.sleep(1)
-        
-        response = requests.get(nominatim_url, params=params, headers=headers)
-        response.raise_for_status()
-        
-        results = response.json()
-        
-        if not results:
+        result = backend.search(query_address, api_key)
+        if not result:
             return None
-            
-        # Get the first (best) result
-        result = results[0]
-        
-        return {
-            "latitude": float(result["lat"]),
-            "longitude": float(result["lon"]),
-            "display_name": result["display_name"],
-            "address_components": result.get("address", {}),
-            "importance": result.get("importance", 0),
-            "original_address": original_address
-        }
+        return dict(result, original_address=original_address)
     
     try:
         logger.info(f"Geocoding address: {address}")
         
-        # First try with the original address
-        geocoded_data = try_geocode(address)
-        
-        # If that fails, try with preprocessed address
+        # First try one structured query built from the parsed address (unit left out)
+        stages_tried = []
+        geocoded_data = None
+        parsed = parse_address(address)
+        if parsed["street"] and (parsed["city"] or parsed["zip"]):
+            stages_tried.append("structured")
+            result = backend.search_structured(
+                street=parsed["street"],
+                city=parsed["city"],
+                state=parsed["state"],
+                postalcode=parsed["zip"],
+                api_key=api_key
+            )
+            if result:
+                geocoded_data = dict(result, original_address=original_address)
+        
+        # Then try with the original address
         if not geocoded_data:
+            if stages_tried:
+                logger.info(f"Structured query failed. Trying with original address: {address}")
+            stages_tried.append("original")
+            geocoded_data = try_geocode(address)
+        
+        # If that fails, try with preprocessed address; the structured query already
+        # left the unit out and normalized the state, so only do this without one
+        if not geocoded_data and "structured" not in stages_tried:
             processed_address = preprocess_address(address)
             logger.info(f"First attempt failed. Trying with preprocessed address: {processed_address}")
             
             if processed_address != address:
+                stages_tried.append("preprocessed")
                 geocoded_data = try_geocode(processed_address)
         
         # If that still fails, try with just city, state, zip
@@ -278,24 +306,127 @@ def geocode_address(address, api_key=None):
             if len(parts) >= 2:
                 # Assume format like "Street, City, State ZIP"
                 city_state_zip = ','.join(parts[1:]).strip()
-                logger.info(f"Second attempt failed. Trying with just city/state/zip: {city_state_zip}")
-                geocoded_data = try_geocode(city_state_zip)
+                
+                # Prefer the offline zip centroid over another network request
+                zip_match = re.search(r'\b(\d{5})(?:-\d{4})?\s*$', city_state_zip)
+                if zip_match:
+                    stages_tried.append("zip_gazetteer")
+                    geocoded_data = geocode_zip_offline(zip_match.group(1), original_address)
+                    if geocoded_data:
+                        logger.info(f"Second attempt failed. Using offline centroid for zip code: {zip_match.group(1)}")
+                
+                if not geocoded_data:
+                    logger.info(f"Second attempt failed. Trying with just city/state/zip: {city_state_zip}")
+                    stages_tried.append("city_state_zip")
+                    geocoded_data = try_geocode(city_state_zip)
         
         if geocoded_data:
             # Cache the result
-            with open(cache_file, 'w') as f:
-                json.dump(geocoded_data, f, indent=2)
+            cache.set(cache_key, dict(geocoded_data))
                 
             logger.info(f"Successfully geocoded address: {address}")
             return geocoded_data
         else:
             logger.warning(f"All geocoding attempts failed for address: {address}")
+            # Network errors raise and are not cached; only a clean "not found" is
+            cache_failure(cache, cache_key, address, stages_tried)
             return None
             
     except Exception as e:
         logger.error(f"Error geocoding address: {str(e)}")
         return None
 
+def _geocode_cache_key(address):
+    """Cache key geocode_address uses for an address."""
+    address = address.strip()
+    if re.match(r'^\d{5}$', address):
+        return f"zip_{address}"
+    return address_cache_key(address)
+
+def geocode_many(addresses, api_key=None, max_workers=None):
+    """
+    Geocode many addresses, looking up each distinct address only once.
+    
+    Addresses that canonicalize to the same form share one lookup. Cached
+    addresses are answered immediately; the rest are geocoded on a thread pool,
+    and the shared rate limiter still spaces out requests to each host.
+    
+    Args:
+        addresses: List of address strings (empty entries are allowed)
+        api_key: Optional API key for commercial geocoding services
+        max_workers: Maximum concurrent lookups (defaults to config.GEOCODE_MAX_WORKERS)
+        
+    Returns:
+        List of geocoding dictionaries (or None) in the same order as addresses
+    """
+    cache = get_geocode_cache()
+    representatives = {}
+    keys = []
+    for address in addresses:
+        key = _geocode_cache_key(address) if address and address.strip() else None
+        keys.append(key)
+        if key is not None and key not in representatives:
+            representatives[key] = address
+    
+    resolved = {}
+    misses = []
+    for key, address in representatives.items():
+        cached = cache.get(key)
+        if is_cached_failure(cached):
+            resolved[key] = None
+        elif cached is not None:
+            resolved[key] = cached
+        else:
+            misses.append((key, address))
+    
+    logger.info(f"Geocoding {len(addresses)} addresses: {len(representatives)} distinct, "
+                f"{len(representatives) - len(misses)} cached, {len(misses)} to look up")
+    
+    if misses:
+        max_workers = max_workers or config.GEOCODE_MAX_WORKERS
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(misses))) as executor:
+            futures = {key: executor.submit(geocode_address, address, api_key) for key, address in misses}
+            for key, future in futures.items():
+                try:
+                    resolved[key] = future.result()
+                except Exception as e:
+                    logger.error(f"Error geocoding address: {str(e)}")
+                    resolved[key] = None
+    
+    results = []
+    for address, key in zip(addresses, keys):
+        geocoded_data = resolved.get(key)
+        if geocoded_data is not None:
+            # Each caller gets its own copy, reporting its own spelling of the address
+            geocoded_data = dict(geocoded_data, original_address=address)
+        results.append(geocoded_data)
+    return results
+
+def nearest_reverse_entry(entries, lat, lon, max_distance_meters):
+    """
+    Find the cached reverse geocoding result looked up closest to a location.
+    
+    Args:
+        entries: List of {"lat", "lon", "result"} dictionaries from one cache cell
+        lat: Latitude
+        lon: Longitude
+        max_distance_meters: Entries farther away than this are ignored
+        
+    Returns:
+        Cached result dictionary or None if no entry is close enough
+    """
+    best = None
+    best_distance = max_distance_meters
+    cos_lat = math.cos(math.radians(lat))
+    for entry in entries:
+        # Equirectangular approximation; exact enough within one small cell
+        dy = math.radians(entry["lat"] - lat)
+        dx = math.radians(entry["lon"] - lon) * cos_lat
+        distance = EARTH_RADIUS_METERS * math.hypot(dx, dy)
+        if distance <= best_distance:
+            best, best_distance = entry["result"], distance
+    return best
+
 def reverse_geocode(lat, lon, api_key=None):
     """
     Convert geographic coordinates to an address using OpenStreetMap Nominatim API.
@@ -308,63 +439,35 @@ def reverse_geocode(lat, lon, api_key=None):
     Returns:
         Dictionary with address details or None if reverse geocoding fails
     """
-    # Generate a cache key from the coordinates
-    cache_key = f"{lat}_{lon}".replace(".", "_")
-    cache_file = GEOCODE_CACHE_DIR / f"reverse_{cache_key}.json"
-    
-    # Check if we have a cached result
-    if cache_file.exists():
-        try:
-            with open(cache_file, 'r') as f:
-                logger.info(f"Using cached reverse geocoding result for: {lat}, {lon}")
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Error reading reverse geocode cache: {str(e)}")
-    
-    # Use Nominatim API (OSM)
-    nominatim_url = "https://nominatim.openstreetmap.org/reverse"
+    # Results are cached per geohash cell; any earlier lookup close enough in the same cell is reused
+    lat, lon = float(lat), float(lon)
+    cache_key = "reverse_" + geohash.encode(lat, lon, config.REVERSE_GEOCODE_CELL_PRECISION)
+    cache = get_geocode_cache()
     
-    headers = {
-        "User-Agent": "WorkersCompProcessor/1.0",  # Required by Nominatim
-        "Accept": "application/json"
-    }
-    
-    params = {
-        "lat": lat,
-        "lon": lon,
-        "format": "json",
-        "addressdetails": 1
-    }
-    
-    # Add API key if provided
-    if api_key:
-        params["key"] = api_key
+    # Check if we have a cached result; the cache hands out its own objects, so work on a copy
+    cell_entries = list(cache.get(cache_key) or [])
+    cached = nearest_reverse_entry(cell_entries, lat, lon, config.REVERSE_GEOCODE_MAX_DISTANCE_METERS)
+    if cached is not None:
+        logger.info(f"Using cached reverse geocoding result for: {lat}, {lon}")
+        return dict(cached)
     
     try:
         logger.info(f"Reverse geocoding coordinates: {lat}, {lon}")
         
-        # Respect Nominatim's usage policy
-        time.sleep(1)
-        
-        response = requests.get(nominatim_url, params=params, headers=headers)
-        response.raise_for_status()
-        
-        result = response.json()
-        
-        if "error" in result:
-            logger.warning(f"Error in reverse geocoding response: {result['error']}")
+        result = get_geocoder_backend().reverse(lat, lon, api_key)
+        if not result:
             return None
             
         geocoded_data = {
             "display_name": result["display_name"],
-            "address_components": result.get("address", {}),
-            "latitude": float(result["lat"]),
-            "longitude": float(result["lon"]),
+            "address_components": result["address_components"],
+            "latitude": result["latitude"],
+            "longitude": result["longitude"],
         }
         
-        # Cache the result
-        with open(cache_file, 'w') as f:
-            json.dump(geocoded_data, f, indent=2)
+        # Cache the result alongside the cell's other lookups, keeping the newest ones
+        cell_entries.append({"lat": lat, "lon": lon, "result": dict(geocoded_data)})
+        cache.set(cache_key, cell_entries[-config.REVERSE_GEOCODE_CELL_ENTRIES:])
             
         logger.info(f"Successfully reverse geocoded coordinates: {lat}, {lon}")
         return geocoded_data
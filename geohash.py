@@ -0,0 +1,126 @@
+"""
+Minimal geohash encoding and cell helpers.
+"""
+import math
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {ch: i for i, ch in enumerate(_BASE32)}
+
+def encode(latitude, longitude, precision=6):
+    """
+    Encode a location as a geohash.
+
+    Args:
+        latitude: Latitude in degrees
+        longitude: Longitude in degrees
+        precision: Number of geohash characters
+
+    Returns:
+        Geohash string
+    """
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if longitude >= mid:
+                value = (value << 1) | 1
+                lon_lo = mid
+            else:
+                value <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if latitude >= mid:
+                value = (value << 1) | 1
+                lat_lo = mid
+            else:
+                value <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+def bounds(geohash):
+    """
+    Bounding box of a geohash cell.
+
+    Args:
+        geohash: Geohash string
+
+    Returns:
+        Tuple (min_lat, max_lat, min_lon, max_lon)
+    """
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    even = True
+    for ch in geohash:
+        value = _BASE32_INDEX[ch]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lon_lo + lon_hi) / 2
+                if bit:
+                    lon_lo = mid
+                else:
+                    lon_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return lat_lo, lat_hi, lon_lo, lon_hi
+
+def cell_size(precision):
+    """
+    Size of geohash cells at a precision.
+
+    Returns:
+        Tuple (lat_degrees, lon_degrees)
+    """
+    total_bits = 5 * precision
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+def cells_covering(min_lat, max_lat, min_lon, max_lon, precision):
+    """
+    Geohash cells that together cover a bounding box.
+
+    Args:
+        min_lat: Southern edge in degrees
+        max_lat: Northern edge in degrees
+        min_lon: Western edge in degrees
+        max_lon: Eastern edge in degrees
+        precision: Number of geohash characters
+
+    Returns:
+        Set of geohash strings
+    """
+    lat_step, lon_step = cell_size(precision)
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    min_lon, max_lon = max(min_lon, -180.0), min(max_lon, 180.0)
+
+    # Cell rows/columns that intersect the box, clamped to the grid
+    first_row = max(0, int(math.floor((min_lat + 90.0) / lat_step)))
+    last_row = min(int(round(180.0 / lat_step)) - 1, int(math.floor((max_lat + 90.0) / lat_step)))
+    first_col = max(0, int(math.floor((min_lon + 180.0) / lon_step)))
+    last_col = min(int(round(360.0 / lon_step)) - 1, int(math.floor((max_lon + 180.0) / lon_step)))
+
+    cells = set()
+    for row in range(first_row, last_row + 1):
+        center_lat = -90.0 + (row + 0.5) * lat_step
+        for col in range(first_col, last_col + 1):
+            center_lon = -180.0 + (col + 0.5) * lon_step
+            cells.add(encode(center_lat, center_lon, precision))
+    return cells
@@ -0,0 +1,236 @@
+"""
+Shared HTTP client for external services (geocoding, static maps).
+
+Every host gets its own pooled keep-alive session, every request has connect
+and read timeouts, transient failures are retried a bounded number of times
+with jittered exponential backoff, and a per-host circuit breaker makes calls
+fail fast while a service is down instead of stalling each order on timeouts.
+Requests also go through the shared per-host rate limiter, retries included.
+"""
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from referrals import config
+from referrals.concurrency import service_slot
+from referrals.rate_limiter import wait_for_url
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Response codes worth retrying; anything else is returned to the caller as is
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULT_HEADERS = {
+    "User-Agent": "WorkersCompProcessor/1.0"
+}
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while a host's circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one host.
+
+    After failure_threshold failures in a row the circuit opens and requests
+    are refused for reset_timeout seconds. Then a single trial request is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self):
+        """Whether a request may be sent now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_in_flight or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+class HttpClient:
+    """Pooled, timed, retrying and circuit-broken HTTP GETs, one session per host."""
+
+    def __init__(self, connect_timeout=5, read_timeout=20, max_retries=2, backoff_base=0.5,
+                 backoff_max=8, pool_size=10, failure_threshold=5, reset_timeout=60, rate_limit=True):
+        """
+        Set up the client.
+
+        Args:
+            connect_timeout: Seconds to wait for a connection
+            read_timeout: Seconds to wait between bytes of the response
+            max_retries: Retries after the first attempt for connection errors,
+                timeouts and retryable status codes
+            backoff_base: Backoff before the first retry, doubled for each later one
+            backoff_max: Upper bound on a single backoff
+            pool_size: Keep-alive connections kept per host
+            failure_threshold: Consecutive failed requests that open a host's circuit
+            reset_timeout: Seconds an open circuit waits before a trial request
+            rate_limit: Wait for the shared per-host rate limiter before each attempt
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.rate_limit = rate_limit
+        self._sessions = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _session(self, host):
+        session = self._sessions.get(host)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+                if session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    session.headers.update(DEFAULT_HEADERS)
+                    self._sessions[host] = session
+        return session
+
+    def breaker(self, host):
+        """Circuit breaker for a host."""
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    host, CircuitBreaker(self.failure_threshold, self.reset_timeout))
+        return breaker
+
+    def _backoff(self, attempt, response=None):
+        # Honour a numeric Retry-After, otherwise "full jitter" exponential backoff
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        """
+        Send a GET request.
+
+        Args:
+            url: Request URL
+            params: Optional query parameters
+            headers: Optional extra headers
+            timeout: Optional (connect, read) timeout overriding the client default
+
+        Returns:
+            requests.Response of the last attempt (callers still check the status)
+
+        Raises:
+            CircuitOpenError: If the host's circuit is open
+            requests.RequestException: If every attempt failed to get a response
+        """
+        host = (urlparse(url).hostname or "").lower()
+        breaker = self.breaker(host)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {host}; not sending request")
+
+        session = self._session(host)
+        for attempt in range(self.max_retries + 1):
+            try:
+                # Take the slot first so a rate-limit slot isn't spent while queued behind other calls
+                with service_slot(host):
+                    if self.rate_limit:
+                        wait_for_url(url)
+                    response = session.get(url, params=params, headers=headers, timeout=timeout or self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    breaker.record_failure()
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"Request to {host} failed ({type(e).__name__}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            except Exception:
+                breaker.record_failure()
+                raise
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                delay = self._backoff(attempt, response)
+                logger.warning(f"Request to {host} returned {response.status_code}; retrying in {delay:.1f}s")
+                response.close()
+                time.sleep(delay)
+                continue
+
+            if response.status_code in RETRY_STATUSES:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            return response
+
+    def close(self):
+        """Close every pooled session."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+# Process-wide client, created on first use
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def get_http_client():
+    """
+    Get the process-wide HTTP client configured from config.
+
+    Returns:
+        HttpClient shared by every caller in this process
+    """
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient(
+                connect_timeout=config.HTTP_CONNECT_TIMEOUT,
+                read_timeout=config.HTTP_READ_TIMEOUT,
+                max_retries=config.HTTP_MAX_RETRIES,
+                backoff_base=config.HTTP_BACKOFF_BASE,
+                backoff_max=config.HTTP_BACKOFF_MAX,
+                pool_size=config.HTTP_POOL_SIZE,
+                failure_threshold=config.HTTP_CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=config.HTTP_CIRCUIT_RESET_TIMEOUT
+            )
+        return _http_client
+
+def http_get(url, params=None, headers=None, timeout=None):
+    """Send a GET request through the process-wide client. See HttpClient.get."""
+    return get_http_client().get(url, params=params, headers=headers, timeout=timeout)
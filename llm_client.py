@@ -7,6 +7,7 @@ import os
 import openai
 from openai import OpenAI
 import config
+from referrals.concurrency import service_slot
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -32,12 +33,13 @@ def call_openai_api(api_request):
         
         client = OpenAI(api_key=api_key)
         
-        response = client.chat.completions.create(
-            model=api_request.get("model", "gpt-3.5-turbo"),
-            messages=api_request.get("messages", []),
-            temperature=api_request.get("temperature", 0),
-            max_tokens=api_request.get("max_tokens", 1000)
-        )
+        with service_slot("llm"):
+            response = client.chat.completions.create(
+                model=api_request.get("model", "gpt-3.5-turbo"),
+                messages=api_request.get("messages", []),
+                temperature=api_request.get("temperature", 0),
+                max_tokens=api_request.get("max_tokens", 1000)
+            )
         
         # Format the response to be more usable
         formatted_response = {
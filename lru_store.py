@@ -0,0 +1,113 @@
+"""
+Size-bounded directory of files with least-recently-used eviction.
+
+Shared by the tile cache (tile_renderer.TileCache) and the rendered map cache
+(map_cache.MapCache). Files are written atomically, reads bump the file's
+mtime, and once the directory grows past its limit the least recently used
+files are deleted until it is back under 90% of the limit.
+"""
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class LRUDirectoryStore:
+    """On-disk file store with least-recently-used eviction above a size limit."""
+
+    def __init__(self, cache_dir, max_bytes, suffix=".png", label="files"):
+        """
+        Set up the store.
+
+        Args:
+            cache_dir: Directory for stored files
+            max_bytes: Size above which the least recently used files are evicted
+            suffix: Extension of the files the store manages (and may evict)
+            label: What the files are, for log messages
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.label = label
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _stored_files(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(self.suffix):
+                    yield os.path.join(root, name)
+
+    def touch(self, path):
+        """
+        Mark a stored file as recently used.
+
+        Args:
+            path: Path inside the store
+
+        Returns:
+            True if the file exists
+        """
+        try:
+            os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    def write(self, path, data):
+        """
+        Atomically write a file, evicting old files if the store grew past its limit.
+
+        Args:
+            path: Path inside the store
+            data: File contents
+
+        Returns:
+            Path to the written file
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(os.path.getsize(p) for p in self._stored_files())
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict(keep=str(path))
+        return path
+
+    def _evict(self, keep=None):
+        # Drop least recently used files until the store is at 90% of its limit
+        stored = []
+        for file_path in self._stored_files():
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            stored.append((stat.st_mtime, stat.st_size, file_path))
+        stored.sort()
+        size = sum(entry[1] for entry in stored)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, file_size, file_path in stored:
+            if size <= target:
+                break
+            if file_path == keep:
+                continue
+            try:
+                os.remove(file_path)
+                size -= file_size
+                removed += 1
+            except OSError:
+                pass
+        self._size = size
+        logger.info(f"Evicted {removed} {self.label} from {self.cache_dir} ({size / 1e6:.1f} MB kept)")
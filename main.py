@@ -8,21 +8,74 @@ import logging
 import shutil
 from pathlib import Path
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import config
 from extract import initialize_documentai
-from process import process_order_folder, format_llm_request, save_results
+from process import process_order_folder, format_llm_request, save_results, add_mapping_to_saved_results
 from llm_client import call_llm_api
+from mapping import wait_for_background_maps
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def process_all_orders():
+def process_order(order_folder, add_mapping=True):
+    """
+    Process one order folder: OCR, LLM extraction and saving results.
+    
+    Errors are logged and contained to the order, so one bad order does not
+    stop the others.
+    
+    Args:
+        order_folder: Path to the order folder
+        add_mapping: Add geocoding and provider mapping before saving; pass False
+            when mapping many orders at once with add_mapping_to_saved_results
+        
+    Returns:
+        Results dictionary, or None if the order produced no results
+    """
+    order_id = order_folder.name
+    logger.info(f"Processing order folder: {order_id}")
+    
+    try:
+        # Step 1: Process documents in the order folder
+        order_data = process_order_folder(order_folder)
+        
+        if not order_data["documents"]:
+            logger.warning(f"No valid documents found in order folder: {order_id}")
+            return None
+        
+        # Step 2: Format the data for LLM request
+        api_request = format_llm_request(order_data)
+        
+        # Step 3: Call the LLM API
+        llm_response = call_llm_api(api_request)
+        
+        # Step 4: Save results
+        results = save_results(order_id, order_data, api_request, llm_response, add_mapping=add_mapping)
+        
+        # Optional: Move processed order to an archive folder
+        # archive_path = config.INPUT_DIR.parent / "archive" / order_id
+        # shutil.move(str(order_folder), str(archive_path))
+        
+        logger.info(f"Completed processing order: {order_id}")
+        return results
+    except Exception as e:
+        logger.error(f"Error processing order {order_id}: {str(e)}")
+        return None
+
+def process_all_orders(workers=None):
     """
     Process all order folders in the input directory.
+    
+    Args:
+        workers: Orders processed concurrently (defaults to config.ORDER_WORKERS);
+            calls to each external service are still limited by
+            config.SERVICE_CONCURRENCY and config.RATE_LIMITS
     """
     start_time = time.time()
+    workers = max(1, workers or config.ORDER_WORKERS)
     logger.info(f"Starting batch processing using OpenAI")
     
     # Ensure input directory exists
@@ -31,13 +84,13 @@ def process_all_orders():
         return
     
     # Get list of order folders
-    order_folders = [f for f in config.INPUT_DIR.glob("*") if f.is_dir()]
+    order_folders = sorted(f for f in config.INPUT_DIR.glob("*") if f.is_dir())
     
     if not order_folders:
         logger.warning(f"No order folders found in {config.INPUT_DIR}")
         return
     
-    logger.info(f"Found {len(order_folders)} order folders to process")
+    logger.info(f"Found {len(order_folders)} order folders to process with {workers} workers")
     
     # Initialize Document AI once for all orders
     try:
@@ -46,38 +99,27 @@ def process_all_orders():
         logger.error(f"Failed to initialize Document AI: {str(e)}")
         return
     
-    # Process each order folder
-    for order_folder in order_folders:
-        order_id = order_folder.name
-        logger.info(f"Processing order folder: {order_id}")
-        
-        try:
-            # Step 1: Process documents in the order folder
-            order_data = process_order_folder(order_folder)
-            
-            if not order_data["documents"]:
-                logger.warning(f"No valid documents found in order folder: {order_id}")
-                continue
-            
-            # Step 2: Format the data for LLM request
-            api_request = format_llm_request(order_data)
-            
-            # Step 3: Call the LLM API
-            llm_response = call_llm_api(api_request)
-            
-            # Step 4: Save results
-            save_results(order_id, order_data, api_request, llm_response)
-            
-            # Optional: Move processed order to an archive folder
-            # archive_path = config.INPUT_DIR.parent / "archive" / order_id
-            # shutil.move(str(order_folder), str(archive_path))
-            
-            logger.info(f"Completed processing order: {order_id}")
-        except Exception as e:
-            logger.error(f"Error processing order {order_id}: {str(e)}")
+    # Process each order folder; mapping is added for all orders at the end
+    if workers == 1:
+        order_results = [process_order(order_folder, add_mapping=False) for order_folder in order_folders]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="order") as executor:
+            order_results = list(executor.map(lambda folder: process_order(folder, add_mapping=False),
+                                              order_folders))
+    saved_results = [results for results in order_results if results is not None]
+    
+    # Step 5: Geocode and match providers for all orders in one pass
+    try:
+        add_mapping_to_saved_results(saved_results)
+    except Exception as e:
+        logger.error(f"Error adding mapping to results: {str(e)}")
     
     elapsed_time = time.time() - start_time
-    logger.info(f"Batch processing completed in {elapsed_time:.2f} seconds")
+    logger.info(f"Batch processing completed in {elapsed_time:.2f} seconds "
+                f"({len(saved_results)} of {len(order_folders)} orders saved)")
+    
+    # Maps queued in "background" mode finish after the results are saved
+    wait_for_background_maps()
 
 def process_single_order(order_id):
     """
@@ -94,31 +136,16 @@ def process_single_order(order_id):
         logger.error(f"Order folder not found: {order_folder}")
         return
     
-    try:
-        # Step 1: Process documents in the order folder
-        order_data = process_order_folder(order_folder)
-        
-        if not order_data["documents"]:
-            logger.warning(f"No valid documents found in order folder: {order_id}")
-            return
-        
-        # Step 2: Format the data for LLM request
-        api_request = format_llm_request(order_data)
-        
-        # Step 3: Call the LLM API
-        llm_response = call_llm_api(api_request)
-        
-        # Step 4: Save results
-        save_results(order_id, order_data, api_request, llm_response)
-        
-        logger.info(f"Completed processing order: {order_id}")
-    except Exception as e:
-        logger.error(f"Error processing order {order_id}: {str(e)}")
+    process_order(order_folder)
+    
+    wait_for_background_maps()
 
 def main():
     """Main entry point."""
     parser = argparse.ArgumentParser(description="Workers Compensation Document Processing")
     parser.add_argument("--order", help="Process a single order by ID")
+    parser.add_argument("--workers", type=int, default=config.ORDER_WORKERS,
+                        help="Orders to process concurrently (default: config.ORDER_WORKERS)")
     
     args = parser.parse_args()
     
@@ -130,7 +157,7 @@ def main():
     if args.order:
         process_single_order(args.order)
     else:
-        process_all_orders()
+        process_all_orders(args.workers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
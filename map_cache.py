@@ -0,0 +1,145 @@
+"""
+Content-addressed cache of rendered static map images.
+
+A map is keyed on everything that decides its pixels: the renderer and its
+source, coordinates rounded to config.MAP_CACHE_COORD_DECIMALS, zoom, size
+and markers. Images are stored as ``{key[:2]}/{key}.png`` under
+config.MAP_CACHE_DIR, so two orders for the same address share one rendering
+and an order whose address is corrected gets a new key rather than its old
+image. The cache is kept under config.MAP_CACHE_MAX_MB by evicting the least
+recently used images.
+
+Per-order files (``{order_id}_map.png`` in config.MAPS_DIR) are hard links to
+cached images where the filesystem allows it and copies otherwise, and are
+refreshed every time the order's map is generated.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from referrals import config
+from referrals.lru_store import LRUDirectoryStore
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def quantize(value, decimals=None):
+    """Round a coordinate to the cache's precision (config.MAP_CACHE_COORD_DECIMALS)."""
+    return round(float(value), config.MAP_CACHE_COORD_DECIMALS if decimals is None else decimals)
+
+def map_cache_key(latitude, longitude, zoom, width, height, markers=None, source=None):
+    """
+    Cache key of a map rendering.
+
+    Args:
+        latitude: Latitude for map center
+        longitude: Longitude for map center
+        zoom: Zoom level
+        width: Map width in pixels
+        height: Map height in pixels
+        markers: Optional list of (latitude, longitude, color) markers
+        source: Renderer and tile/map service the image comes from
+
+    Returns:
+        Hex digest identifying the image
+    """
+    spec = {
+        "center": [quantize(latitude), quantize(longitude)],
+        "zoom": int(zoom),
+        "size": [int(width), int(height)],
+        "markers": sorted([quantize(lat), quantize(lon), color] for lat, lon, color in markers or []),
+        "source": source
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()
+
+class MapCache(LRUDirectoryStore):
+    """On-disk map image store with least-recently-used eviction above a size limit."""
+
+    def __init__(self, cache_dir, max_bytes):
+        """
+        Set up the cache.
+
+        Args:
+            cache_dir: Directory for cached map images
+            max_bytes: Size above which the least recently used images are evicted
+        """
+        super().__init__(cache_dir, max_bytes, suffix=".png", label="map images")
+
+    def path(self, key):
+        """Where the image for a key is (or would be) stored."""
+        return self.cache_dir / key[:2] / f"{key}.png"
+
+    def get(self, key):
+        """
+        Look up a cached image.
+
+        Args:
+            key: Key from map_cache_key
+
+        Returns:
+            Path to the image, or None on a miss
+        """
+        path = self.path(key)
+        return path if self.touch(path) else None
+
+    def put(self, key, data):
+        """
+        Store an image, evicting old images if the cache grew past its limit.
+
+        Args:
+            key: Key from map_cache_key
+            data: PNG bytes
+
+        Returns:
+            Path to the stored image
+        """
+        return self.write(self.path(key), data)
+
+def order_map_path(order_id):
+    """Path of an order's map file ({order_id}_map.png in config.MAPS_DIR)."""
+    return Path(config.MAPS_DIR) / f"{order_id}_map.png"
+
+def link_order_map(image_path, order_id):
+    """
+    Point an order's map file at a cached image.
+
+    Args:
+        image_path: Cached image path from MapCache
+        order_id: Order ID
+
+    Returns:
+        Path to {order_id}_map.png in config.MAPS_DIR
+    """
+    order_path = order_map_path(order_id)
+    order_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = order_path.with_name(f".{order_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        os.link(image_path, tmp_path)
+    except OSError:
+        # Different filesystem, or links not supported
+        shutil.copyfile(image_path, tmp_path)
+    # Replace any earlier map for the order, e.g. from before an address correction
+    os.replace(tmp_path, order_path)
+    return order_path
+
+# Process-wide map cache, created on first use
+_map_cache = None
+_map_cache_lock = threading.Lock()
+
+def get_map_cache():
+    """
+    Get the process-wide map cache configured from config.
+
+    Returns:
+        MapCache shared by every caller in this process
+    """
+    global _map_cache
+    with _map_cache_lock:
+        if _map_cache is None:
+            _map_cache = MapCache(config.MAP_CACHE_DIR, config.MAP_CACHE_MAX_MB * 1024 * 1024)
+        return _map_cache
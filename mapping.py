@@ -3,23 +3,65 @@ Functions for creating maps based on geocoded addresses.
 Updated to work with enhanced HCFA-like data format.
 """
 import logging
-import requests
-import os
-from pathlib import Path
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 import io
-from PIL import Image
 import config
-from geocoding_client import geocode_address
+from geocoding_client import geocode_address, geocode_many
+from referrals.http_client import http_get
+from referrals.map_cache import get_map_cache, link_order_map, map_cache_key, order_map_path, quantize
+from referrals.tile_renderer import render_static_map
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def _render_map_png(latitude, longitude, zoom, width, height, markers, api_key=None):
+    # Compose the map locally from cached tiles
+    if config.MAP_RENDERER == "tiles":
+        logger.info(f"Rendering static map from tiles for coordinates: {latitude}, {longitude}")
+        image = render_static_map(latitude, longitude, zoom, width, height, markers=markers)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    # OpenStreetMap Static Map API (via third-party service since OSM doesn't provide an official static map API)
+    # We're using staticmap.openstreetmap.de by default; fixture_server.py serves a local stand-in
+    params = {
+        "center": f"{latitude},{longitude}",
+        "zoom": zoom,
+        "size": f"{width}x{height}",
+        "markers": "|".join(f"{lat},{lon},{color}" for lat, lon, color in markers),
+        "attribution": "true"
+    }
+    
+    # If API key provided and using a different service that accepts it
+    if api_key and config.MAP_PROVIDER != "openstreetmap":
+        params["key"] = api_key
+    
+    logger.info(f"Generating static map for coordinates: {latitude}, {longitude}")
+    
+    # Service usage policy (rate limit) is enforced by the HTTP client
+    response = http_get(config.STATIC_MAP_URL, params=params)
+    response.raise_for_status()
+    return response.content
+
+def _map_spec(latitude, longitude, zoom, width, height):
+    # Rounded center, markers and cache key of a patient location map
+    latitude, longitude = quantize(latitude), quantize(longitude)
+    markers = [(latitude, longitude, "red")]
+    source = config.MAP_TILE_URL if config.MAP_RENDERER == "tiles" else config.STATIC_MAP_URL
+    key = map_cache_key(latitude, longitude, zoom, width, height, markers, f"{config.MAP_RENDERER}:{source}")
+    return latitude, longitude, markers, key
+
 def generate_static_map(latitude, longitude, zoom=14, width=600, height=400, api_key=None, order_id=None):
     """
     Generate a static map using OpenStreetMap and save it locally.
     
+    Maps are rendered once per rounded location, zoom and size and kept in
+    the map cache (see map_cache.py); an order's map file is a link to (or
+    copy of) the cached image and is refreshed on every call.
+    
     Args:
         latitude: Latitude for map center
         longitude: Longitude for map center
@@ -30,60 +72,85 @@ def generate_static_map(latitude, longitude, zoom=14, width=600, height=400, api
         order_id: Optional order ID to associate with the map
         
     Returns:
-        Path to the saved map image
+        Path to the saved map image ({order_id}_map.png when order_id is given),
+        or None if the map could not be rendered completely (nothing is cached
+        then, so a later call tries again)
     """
-    # Ensure maps directory exists
-    os.makedirs(config.MAPS_DIR, exist_ok=True)
-    
-    # Generate map filename
-    filename = f"map_{latitude}_{longitude}_{zoom}".replace(".", "_")
-    if order_id:
-        filename = f"{order_id}_map"
-    
-    map_path = config.MAPS_DIR / f"{filename}.png"
-    
-    # Check if map already exists
-    if map_path.exists():
-        logger.info(f"Using existing map at {map_path}")
-        return map_path
-    
-    # OpenStreetMap Static Map API (via third-party service since OSM doesn't provide an official static map API)
-    # We're using staticmap.openstreetmap.de as an example
-    static_map_url = "https://staticmap.openstreetmap.de/staticmap.php"
-    
-    params = {
-        "center": f"{latitude},{longitude}",
-        "zoom": zoom,
-        "size": f"{width}x{height}",
-        "markers": f"{latitude},{longitude},red",
-        "attribution": "true"
-    }
-    
-    # If API key provided and using a different service that accepts it
-    if api_key and config.MAP_PROVIDER != "openstreetmap":
-        params["key"] = api_key
+    latitude, longitude, markers, key = _map_spec(latitude, longitude, zoom, width, height)
+    cache = get_map_cache()
     
     try:
-        logger.info(f"Generating static map for coordinates: {latitude}, {longitude}")
-        
-        # Respect service usage policy
-        time.sleep(1)
-        
-        response = requests.get(static_map_url, params=params)
-        response.raise_for_status()
+        map_path = cache.get(key)
+        if map_path is not None:
+            logger.info(f"Using cached map at {map_path}")
+        else:
+            data = _render_map_png(latitude, longitude, zoom, width, height, markers, api_key)
+            map_path = cache.put(key, data)
+            logger.info(f"Successfully saved map to {map_path}")
         
-        # Save the map image
-        with open(map_path, 'wb') as f:
-            f.write(response.content)
-            
-        logger.info(f"Successfully saved map to {map_path}")
+        if order_id:
+            map_path = link_order_map(map_path, order_id)
         return map_path
         
     except Exception as e:
         logger.error(f"Error generating static map: {str(e)}")
         return None
 
-def process_address_for_mapping(address, order_id=None, api_key=None):
+# Background map rendering, started on first use
+_map_executor = None
+_map_executor_lock = threading.Lock()
+_map_futures = set()
+
+def _render_in_background(map_request, api_key, on_done):
+    map_path = generate_static_map(api_key=api_key, **map_request)
+    if on_done is not None:
+        try:
+            on_done(map_path)
+        except Exception as e:
+            logger.error(f"Error recording background map for order {map_request.get('order_id')}: {str(e)}")
+    return map_path
+
+def queue_static_map(map_request, api_key=None, on_done=None):
+    """
+    Render a map in the background.
+    
+    Args:
+        map_request: generate_static_map keyword arguments (the map_request of a pending map)
+        api_key: Optional OSM API key
+        on_done: Optional function called from the rendering thread with the
+            map path (or None if rendering failed) once the map is done
+        
+    Returns:
+        Future resolving to the map path (or None if rendering failed)
+    """
+    global _map_executor
+    with _map_executor_lock:
+        if _map_executor is None:
+            _map_executor = ThreadPoolExecutor(max_workers=config.MAP_BACKGROUND_WORKERS,
+                                               thread_name_prefix="map")
+        future = _map_executor.submit(_render_in_background, map_request, api_key, on_done)
+        _map_futures.add(future)
+    future.add_done_callback(_map_futures.discard)
+    return future
+
+def wait_for_background_maps(timeout=None):
+    """
+    Wait for maps queued with queue_static_map to finish rendering.
+    
+    Args:
+        timeout: Optional maximum seconds to wait
+        
+    Returns:
+        Number of maps still rendering when the wait ended
+    """
+    with _map_executor_lock:
+        pending = list(_map_futures)
+    if pending:
+        logger.info(f"Waiting for {len(pending)} background maps")
+        wait(pending, timeout=timeout)
+    return sum(1 for future in pending if not future.done())
+
+def process_address_for_mapping(address, order_id=None, api_key=None, geocode_data=None):
     """
     Process a patient address for mapping.
     
@@ -91,6 +158,7 @@ def process_address_for_mapping(address, order_id=None, api_key=None):
         address: The patient address to map
         order_id: Order ID for the patient
         api_key: Optional OSM API key
+        geocode_data: Optional geocoding result already looked up for the address
         
     Returns:
         Dictionary with geocoding data and map path
@@ -106,24 +174,38 @@ def process_address_for_mapping(address, order_id=None, api_key=None):
     try:
         # Step 1: Geocode the address
         api_key = api_key or config.OSM_API_KEY
-        geocode_data = geocode_address(address, api_key)
+        if geocode_data is None:
+            geocode_data = geocode_address(address, api_key)
         
         if not geocode_data:
             logger.warning(f"Could not geocode address: {address}")
             return None
             
-        # Step 2: Generate a static map
-        map_path = generate_static_map(
-            latitude=geocode_data["latitude"],
-            longitude=geocode_data["longitude"],
-            api_key=api_key,
-            order_id=order_id
-        )
+        # Step 2: Generate a static map, or leave a pending map for later
+        map_request = {
+            "latitude": geocode_data["latitude"],
+            "longitude": geocode_data["longitude"],
+            "order_id": order_id
+        }
+        if config.MAP_GENERATION_MODE == "background":
+            # The caller queues the map once the results are saved (process.queue_background_maps);
+            # drop any earlier map so the order never shows one for an old address meanwhile
+            if order_id:
+                order_map_path(order_id).unlink(missing_ok=True)
+            return {
+                "geocode_data": geocode_data,
+                "map_path": None,
+                "map_status": "pending",
+                "map_request": map_request
+            }
+        
+        map_path = generate_static_map(api_key=api_key, **map_request)
         
         # Step 3: Return mapping data
         mapping_data = {
             "geocode_data": geocode_data,
-            "map_path": str(map_path) if map_path else None
+            "map_path": str(map_path) if map_path else None,
+            "map_status": "ready" if map_path else "failed"
         }
         
         return mapping_data
@@ -132,6 +214,22 @@ def process_address_for_mapping(address, order_id=None, api_key=None):
         logger.error(f"Error processing address for mapping: {str(e)}")
         return None
 
+def get_patient_address(results):
+    """
+    Get the patient address from order processing results.
+    
+    Args:
+        results: Order processing results dictionary
+        
+    Returns:
+        Patient address string or None if not present
+    """
+    extracted_data = results.get("extracted_data", {})
+    # Use the normalized structure
+    patient_info = extracted_data.get("patient_info", {})
+    patient_address_data = patient_info.get("patient_address", {})
+    return patient_address_data.get("value") if isinstance(patient_address_data, dict) else None
+
 def add_mapping_to_results(results, api_key=None):
     """
     Add mapping data to order processing results.
@@ -150,12 +248,7 @@ def add_mapping_to_results(results, api_key=None):
     try:
         # Extract patient address from results
         order_id = results.get("order_id")
-        
-        extracted_data = results.get("extracted_data", {})
-        # Use the normalized structure
-        patient_info = extracted_data.get("patient_info", {})
-        patient_address_data = patient_info.get("patient_address", {})
-        patient_address = patient_address_data.get("value") if isinstance(patient_address_data, dict) else None
+        patient_address = get_patient_address(results)
         
         if not patient_address:
             logger.warning(f"No patient address found in results for order {order_id}")
@@ -180,4 +273,51 @@ def add_mapping_to_results(results, api_key=None):
     except Exception as e:
         logger.error(f"Error adding mapping to results: {str(e)}")
         results["mapping_data"] = {"status": "error", "message": str(e)}
-        return results
\ No newline at end of file
+        return results
+
+def add_mapping_to_results_many(results_list, api_key=None):
+    """
+    Add mapping data to many order results, geocoding each distinct address once.
+    
+    Args:
+        results_list: List of order processing results dictionaries
+        api_key: Optional OSM API key
+        
+    Returns:
+        The same list, with mapping_data set on every results dictionary
+    """
+    if not config.ENABLE_GEOCODING:
+        logger.info("Geocoding is disabled in configuration")
+        return results_list
+    
+    api_key = api_key or config.OSM_API_KEY
+    addresses = []
+    for results in results_list:
+        try:
+            addresses.append(get_patient_address(results))
+        except Exception as e:
+            logger.error(f"Error reading patient address for order {results.get('order_id')}: {str(e)}")
+            addresses.append(None)
+    
+    geocoded = geocode_many(addresses, api_key)
+    
+    for results, patient_address, geocode_data in zip(results_list, addresses, geocoded):
+        order_id = results.get("order_id")
+        if not patient_address:
+            logger.warning(f"No patient address found in results for order {order_id}")
+            results["mapping_data"] = {"status": "no_address_found"}
+            continue
+        if not geocode_data:
+            logger.warning(f"Could not geocode address: {patient_address}")
+            results["mapping_data"] = {"status": "geocoding_failed"}
+            continue
+        
+        mapping_data = process_address_for_mapping(
+            address=patient_address,
+            order_id=order_id,
+            api_key=api_key,
+            geocode_data=geocode_data
+        )
+        results["mapping_data"] = mapping_data if mapping_data else {"status": "geocoding_failed"}
+    
+    return results_list
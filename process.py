@@ -4,13 +4,15 @@ Process order folders and prepare data for LLM with enhanced HCFA-like functiona
 import os
 import json
 import shutil
+from functools import partial
 from pathlib import Path
 import logging
-from extract import extract_text, initialize_documentai
+from concurrent.futures import ThreadPoolExecutor
+from extract import extract_text, get_documentai_client
 import config
-from mapping import add_mapping_to_results
+from mapping import add_mapping_to_results, add_mapping_to_results_many, queue_static_map
 # Import the updated provider_mapping function that only takes one argument
-from provider_mapping_simple import add_provider_mapping_to_results
+from provider_mapping_simple import add_provider_mapping_to_results, add_provider_mapping_to_results_bulk
 from email_converter import convert_email_to_pdf
 
 # Set up logging
@@ -37,18 +39,16 @@ def process_order_folder(order_folder):
         "documents": []
     }
     
-    # Process all files in the order folder
-    file_count = 0
-    
-    # First, initialize Google Document AI
+    # First, initialize Google Document AI (shared by every order and document)
     try:
-        initialize_documentai()
+        get_documentai_client()
     except Exception as e:
         logger.error(f"Failed to initialize Document AI: {str(e)}")
         return order_data
     
-    # Process all files in the order folder
-    for file_path in order_path.glob("*"):
+    # Collect the files to process, in a stable order
+    file_paths = []
+    for file_path in sorted(order_path.glob("*")):
         if not file_path.is_file():
             continue
             
@@ -62,8 +62,7 @@ def process_order_folder(order_folder):
             logger.warning(f"Skipping unsupported file type: {file_path}")
             continue
         
-        file_count += 1
-        logger.info(f"Processing file {file_count}: {file_path.name}")
+        logger.info(f"Processing file {len(file_paths) + 1}: {file_path.name}")
         
         # Convert email files to PDF before processing
         if file_path.suffix.lower() == '.eml':
@@ -75,9 +74,17 @@ def process_order_folder(order_folder):
                 logger.error(f"Failed to convert email to PDF: {str(e)}")
                 continue
         
-        # Extract text from the document using appropriate method
-        extracted_text = extract_text(file_path)
-        
+        file_paths.append(file_path)
+    
+    # Extract text from the documents concurrently (results come back in file order)
+    workers = max(1, min(config.OCR_MAX_WORKERS, len(file_paths)))
+    if workers == 1:
+        extracted_texts = [extract_text(file_path) for file_path in file_paths]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"ocr-{order_id}") as executor:
+            extracted_texts = list(executor.map(extract_text, file_paths))
+    
+    for file_path, extracted_text in zip(file_paths, extracted_texts):
         # Save OCR text to the OCR directory
         ocr_file_path = config.OCR_DIR / f"{order_id}_{file_path.stem}.txt"
         with open(ocr_file_path, 'w', encoding='utf-8') as f:
@@ -92,7 +99,7 @@ def process_order_folder(order_folder):
         
         order_data["documents"].append(document_data)
     
-    logger.info(f"Completed processing {file_count} files for order {order_id}")
+    logger.info(f"Completed processing {len(file_paths)} files for order {order_id}")
     return order_data
 
 def format_llm_request(order_data):
@@ -231,7 +238,7 @@ def normalize_extracted_data(extracted_data):
     
     return normalized
 
-def save_results(order_id, processed_data, api_request, llm_response):
+def save_results(order_id, processed_data, api_request, llm_response, add_mapping=True):
     """
     Save processing results to output directory.
     
@@ -240,6 +247,8 @@ def save_results(order_id, processed_data, api_request, llm_response):
         processed_data: Processed order data
         api_request: LLM API request
         llm_response: LLM API response
+        add_mapping: Add geocoding and provider mapping now; pass False when the
+            caller maps many orders at once with add_mapping_to_saved_results
         
     Returns:
         Results dictionary
@@ -294,13 +303,31 @@ def save_results(order_id, processed_data, api_request, llm_response):
     }
     
     # Add mapping data if geocoding is enabled
-    if config.ENABLE_GEOCODING:
+    if add_mapping and config.ENABLE_GEOCODING:
         results = add_mapping_to_results(results)
         
         # Add provider mapping if geocoding succeeded
         # Call the simplified version that only takes one argument
         results = add_provider_mapping_to_results(results)
     
+    write_results(order_id, results)
+    
+    if add_mapping:
+        queue_background_maps([results])
+    
+    return results
+
+def write_results(order_id, results):
+    """
+    Write an order's results dictionary to the output directory.
+    
+    Args:
+        order_id: ID of the processed order
+        results: Results dictionary
+        
+    Returns:
+        Path to the results file
+    """
     output_path = config.OUTPUT_DIR / f"{order_id}_results.json"
     
     # Ensure output directory exists
@@ -311,4 +338,71 @@ def save_results(order_id, processed_data, api_request, llm_response):
     
     logger.info(f"Results saved to {output_path}")
     
-    return results
\ No newline at end of file
+    return output_path
+
+def add_mapping_to_saved_results(results_list):
+    """
+    Add geocoding and provider mapping to many saved orders in one pass and rewrite them.
+    
+    Each distinct patient address is geocoded once across all orders, and
+    providers are matched for all orders with one bulk search. If the batch
+    fails, the orders it did not finish are mapped one at a time, and every
+    order is written on its own, so one bad order never costs the others
+    their mapping.
+    
+    Args:
+        results_list: Results dictionaries returned by save_results(..., add_mapping=False)
+        
+    Returns:
+        The same list, with mapping_data and provider_mapping added
+    """
+    if not config.ENABLE_GEOCODING or not results_list:
+        return results_list
+    
+    try:
+        add_mapping_to_results_many(results_list)
+        add_provider_mapping_to_results_bulk(results_list)
+    except Exception as e:
+        logger.error(f"Error mapping {len(results_list)} orders together, mapping them one at a time: {str(e)}")
+    
+    written = []
+    for results in results_list:
+        order_id = results.get("order_id")
+        try:
+            if "mapping_data" not in results or "provider_mapping" not in results:
+                results = add_mapping_to_results(results)
+                results = add_provider_mapping_to_results(results)
+            write_results(order_id, results)
+            written.append(results)
+        except Exception as e:
+            logger.error(f"Error adding mapping to results for order {order_id}: {str(e)}")
+    
+    queue_background_maps(written)
+    
+    return results_list
+
+def queue_background_maps(results_list):
+    """
+    Render the pending maps of saved results in the background.
+    
+    Only results saved with config.MAP_GENERATION_MODE = "background" have
+    pending maps. Each results file is rewritten with the map's path and
+    status once its map is done (main waits for this before exiting).
+    
+    Args:
+        results_list: Results dictionaries already written with write_results
+    """
+    for results in results_list:
+        mapping_data = results.get("mapping_data") or {}
+        if mapping_data.get("map_status") != "pending":
+            continue
+        queue_static_map(mapping_data["map_request"], api_key=config.OSM_API_KEY,
+                         on_done=partial(_record_background_map, results))
+
+def _record_background_map(results, map_path):
+    # Called from the map rendering thread; nothing else writes these results any more
+    mapping_data = results["mapping_data"]
+    mapping_data["map_path"] = str(map_path) if map_path else None
+    mapping_data["map_status"] = "ready" if map_path else "failed"
+    mapping_data.pop("map_request", None)
+    write_results(results["order_id"], results)
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""
+Long-lived, thread-safe read-only access to the provider SQLite database.
+"""
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class ProviderDatabase:
+    """
+    Pool of read-only SQLite connections, one per thread.
+
+    SQLite connections must not be shared between threads mid-statement, so
+    each thread lazily opens its own connection and keeps it for the life of
+    the process. Connections are opened read-only with memory-mapped I/O,
+    ``query_only`` enabled and a prepared-statement cache.
+    """
+
+    def __init__(self, db_path, mmap_size=256 * 1024 * 1024, cached_statements=256, functions=None):
+        """
+        Set up the pool. No connection is opened until first use.
+
+        Args:
+            db_path: Path to the provider SQLite database
+            mmap_size: Bytes of the database file to memory-map
+            cached_statements: Prepared statements cached per connection
+            functions: Optional {name: callable} of one-argument SQL functions
+                registered on every connection
+        """
+        self.db_path = str(db_path)
+        self.mmap_size = int(mmap_size)
+        self.cached_statements = int(cached_statements)
+        self.functions = dict(functions or {})
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        uri = Path(self.db_path).absolute().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        for name, function in self.functions.items():
+            conn.create_function(name, 1, function, deterministic=True)
+        logger.info(f"Opened read-only provider database connection: {self.db_path}")
+        return conn
+
+    def connection(self):
+        """Get the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def cursor(self):
+        """Get a new cursor on the calling thread's connection."""
+        return self.connection().cursor()
+
+    def close(self):
+        """Close every pooled connection. The pool reopens connections on next use."""
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections = []
+            # A fresh thread-local store drops every thread's closed connection
+            self._local = threading.local()
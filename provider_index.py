@@ -0,0 +1,320 @@
+"""
+In-memory spatial index over provider coordinates for fast nearest-provider lookups.
+
+Providers are stored as 3D unit vectors on the sphere. Straight-line (chord)
+distance between unit vectors grows monotonically with great-circle distance,
+so the k nearest points in the KD-tree are exactly the k nearest providers.
+"""
+import heapq
+import logging
+import math
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from referrals import geohash
+from referrals.provider_rtree import bounding_box, EARTH_RADIUS_MILES, MAX_SEARCH_RADIUS_MILES
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Maximum number of points kept in a single leaf of the tree
+LEAF_SIZE = 8
+
+def to_unit_vector(lat, lon):
+    """
+    Convert a latitude/longitude pair into a 3D unit vector.
+
+    Args:
+        lat: Latitude in degrees
+        lon: Longitude in degrees
+
+    Returns:
+        Tuple (x, y, z) on the unit sphere
+    """
+    lat_rad = math.radians(lat)
+    lon_rad = math.radians(lon)
+    cos_lat = math.cos(lat_rad)
+    return (cos_lat * math.cos(lon_rad), cos_lat * math.sin(lon_rad), math.sin(lat_rad))
+
+def chord_sq_for_distance(miles):
+    """
+    Squared unit-sphere chord length for a great-circle distance.
+
+    Args:
+        miles: Great-circle distance in miles
+
+    Returns:
+        Squared chord length, slightly padded so boundary points are kept
+    """
+    theta = miles / EARTH_RADIUS_MILES
+    if theta >= math.pi:
+        return float("inf")
+    return (2 * math.sin(theta / 2)) ** 2 + 1e-12
+
+def distance_for_chord_sq(chord_sq):
+    """Great-circle distance in miles for a squared unit-sphere chord length."""
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(chord_sq) / 2))
+
+class KDTree:
+    """Static KD-tree over 3D points supporting k-nearest-neighbour queries."""
+
+    def __init__(self, points):
+        """
+        Build the tree.
+
+        Args:
+            points: Sequence of (x, y, z) tuples
+        """
+        self.points = list(points)
+        self._perm = list(range(len(self.points)))
+        # Each node is (lo, hi, axis, split, left, right); leaves have axis -1
+        self._nodes = []
+        self._root = self._build(0, len(self.points)) if self.points else None
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self, lo, hi):
+        node_id = len(self._nodes)
+        if hi - lo <= LEAF_SIZE:
+            self._nodes.append((lo, hi, -1, 0.0, -1, -1))
+            return node_id
+
+        points = self.points
+        idx = self._perm[lo:hi]
+
+        # Split on the axis with the largest spread
+        axis = 0
+        best_spread = -1.0
+        for candidate in range(3):
+            values = [points[i][candidate] for i in idx]
+            spread = max(values) - min(values)
+            if spread > best_spread:
+                axis, best_spread = candidate, spread
+
+        idx.sort(key=lambda i: points[i][axis])
+        self._perm[lo:hi] = idx
+        mid = (lo + hi) // 2
+        split = points[idx[mid - lo]][axis]
+
+        # Reserve the slot so children get later ids
+        self._nodes.append(None)
+        left = self._build(lo, mid)
+        right = self._build(mid, hi)
+        self._nodes[node_id] = (lo, hi, axis, split, left, right)
+        return node_id
+
+    def query(self, point, k, accept=None, max_sq_dist=None):
+        """
+        Find the k points closest to a query point.
+
+        Args:
+            point: Query point (x, y, z)
+            k: Number of neighbours to return
+            accept: Optional predicate on point index; rejected points are skipped
+            max_sq_dist: Optional bound on squared distance; subtrees beyond it are pruned
+
+        Returns:
+            List of (squared_distance, point_index) tuples, closest first.
+            Ties are broken by the lower point index.
+        """
+        if self._root is None or k <= 0:
+            return []
+
+        qx, qy, qz = point
+        points = self.points
+        perm = self._perm
+        nodes = self._nodes
+        limit = float("inf") if max_sq_dist is None else max_sq_dist
+        # Max-heap of the best k so far, stored as (-sq_dist, -index)
+        heap = []
+
+        def visit(node_id):
+            lo, hi, axis, split, left, right = nodes[node_id]
+            if axis < 0:
+                for pos in range(lo, hi):
+                    i = perm[pos]
+                    px, py, pz = points[i]
+                    d2 = (px - qx) ** 2 + (py - qy) ** 2 + (pz - qz) ** 2
+                    if d2 > limit:
+                        continue
+                    if len(heap) < k:
+                        if accept is None or accept(i):
+                            heapq.heappush(heap, (-d2, -i))
+                    elif (d2, i) < (-heap[0][0], -heap[0][1]):
+                        if accept is None or accept(i):
+                            heapq.heapreplace(heap, (-d2, -i))
+                return
+
+            diff = point[axis] - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            bound = -heap[0][0] if len(heap) == k else limit
+            if diff * diff <= bound:
+                visit(far)
+
+        visit(self._root)
+        return sorted((-neg_d2, -neg_i) for neg_d2, neg_i in heap)
+
+class ProviderIndex:
+    """Spatial index over provider records with float ``lat``/``lon`` fields."""
+
+    def __init__(self, providers, coordinates=None):
+        """
+        Build the index.
+
+        Args:
+            providers: Sequence of provider dictionaries with numeric 'lat' and 'lon'
+            coordinates: Optional iterable of (lat, lon) pairs aligned with providers,
+                used instead of reading every provider record
+        """
+        self.providers = providers if isinstance(providers, Sequence) else list(providers)
+        if coordinates is None:
+            coordinates = ((p['lat'], p['lon']) for p in self.providers)
+        self._tree = KDTree(to_unit_vector(lat, lon) for lat, lon in coordinates)
+        logger.info(f"Built provider spatial index over {len(self.providers)} providers")
+
+    def __len__(self):
+        return len(self.providers)
+
+    def nearest(self, latitude, longitude, k=3, accept=None, max_distance=None):
+        """
+        Find the k providers closest to a location.
+
+        Args:
+            latitude: Query latitude
+            longitude: Query longitude
+            k: Number of providers to return
+            accept: Optional predicate on provider position; rejected providers are
+                skipped during the search rather than filtered afterwards
+            max_distance: Optional maximum distance in miles
+
+        Returns:
+            List of provider records ordered by distance
+        """
+        return [record for _, record in self.nearest_with_distances(latitude, longitude, k, accept, max_distance)]
+
+    def nearest_with_distances(self, latitude, longitude, k=3, accept=None, max_distance=None):
+        """
+        Like nearest(), but also return each provider's great-circle distance.
+
+        Returns:
+            List of (distance_miles, provider_record) tuples ordered by distance
+        """
+        max_sq_dist = chord_sq_for_distance(max_distance) if max_distance is not None else None
+        matches = self._tree.query(to_unit_vector(latitude, longitude), k, accept=accept, max_sq_dist=max_sq_dist)
+        return [(distance_for_chord_sq(d2), self.providers[i]) for d2, i in matches]
+
+class ShardedProviderIndex:
+    """
+    Provider index partitioned into geohash cells that are loaded lazily.
+
+    Each shard is a ProviderIndex over the providers in one geohash cell. A
+    search starts with the cells around the patient and expands to
+    neighbouring cells only until the k nearest providers are proven found,
+    so a worker serving one region only ever loads that region's providers.
+    At most max_shards shards are kept, least recently used first out, and a
+    search that would have to reach beyond max_radius is handed to a
+    fallback search instead of loading cells across the globe.
+    """
+
+    def __init__(self, load_shard, precision=3, initial_radius=25, max_radius=200, max_shards=256):
+        """
+        Set up the index. No shard is loaded until a search needs it.
+
+        Args:
+            load_shard: Callable taking a geohash cell and returning the provider
+                records inside it
+            precision: Geohash precision of the shard cells
+            initial_radius: First search radius in miles
+            max_radius: Largest radius in miles searched through shards when the
+                search has a fallback
+            max_shards: Number of shards kept in memory
+        """
+        self._load_shard = load_shard
+        self.precision = precision
+        self.initial_radius = initial_radius
+        self.max_radius = max_radius
+        self.max_shards = max_shards
+        self._shards = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards.values())
+
+    @property
+    def loaded_cells(self):
+        """Geohash cells whose shards are currently in memory."""
+        return set(self._shards)
+
+    def shard(self, cell):
+        """Get the shard for a geohash cell, loading it on first use."""
+        with self._lock:
+            shard = self._shards.get(cell)
+            if shard is not None:
+                self._shards.move_to_end(cell)
+                return shard
+            shard = ProviderIndex(self._load_shard(cell))
+            self._shards[cell] = shard
+            while len(self._shards) > self.max_shards:
+                self._shards.popitem(last=False)
+            return shard
+
+    def nearest(self, latitude, longitude, k=3, accept=None, max_distance=None, fallback=None):
+        """
+        Find the k providers closest to a location.
+
+        Args:
+            latitude: Query latitude
+            longitude: Query longitude
+            k: Number of providers to return
+            accept: Optional predicate on a provider record
+            max_distance: Optional maximum distance in miles
+            fallback: Optional callable without arguments returning the same
+                result another way; used when the search would grow past max_radius
+
+        Returns:
+            List of provider records ordered by distance
+        """
+        if k <= 0:
+            return []
+
+        radius = self.initial_radius
+        if max_distance is not None:
+            radius = min(radius, max_distance)
+
+        searched = set()
+        best = []
+        while True:
+            cells = geohash.cells_covering(*bounding_box(latitude, longitude, radius), self.precision) - searched
+            for cell in sorted(cells):
+                shard = self.shard(cell)
+                shard_accept = None
+                if accept is not None:
+                    shard_accept = lambda i, providers=shard.providers: accept(providers[i])
+                for position, (distance, record) in enumerate(
+                        shard.nearest_with_distances(latitude, longitude, k, shard_accept, max_distance)):
+                    best.append((distance, cell, position, record))
+                searched.add(cell)
+
+            # A shard's own top k never changes, so only the merged best k is kept
+            best.sort(key=lambda match: match[:3])
+            best = best[:k]
+
+            if len(best) >= k and best[-1][0] <= radius:
+                break
+            if radius >= MAX_SEARCH_RADIUS_MILES or (max_distance is not None and radius >= max_distance):
+                break
+            # Every provider closer than the current kth lies within that radius
+            radius = best[-1][0] if len(best) >= k else radius * 2
+            radius = min(radius, MAX_SEARCH_RADIUS_MILES)
+            if max_distance is not None:
+                radius = min(radius, max_distance)
+            if fallback is not None and radius > self.max_radius:
+                # Few matching providers nearby; covering this radius with cells would load far too many
+                logger.info(f"Sharded search needs {radius:.0f} miles, using fallback search")
+                return fallback()
+
+        return [record for _, _, _, record in best]
@@ -2,12 +2,21 @@
 Simplified module for mapping patient addresses to nearby providers based purely on distance.
 Updated to support multiple procedures and CPT codes.
 """
+import heapq
 import logging
 import sqlite3
 import math
+import threading
+import time
 from pathlib import Path
 import json
-import config
+import numpy as np
+from referrals import config, geohash
+from referrals.provider_index import ProviderIndex, ShardedProviderIndex
+from referrals.distance_engine import DistanceEngine
+from referrals.provider_db import ProviderDatabase
+from referrals.provider_rtree import create_provider_rtree, has_provider_rtree, bounding_box, EARTH_RADIUS_MILES, MAX_SEARCH_RADIUS_MILES
+from referrals.provider_snapshot import snapshot_dir_for, db_fingerprint, compile_snapshot, load_snapshot, normalize_attribute
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -16,6 +25,91 @@ logger = logging.getLogger(__name__)
 # Database file path
 PROVIDER_DB_PATH = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\Documents\Bill_Review_INTERNAL\reference_tables\orders2.db"
 
+# Columns and filters used whenever provider rows are loaded for distance ranking
+PROVIDER_COLUMNS = """
+        PrimaryKey,
+        [DBA Name Billing Name],
+        TIN,
+        State,
+        Status,
+        [Provider Type],
+        [Provider Network],
+        City,
+        lat,
+        lon,
+        Email,
+        [Fax Number],
+        Phone,
+        Website
+"""
+
+PROVIDER_FILTERS = """
+    lat IS NOT NULL 
+    AND lon IS NOT NULL 
+    AND lat != '' 
+    AND lon != ''
+    AND [DBA Name Billing Name] IS NOT NULL
+    AND [DBA Name Billing Name] != ''
+"""
+
+PROVIDER_QUERY = f"""
+    SELECT {PROVIDER_COLUMNS}
+    FROM providers 
+    WHERE {PROVIDER_FILTERS}
+"""
+
+# Same providers, restricted to an R*Tree bounding box (min_lat, max_lat, min_lon, max_lon)
+PROVIDER_RTREE_QUERY = f"""
+    SELECT {PROVIDER_COLUMNS}
+    FROM providers_rtree 
+    JOIN providers ON providers.rowid = providers_rtree.id
+    WHERE {PROVIDER_FILTERS}
+    AND providers_rtree.max_lat >= ? 
+    AND providers_rtree.min_lat <= ?
+    AND providers_rtree.max_lon >= ? 
+    AND providers_rtree.min_lon <= ?
+"""
+
+# Provider filter arguments and the providers columns they match
+PROVIDER_FILTER_COLUMNS = {
+    "status": "Status",
+    "provider_type": "Provider Type",
+    "network": "Provider Network",
+    "state": "State",
+}
+
+# Pooled read-only database access, shared by all threads
+_provider_db = None
+
+# Provider records and the search structures built over them, loaded once per process
+_provider_records = None
+_provider_index = None
+_distance_engine = None
+_provider_attributes = None
+_sharded_provider_index = None
+_provider_cache_lock = threading.RLock()
+
+# Database fingerprint the sharded index was built against, and when it was last checked
+_sharded_fingerprint = None
+_sharded_checked_at = 0.0
+
+# Memory-mapped provider snapshot backing _provider_records (None when serving in-memory records)
+_provider_snapshot = None
+
+# Database fingerprint _provider_records were loaded from, and when it was last checked
+_provider_fingerprint = None
+_provider_checked_at = 0.0
+
+# Expression index on ppo created by setup_provider_database, and whether it exists (None until checked)
+RATE_INDEX_NAME = "idx_ppo_proc_tin"
+_rate_index_ready = None
+
+# Whether the providers R*Tree exists (None until checked)
+_provider_rtree_ready = None
+
+# Maximum number of TINs bound into a single rate query
+RATE_BATCH_SIZE = 500
+
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
     Calculate distance between two points using the Haversine formula.
@@ -41,11 +135,8 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
     
-    # Earth's radius in miles
-    radius = 3956
-    
     # Distance in miles
-    distance = radius * c
+    distance = EARTH_RADIUS_MILES * c
     
     return distance
 
@@ -92,15 +183,659 @@ def get_provider_rate(cursor, tin, proc_code):
         logger.error(f"Error getting provider rate: {str(e)}")
         return None
 
-def find_nearest_providers(latitude, longitude, proc_code=None, limit=3):
+def create_rate_index(conn):
+    """
+    Create the expression index that lets rate lookups avoid full ppo scans.
+    
+    The index is built on exactly the normalized expressions used in the rate
+    queries, so SQLite can use it for both single and batched lookups.
+    
+    Args:
+        conn: Writable SQLite connection to the provider database
+    """
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS {RATE_INDEX_NAME} 
+        ON ppo (TRIM(UPPER(proc_cd)), TRIM(TIN))
+    """)
+    conn.commit()
+
+def setup_provider_database(db_path=None):
+    """
+    Create the ppo rate index and providers R*Tree; run once after the database is (re)built.
+    
+    Lookups never change the database themselves: it is opened read-only, and
+    a schema change would also invalidate the provider snapshot.
+    
+    Args:
+        db_path: Optional database path (defaults to PROVIDER_DB_PATH)
+    """
+    db_path = db_path or PROVIDER_DB_PATH
+    conn = sqlite3.connect(db_path)
+    try:
+        create_rate_index(conn)
+        logger.info(f"Created ppo rate index in {db_path}")
+        # Triggers keep the R*Tree in sync with later changes to providers.lat/lon
+        create_provider_rtree(conn)
+        logger.info(f"Created providers R*Tree in {db_path}")
+    finally:
+        conn.close()
+
+def rate_index_available():
+    """
+    Whether the ppo rate index exists, checked once per process.
+    
+    Rate lookups still work without it, scanning ppo instead.
+    
+    Returns:
+        True if setup_provider_database has created the index
+    """
+    global _rate_index_ready
+    with _provider_cache_lock:
+        if _rate_index_ready is None:
+            try:
+                cursor = get_provider_db().cursor()
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (RATE_INDEX_NAME,))
+                _rate_index_ready = cursor.fetchone() is not None
+            except sqlite3.Error as e:
+                logger.warning(f"Could not check for the ppo rate index: {str(e)}")
+                _rate_index_ready = False
+            if not _rate_index_ready:
+                logger.warning("ppo rate index missing, rate lookups will scan; "
+                               "run provider_mapping_simple.py --setup to create it")
+        return _rate_index_ready
+
+def provider_rtree_available():
+    """
+    Whether the providers R*Tree used by the "rtree" and "sharded" search modes exists.
+    
+    Checked once per process (and again after the database changes); without
+    it those modes fall back to the in-memory spatial index.
+    
+    Returns:
+        True if setup_provider_database has created the R*Tree
+    """
+    global _provider_rtree_ready
+    with _provider_cache_lock:
+        if _provider_rtree_ready is None:
+            try:
+                _provider_rtree_ready = has_provider_rtree(get_provider_db().cursor())
+            except sqlite3.Error as e:
+                logger.warning(f"Could not check for the providers R*Tree: {str(e)}")
+                _provider_rtree_ready = False
+            if not _provider_rtree_ready:
+                logger.warning("providers R*Tree missing, R*Tree and sharded searches use the spatial index; "
+                               "run provider_mapping_simple.py --setup to create it")
+        return _provider_rtree_ready
+
+def get_provider_rate_table(cursor, tins, proc_codes):
+    """Get rates for many provider TINs and procedure codes in a single batched query.
+    
+    Args:
+        cursor: Database cursor
+        tins: Iterable of provider TINs (will be cleaned)
+        proc_codes: Iterable of procedure codes (will be trimmed)
+        
+    Returns:
+        Dictionary mapping normalized procedure code to {clean TIN: rate};
+        TINs without a rate are omitted
+    """
+    rate_table = {}
+    try:
+        clean_tins = sorted({t for t in (clean_tin(tin) for tin in tins) if t})
+        # Trim the procedure codes and convert to uppercase
+        codes = sorted({str(code).strip().upper() for code in proc_codes if code})
+        if not clean_tins or not codes:
+            return rate_table
+        
+        code_placeholders = ",".join("?" * len(codes))
+        
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(clean_tins), RATE_BATCH_SIZE):
+            batch = clean_tins[start:start + RATE_BATCH_SIZE]
+            tin_placeholders = ",".join("?" * len(batch))
+            cursor.execute(f"""
+                SELECT TRIM(UPPER(proc_cd)), TRIM(TIN), rate 
+                FROM ppo 
+                WHERE TRIM(UPPER(proc_cd)) IN ({code_placeholders}) 
+                AND TRIM(TIN) IN ({tin_placeholders})
+                ORDER BY rowid
+            """, codes + batch)
+            
+            for code, tin, rate in cursor.fetchall():
+                rates = rate_table.setdefault(code, {})
+                # Keep the first match per TIN, like get_provider_rate
+                if tin in rates:
+                    continue
+                try:
+                    rates[tin] = float(rate)
+                except (ValueError, TypeError):
+                    rates[tin] = None
+        
+        return rate_table
+        
+    except Exception as e:
+        logger.error(f"Error getting provider rates: {str(e)}")
+        return rate_table
+
+def get_provider_rates(cursor, tins, proc_code):
+    """Get rates for many provider TINs and one procedure code in a single batched query.
+    
+    Args:
+        cursor: Database cursor
+        tins: Iterable of provider TINs (will be cleaned)
+        proc_code: Procedure code (will be trimmed)
+        
+    Returns:
+        Dictionary mapping clean TIN to rate; TINs without a rate are omitted
+    """
+    if not proc_code:
+        return {}
+    rate_table = get_provider_rate_table(cursor, tins, [proc_code])
+    return rate_table.get(str(proc_code).strip().upper(), {})
+
+def get_rated_tins(cursor, proc_code):
+    """Get the set of clean TINs that have a contracted rate for a procedure code.
+    
+    Args:
+        cursor: Database cursor
+        proc_code: Procedure code (will be trimmed)
+        
+    Returns:
+        Set of TINs with a rate row for the code
+    """
+    try:
+        cursor.execute("""
+            SELECT DISTINCT TRIM(TIN) 
+            FROM ppo 
+            WHERE TRIM(UPPER(proc_cd)) = ?
+        """, (str(proc_code).strip().upper(),))
+        return {row[0] for row in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Error getting rated TINs: {str(e)}")
+        return set()
+
+def load_provider_records(cursor, query=PROVIDER_QUERY, params=()):
+    """
+    Load geocoded providers with parsed coordinates and cleaned TINs.
+    
+    Args:
+        cursor: Database cursor
+        query: Provider query selecting PROVIDER_COLUMNS (defaults to all providers)
+        params: Query parameters
+        
+    Returns:
+        List of provider dictionaries with float 'lat'/'lon' and 'clean_tin'
+    """
+    cursor.execute(query, params)
+    column_names = [description[0] for description in cursor.description]
+    
+    records = []
+    for provider in cursor.fetchall():
+        provider_dict = dict(zip(column_names, provider))
+        
+        # Skip providers with invalid coordinates
+        try:
+            provider_dict['lat'] = float(provider_dict['lat'])
+            provider_dict['lon'] = float(provider_dict['lon'])
+        except (ValueError, TypeError):
+            continue
+        
+        provider_dict['clean_tin'] = clean_tin(provider_dict['TIN'])
+        records.append(provider_dict)
+    
+    return records
+
+def get_provider_db():
+    """
+    Get the process-wide pooled provider database.
+    
+    Returns:
+        ProviderDatabase for PROVIDER_DB_PATH, reopened if the path changes
+    """
+    global _provider_db
+    with _provider_cache_lock:
+        if _provider_db is None or _provider_db.db_path != str(PROVIDER_DB_PATH):
+            if _provider_db is not None:
+                _provider_db.close()
+            logger.info(f"Connecting to provider database: {PROVIDER_DB_PATH}")
+            _provider_db = ProviderDatabase(
+                PROVIDER_DB_PATH,
+                mmap_size=config.PROVIDER_DB_MMAP_SIZE,
+                cached_statements=config.PROVIDER_DB_CACHED_STATEMENTS,
+                # Lets SQL filters normalize column values exactly like the in-memory searches
+                functions={"normalize_attribute": normalize_attribute}
+            )
+        return _provider_db
+
+def _load_snapshot_records(cursor, fingerprint):
+    """Load provider records from the compiled snapshot, recompiling it if stale."""
+    global _provider_snapshot
+    snapshot_dir = snapshot_dir_for(PROVIDER_DB_PATH)
+    
+    snapshot = load_snapshot(snapshot_dir, fingerprint)
+    if snapshot is None:
+        records = load_provider_records(cursor)
+        try:
+            compile_snapshot(snapshot_dir, records, fingerprint, attribute_columns=list(PROVIDER_FILTER_COLUMNS.values()))
+            snapshot = load_snapshot(snapshot_dir, fingerprint)
+        except Exception as e:
+            logger.warning(f"Could not compile provider snapshot: {str(e)}")
+        if snapshot is None:
+            # Serve the freshly loaded records rather than fail the search
+            _provider_snapshot = None
+            return records
+    
+    logger.info(f"Loaded provider snapshot with {len(snapshot)} providers: {snapshot.path}")
+    _provider_snapshot = snapshot
+    return snapshot.records
+
+def _current_db_fingerprint():
+    """Fingerprint of PROVIDER_DB_PATH, or None if it cannot be read."""
+    try:
+        return db_fingerprint(PROVIDER_DB_PATH, get_provider_db().cursor())
+    except Exception as e:
+        logger.warning(f"Could not fingerprint provider database: {str(e)}")
+        return None
+
+def _provider_records_are_stale():
+    """Whether the database changed since the records were loaded, checked at most once per interval."""
+    global _provider_checked_at
+    now = time.monotonic()
+    if now - _provider_checked_at < config.PROVIDER_SNAPSHOT_CHECK_INTERVAL:
+        return False
+    _provider_checked_at = now
+    # Checked whether the records came from the snapshot or straight from the database
+    fingerprint = _current_db_fingerprint()
+    if fingerprint is None or fingerprint == _provider_fingerprint:
+        return False
+    logger.info("Provider database changed, reloading provider records")
+    return True
+
+def get_provider_records(rebuild=False):
+    """
+    Get the process-wide sequence of geocoded provider records, loading it on first use.
+    
+    With config.PROVIDER_SNAPSHOT_ENABLED the records come from a memory-mapped
+    snapshot next to the database, which is recompiled whenever the database
+    file or its schema changes.
+    
+    Args:
+        rebuild: Force the records to be reloaded from the database
+        
+    Returns:
+        Sequence of provider dictionaries shared by the in-memory search structures
+    """
+    global _provider_records, _provider_index, _distance_engine, _provider_attributes, _sharded_provider_index
+    global _provider_snapshot, _provider_fingerprint, _provider_checked_at, _rate_index_ready, _provider_rtree_ready
+    with _provider_cache_lock:
+        if _provider_records is None or rebuild or _provider_records_are_stale():
+            # The database may have been rebuilt (or set up) since indexes were checked
+            _rate_index_ready = None
+            _provider_rtree_ready = None
+            cursor = get_provider_db().cursor()
+            _provider_fingerprint = db_fingerprint(PROVIDER_DB_PATH, cursor)
+            if config.PROVIDER_SNAPSHOT_ENABLED:
+                _provider_records = _load_snapshot_records(cursor, _provider_fingerprint)
+            else:
+                _provider_snapshot = None
+                _provider_records = load_provider_records(cursor)
+            _provider_checked_at = time.monotonic()
+            # Structures built over the old records are stale now
+            _provider_index = None
+            _distance_engine = None
+            _provider_attributes = None
+            _sharded_provider_index = None
+        return _provider_records
+
+def get_provider_index(rebuild=False):
+    """
+    Get the process-wide provider spatial index, building it on first use.
+    
+    Args:
+        rebuild: Force the index to be rebuilt from the database
+        
+    Returns:
+        ProviderIndex over all providers with valid coordinates
+    """
+    global _provider_index
+    with _provider_cache_lock:
+        records = get_provider_records(rebuild=rebuild)
+        if _provider_index is None:
+            if _provider_snapshot is not None:
+                coordinates = zip(_provider_snapshot.lat.tolist(), _provider_snapshot.lon.tolist())
+                _provider_index = ProviderIndex(records, coordinates=coordinates)
+            else:
+                _provider_index = ProviderIndex(records)
+        return _provider_index
+
+def get_distance_engine(rebuild=False):
+    """
+    Get the process-wide vectorized distance engine, building it on first use.
+    
+    Args:
+        rebuild: Force the engine to be rebuilt from the database
+        
+    Returns:
+        DistanceEngine whose positions line up with get_provider_records()
+    """
+    with _provider_cache_lock:
+        return _distance_engine_for(get_provider_records(rebuild=rebuild))
+
+def _distance_engine_for(records):
+    """Build or reuse the distance engine over records just returned by get_provider_records (lock held)."""
+    global _distance_engine
+    if _distance_engine is None:
+        if _provider_snapshot is not None:
+            # Share the memory-mapped arrays instead of copying them
+            _distance_engine = DistanceEngine.from_radians(
+                _provider_snapshot.lat_rad, _provider_snapshot.lon_rad, _provider_snapshot.cos_lat
+            )
+        else:
+            _distance_engine = DistanceEngine.from_providers(records)
+    return _distance_engine
+
+def get_vectorized_search_data(with_attributes=False):
+    """
+    Get the provider records together with the structures built over them.
+    
+    Everything is taken under one lock acquisition, so a reload of the
+    provider database between separate calls cannot pair the engine's
+    positions with a different set of records.
+    
+    Args:
+        with_attributes: Also return the normalized filter-column arrays
+        
+    Returns:
+        Tuple (records, distance_engine, attributes); attributes is None
+        unless with_attributes is set
+    """
+    with _provider_cache_lock:
+        records = get_provider_records()
+        engine = _distance_engine_for(records)
+        attributes = _provider_attributes_for(records) if with_attributes else None
+        return records, engine, attributes
+
+def _build_search_criteria(cursor, proc_code=None, status=None, provider_type=None, network=None,
+                           state=None, max_distance=None, require_rate=False):
+    """
+    Normalize provider filter arguments into search criteria.
+    
+    Returns:
+        Dictionary with "columns" ({column: allowed normalized values}),
+        "max_distance" (miles or None) and "tins" (allowed clean TINs or None)
+    """
+    requested = {"status": status, "provider_type": provider_type, "network": network, "state": state}
+    columns = {}
+    for name, values in requested.items():
+        if values is None:
+            continue
+        if isinstance(values, str):
+            values = [values]
+        columns[PROVIDER_FILTER_COLUMNS[name]] = {normalize_attribute(v) for v in values}
+    
+    tins = None
+    if require_rate:
+        tins = get_rated_tins(cursor, proc_code) if proc_code else set()
+    
+    return {"columns": columns, "max_distance": max_distance, "tins": tins}
+
+def _has_criteria(criteria):
+    return bool(criteria) and bool(criteria["columns"] or criteria["max_distance"] is not None or criteria["tins"] is not None)
+
+def _record_matches(record, criteria):
+    """Check a provider record against the column and TIN criteria."""
+    for column, allowed in criteria["columns"].items():
+        if normalize_attribute(record.get(column)) not in allowed:
+            return False
+    if criteria["tins"] is not None and record.get('clean_tin') not in criteria["tins"]:
+        return False
+    return True
+
+def _load_provider_shard(cell):
+    """Load the providers whose coordinates fall inside one geohash cell (needs the R*Tree)."""
+    min_lat, max_lat, min_lon, max_lon = geohash.bounds(cell)
+    query = PROVIDER_RTREE_QUERY + " ORDER BY providers.rowid"
+    candidates = load_provider_records(get_provider_db().cursor(), query, (min_lat, max_lat, min_lon, max_lon))
+    
+    # Box edges are shared between cells; keep only providers this cell owns
+    records = [r for r in candidates if geohash.encode(r['lat'], r['lon'], len(cell)) == cell]
+    logger.info(f"Loaded provider shard {cell} with {len(records)} providers")
+    return records
+
+def get_sharded_provider_index():
+    """
+    Get the process-wide geohash-sharded provider index.
+    
+    Shards are loaded lazily the first time a search reaches their cell, and
+    all of them are dropped when the database changes (checked at most once
+    per config.PROVIDER_SNAPSHOT_CHECK_INTERVAL).
+    
+    Returns:
+        ShardedProviderIndex over PROVIDER_DB_PATH
+    """
+    global _sharded_provider_index, _sharded_fingerprint, _sharded_checked_at
+    with _provider_cache_lock:
+        now = time.monotonic()
+        if _sharded_provider_index is not None and now - _sharded_checked_at >= config.PROVIDER_SNAPSHOT_CHECK_INTERVAL:
+            _sharded_checked_at = now
+            fingerprint = _current_db_fingerprint()
+            if fingerprint is not None and fingerprint != _sharded_fingerprint:
+                logger.info("Provider database changed, dropping loaded provider shards")
+                _sharded_provider_index = None
+        
+        if _sharded_provider_index is None:
+            _sharded_fingerprint = _current_db_fingerprint()
+            _sharded_checked_at = now
+            _sharded_provider_index = ShardedProviderIndex(
+                _load_provider_shard,
+                precision=config.PROVIDER_SHARD_PRECISION,
+                initial_radius=config.PROVIDER_RTREE_INITIAL_RADIUS_MILES,
+                max_radius=config.PROVIDER_SHARD_MAX_RADIUS_MILES,
+                max_shards=config.PROVIDER_SHARD_CACHE_SIZE
+            )
+        return _sharded_provider_index
+
+def get_provider_attributes():
+    """
+    Get normalized filter-column values aligned with get_provider_records().
+    
+    Returns:
+        Dictionary mapping each filterable column, plus "clean_tin", to a NumPy
+        array of normalized values, one per provider record
+    """
+    with _provider_cache_lock:
+        return _provider_attributes_for(get_provider_records())
+
+def _provider_attributes_for(records):
+    """Build or reuse the filter-column arrays over records just returned by get_provider_records (lock held)."""
+    global _provider_attributes
+    if _provider_attributes is None:
+        columns = list(PROVIDER_FILTER_COLUMNS.values())
+        if _provider_snapshot is not None and all(c in _provider_snapshot.attributes for c in columns):
+            attributes = dict(_provider_snapshot.attributes)
+            attributes["clean_tin"] = _provider_snapshot.tins.astype(np.str_)
+        else:
+            attributes = {
+                column: np.array([normalize_attribute(r.get(column)) for r in records], dtype=np.str_)
+                for column in columns
+            }
+            attributes["clean_tin"] = np.array([r['clean_tin'] or '' for r in records], dtype=np.str_)
+        _provider_attributes = attributes
+    return _provider_attributes
+
+def _scan_nearest_records(cursor, latitude, longitude, limit, criteria):
+    """Brute-force reference search: rank every provider by distance."""
+    # First check if there are any providers in the database
+    cursor.execute("SELECT COUNT(*) FROM providers")
+    count = cursor.fetchone()[0]
+    logger.info(f"Total providers in database: {count}")
+    
+    providers = load_provider_records(cursor)
+    logger.info(f"Found {len(providers)} providers with valid coordinates")
+    
+    if _has_criteria(criteria):
+        providers = [p for p in providers if _record_matches(p, criteria)]
+    
+    # Sort by distance - pure distance-based, no filters
+    providers.sort(key=lambda p: round(calculate_distance(latitude, longitude, p['lat'], p['lon']), 2))
+    
+    # Return the closest N providers regardless of distance
+    return providers[:limit]
+
+def _indexed_nearest_records(cursor, latitude, longitude, limit, criteria):
+    """Spatial index search over the in-memory KD-tree, filtering while it searches."""
+    if not _has_criteria(criteria):
+        return get_provider_index().nearest(latitude, longitude, k=limit)
+    
+    # One lock acquisition so the index and attributes come from the same records
+    with _provider_cache_lock:
+        index = get_provider_index()
+        attributes = _provider_attributes_for(index.providers)
+    checks = [(attributes[column], allowed) for column, allowed in criteria["columns"].items()]
+    if criteria["tins"] is not None:
+        checks.append((attributes["clean_tin"], criteria["tins"]))
+    
+    def accept(i):
+        return all(values[i] in allowed for values, allowed in checks)
+    
+    return index.nearest(latitude, longitude, k=limit, accept=accept, max_distance=criteria["max_distance"])
+
+def _vectorized_nearest_records(cursor, latitude, longitude, limit, criteria):
+    """NumPy search: one vectorized distance pass plus argpartition top-k."""
+    records, engine, attributes = get_vectorized_search_data(with_attributes=_has_criteria(criteria))
+    mask = None
+    if _has_criteria(criteria):
+        mask = np.ones(len(records), dtype=bool)
+        for column, allowed in criteria["columns"].items():
+            mask &= np.isin(attributes[column], list(allowed))
+        if criteria["tins"] is not None:
+            mask &= np.isin(attributes["clean_tin"], list(criteria["tins"]))
+    
+    indices, _ = engine.nearest(
+        latitude, longitude, k=limit, mask=mask,
+        max_distance=criteria["max_distance"] if criteria else None
+    )
+    return [records[i] for i in indices]
+
+def _rtree_nearest_records(cursor, latitude, longitude, limit, criteria):
+    """R*Tree search: grow a bounding box until it provably holds the k nearest providers."""
+    if not provider_rtree_available():
+        return _indexed_nearest_records(cursor, latitude, longitude, limit, criteria)
+    
+    # Column filters become part of the R*Tree query itself
+    query = PROVIDER_RTREE_QUERY
+    column_params = []
+    for column, allowed in criteria["columns"].items():
+        query += f" AND normalize_attribute([{column}]) IN ({','.join('?' * len(allowed))})"
+        column_params.extend(sorted(allowed))
+    query += " ORDER BY providers.rowid"
+    
+    max_distance = criteria["max_distance"]
+    radius = config.PROVIDER_RTREE_INITIAL_RADIUS_MILES
+    if max_distance is not None:
+        radius = min(radius, max_distance)
+    while True:
+        records = load_provider_records(cursor, query, list(bounding_box(latitude, longitude, radius)) + column_params)
+        if criteria["tins"] is not None:
+            records = [r for r in records if r['clean_tin'] in criteria["tins"]]
+        
+        ranked = heapq.nsmallest(limit, (
+            (calculate_distance(latitude, longitude, r['lat'], r['lon']), position)
+            for position, r in enumerate(records)
+        ))
+        
+        if len(ranked) >= limit:
+            kth_distance = ranked[limit - 1][0] if limit > 0 else 0
+            # Anything closer than the kth candidate lies inside a box of that radius
+            if kth_distance <= radius:
+                break
+            radius = kth_distance
+        elif radius >= MAX_SEARCH_RADIUS_MILES or (max_distance is not None and radius >= max_distance):
+            # The box already covers every allowed distance; there are fewer than k providers
+            break
+        else:
+            radius = min(radius * 2, MAX_SEARCH_RADIUS_MILES)
+            if max_distance is not None:
+                radius = min(radius, max_distance)
+    
+    logger.info(f"R*Tree search examined {len(records)} candidates within {radius:.1f} miles")
+    return [records[position] for _, position in ranked[:limit]]
+
+def _sharded_nearest_records(cursor, latitude, longitude, limit, criteria):
+    """Sharded search: only the geohash cells around the patient are loaded and searched."""
+    if not provider_rtree_available():
+        return _indexed_nearest_records(cursor, latitude, longitude, limit, criteria)
+    
+    accept = None
+    if criteria["columns"] or criteria["tins"] is not None:
+        accept = lambda record: _record_matches(record, criteria)
+    return get_sharded_provider_index().nearest(
+        latitude, longitude, k=limit, accept=accept, max_distance=criteria["max_distance"],
+        fallback=lambda: _rtree_nearest_records(cursor, latitude, longitude, limit, criteria)
+    )
+
+# Nearest-provider strategies by search mode; each returns unrated records, closest first
+_NEAREST_RECORD_SEARCHES = {
+    "scan": _scan_nearest_records,
+    "kdtree": _indexed_nearest_records,
+    "numpy": _vectorized_nearest_records,
+    "rtree": _rtree_nearest_records,
+    "sharded": _sharded_nearest_records,
+}
+
+def _nearest_records(cursor, latitude, longitude, limit, search_mode, criteria=None):
+    """Rank providers by distance with the requested search mode, applying any criteria."""
+    search = _NEAREST_RECORD_SEARCHES.get(search_mode)
+    if search is None:
+        raise ValueError(f"Unknown provider search mode: {search_mode}")
+    criteria = criteria or {"columns": {}, "max_distance": None, "tins": None}
+    records = search(cursor, latitude, longitude, limit, criteria)
+    
+    # Every mode agrees on the exact haversine cutoff
+    max_distance = criteria["max_distance"]
+    if max_distance is not None:
+        records = [r for r in records if calculate_distance(latitude, longitude, r['lat'], r['lon']) <= max_distance]
+    return records
+
+def _materialize_providers(records, latitude, longitude, proc_code, rates):
+    """Copy matched records and attach distance and rate fields."""
+    nearest_providers = []
+    for record in records:
+        # Copy so per-query fields never leak into the shared records
+        provider_dict = dict(record)
+        distance = calculate_distance(latitude, longitude, provider_dict['lat'], provider_dict['lon'])
+        provider_dict['distance_miles'] = round(distance, 2)
+        
+        if proc_code and provider_dict['clean_tin']:
+            provider_dict['rate'] = rates.get(provider_dict['clean_tin'])
+        
+        nearest_providers.append(provider_dict)
+    
+    # Same ordering key as the brute-force scan
+    nearest_providers.sort(key=lambda x: x['distance_miles'])
+    return nearest_providers
+
+def find_nearest_providers(latitude, longitude, proc_code=None, limit=3, search_mode=None,
+                           status=None, provider_type=None, network=None, state=None,
+                           max_distance=None, require_rate=False):
     """
     Find the nearest providers from the database based purely on distance.
     
+    Filters are applied inside the search itself, so the result holds the
+    closest providers that pass them rather than a filtered top-k.
+    
     Args:
         latitude: Patient location latitude
         longitude: Patient location longitude
         proc_code: Optional procedure code to look up rates
         limit: Maximum number of providers to return (default 3)
+        search_mode: "kdtree", "numpy", "rtree", "sharded" or "scan" (defaults to config.PROVIDER_SEARCH_MODE)
+        status: Optional Status value, or list of values, to allow
+        provider_type: Optional Provider Type value(s) to allow
+        network: Optional Provider Network value(s) to allow
+        state: Optional State value(s) to allow
+        max_distance: Optional maximum distance in miles
+        require_rate: Only return providers with a contracted rate for proc_code
         
     Returns:
         List of nearby providers with distance and rate information
@@ -109,100 +844,215 @@ def find_nearest_providers(latitude, longitude, proc_code=None, limit=3):
         logger.warning("No coordinates provided for provider search")
         return []
     
+    search_mode = search_mode or config.PROVIDER_SEARCH_MODE
+    
+    if proc_code:
+        rate_index_available()
+    
     try:
-        # Connect to the providers database
-        conn = sqlite3.connect(PROVIDER_DB_PATH)
-        cursor = conn.cursor()
+        cursor = get_provider_db().cursor()
         
-        # Log database connection attempt
-        logger.info(f"Connecting to provider database: {PROVIDER_DB_PATH}")
+        criteria = _build_search_criteria(
+            cursor, proc_code, status=status, provider_type=provider_type, network=network,
+            state=state, max_distance=max_distance, require_rate=require_rate
+        )
+        records = _nearest_records(cursor, latitude, longitude, limit, search_mode, criteria)
         
-        # First check if there are any providers in the database
-        cursor.execute("SELECT COUNT(*) FROM providers")
-        count = cursor.fetchone()[0]
-        logger.info(f"Total providers in database: {count}")
-        
-        # Get all providers with coordinates and required fields
-        query = """
-            SELECT 
-                PrimaryKey,
-                [DBA Name Billing Name],
-                TIN,
-                State,
-                Status,
-                [Provider Type],
-                [Provider Network],
-                City,
-                lat,
-                lon,
-                Email,
-                [Fax Number],
-                Phone,
-                Website
-            FROM providers 
-            WHERE lat IS NOT NULL 
-            AND lon IS NOT NULL 
-            AND lat != '' 
-            AND lon != ''
-            AND [DBA Name Billing Name] IS NOT NULL
-            AND [DBA Name Billing Name] != ''
-        """
-        cursor.execute(query)
+        # Resolve every candidate's rate in one query instead of one per provider
+        rates = get_provider_rates(cursor, [r['clean_tin'] for r in records], proc_code) if proc_code else {}
+        nearest_providers = _materialize_providers(records, latitude, longitude, proc_code, rates)
         
-        # Get column names
-        column_names = [description[0] for description in cursor.description]
+        logger.info(f"Returning the {len(nearest_providers)} closest providers")
+        return nearest_providers
         
-        # Fetch all providers
-        providers = cursor.fetchall()
-        logger.info(f"Found {len(providers)} providers with valid coordinates")
+    except Exception as e:
+        logger.error(f"Error finding providers: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return []
+
+def match_providers_for_order(latitude, longitude, proc_codes, limit=3, search_mode=None, **filters):
+    """
+    Find the nearest providers once for an order and rate them for every procedure.
+    
+    Providers are ranked by distance a single time for the patient location;
+    rates for all procedure codes come from one batched lookup. With
+    require_rate the eligible providers differ per code, so ranking happens
+    once per distinct code instead.
+    
+    Args:
+        latitude: Patient location latitude
+        longitude: Patient location longitude
+        proc_codes: List of procedure codes (entries may be None)
+        limit: Maximum number of providers per procedure (default 3)
+        search_mode: Search mode, as for find_nearest_providers
+        **filters: Provider filters, as for find_nearest_providers
         
-        # Calculate distance for each provider and get rates if proc_code provided
-        all_providers = []
-        for provider in providers:
-            # Create a dictionary with column names as keys
-            provider_dict = dict(zip(column_names, provider))
-            
-            # Skip providers with invalid coordinates
-            try:
-                prov_lat = float(provider_dict['lat'])
-                prov_lon = float(provider_dict['lon'])
-            except (ValueError, TypeError):
-                continue
-                
-            # Calculate distance
-            distance = calculate_distance(latitude, longitude, prov_lat, prov_lon)
-            
-            # Add distance to provider info
-            provider_dict['distance_miles'] = round(distance, 2)
-            provider_dict['lat'] = prov_lat
-            provider_dict['lon'] = prov_lon
-            
-            # Clean the TIN
-            provider_dict['clean_tin'] = clean_tin(provider_dict['TIN'])
-            
-            # Get rate if procedure code provided
-            if proc_code and provider_dict['clean_tin']:
-                rate = get_provider_rate(cursor, provider_dict['clean_tin'], proc_code)
-                provider_dict['rate'] = rate
-            
-            all_providers.append(provider_dict)
+    Returns:
+        List of provider lists, one per entry in proc_codes, in the same order
+    """
+    if not latitude or not longitude:
+        logger.warning("No coordinates provided for provider search")
+        return [[] for _ in proc_codes]
+    
+    search_mode = search_mode or config.PROVIDER_SEARCH_MODE
+    
+    if any(proc_codes):
+        rate_index_available()
+    
+    try:
+        cursor = get_provider_db().cursor()
         
-        conn.close()
+        # Ranking key per procedure: the code itself when eligibility depends on it
+        def rank_key(proc_code):
+            if filters.get("require_rate"):
+                return str(proc_code).strip().upper() if proc_code else None
+            return None
         
-        # Sort by distance - pure distance-based, no filters
-        all_providers.sort(key=lambda x: x['distance_miles'])
+        ranked = {}
+        for proc_code in proc_codes:
+            key = rank_key(proc_code)
+            if key not in ranked:
+                criteria = _build_search_criteria(cursor, key, **filters)
+                ranked[key] = _nearest_records(cursor, latitude, longitude, limit, search_mode, criteria)
         
-        # Return the closest N providers regardless of distance
-        nearest_providers = all_providers[:limit]
+        tins = {r['clean_tin'] for records in ranked.values() for r in records}
+        rate_table = get_provider_rate_table(cursor, tins, [c for c in proc_codes if c])
         
-        logger.info(f"Returning the {len(nearest_providers)} closest providers")
-        return nearest_providers
+        matches = []
+        for proc_code in proc_codes:
+            rates = rate_table.get(str(proc_code).strip().upper(), {}) if proc_code else {}
+            records = ranked[rank_key(proc_code)]
+            matches.append(_materialize_providers(records, latitude, longitude, proc_code, rates))
+        
+        logger.info(f"Matched closest providers for {len(proc_codes)} procedures with {len(ranked)} ranking(s)")
+        return matches
         
     except Exception as e:
-        logger.error(f"Error finding providers: {str(e)}")
+        logger.error(f"Error matching providers for order: {str(e)}")
         import traceback
         traceback.print_exc()
-        return []
+        return [[] for _ in proc_codes]
+
+def find_nearest_providers_bulk(latitudes, longitudes, proc_codes, limit=3, chunk_size=None):
+    """
+    Find the nearest providers, with rates, for many patients at once.
+    
+    Distances are computed by the vectorized engine in blocks of chunk_size
+    patients so memory stays bounded, and rates for every patient and
+    procedure come from one batched lookup.
+    
+    Args:
+        latitudes: Patient latitudes
+        longitudes: Patient longitudes
+        proc_codes: One list of procedure codes per patient (entries may be None)
+        limit: Maximum number of providers per procedure (default 3)
+        chunk_size: Patients per distance block (defaults to config.PROVIDER_BULK_CHUNK_SIZE)
+        
+    Returns:
+        One list per patient holding a provider list per procedure code, like
+        match_providers_for_order; patients without coordinates get empty lists
+    """
+    chunk_size = chunk_size or config.PROVIDER_BULK_CHUNK_SIZE
+    results = [[[] for _ in codes] for codes in proc_codes]
+    
+    # Only patients with usable coordinates take part in the distance pass
+    positions = [i for i, (lat, lon) in enumerate(zip(latitudes, longitudes)) if lat and lon]
+    if not positions:
+        return results
+    
+    all_codes = [code for codes in proc_codes for code in codes if code]
+    if all_codes:
+        rate_index_available()
+    
+    try:
+        cursor = get_provider_db().cursor()
+        records, engine, _ = get_vectorized_search_data()
+        indices, _ = engine.nearest_many(
+            [latitudes[i] for i in positions],
+            [longitudes[i] for i in positions],
+            k=limit,
+            chunk_size=chunk_size
+        )
+        
+        nearest = {
+            position: [records[j] for j in row]
+            for position, row in zip(positions, indices.tolist())
+        }
+        
+        tins = {r['clean_tin'] for matched in nearest.values() for r in matched if r['clean_tin']}
+        rate_table = get_provider_rate_table(cursor, tins, all_codes)
+        
+        for position, matched in nearest.items():
+            for n, proc_code in enumerate(proc_codes[position]):
+                rates = rate_table.get(str(proc_code).strip().upper(), {}) if proc_code else {}
+                results[position][n] = _materialize_providers(
+                    matched, latitudes[position], longitudes[position], proc_code, rates
+                )
+        
+        logger.info(f"Matched providers for {len(positions)} patients in bulk")
+        return results
+        
+    except Exception as e:
+        logger.error(f"Error matching providers in bulk: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return results
+
+def _provider_mapping_inputs(results):
+    """
+    Pull the patient location and CPT codes needed for provider mapping.
+    
+    Returns:
+        Tuple (geocode_data, cpt_codes), or (None, failure_status) when the
+        order has no usable geocode data
+    """
+    # Check if we have mapping data
+    if "mapping_data" not in results or results["mapping_data"].get("status") == "geocoding_failed":
+        logger.warning("No geocoding data available for provider mapping")
+        return None, {"status": "geocoding_failed"}
+    
+    # Get geocode data
+    geocode_data = results["mapping_data"].get("geocode_data")
+    if not geocode_data:
+        logger.warning("No geocode data in mapping_data")
+        return None, {"status": "no_geocode_data"}
+    
+    # Check if we have procedures
+    extracted_data = results.get("extracted_data", {})
+    procedures = extracted_data.get("procedures", [])
+    
+    cpt_codes = []
+    for procedure in procedures:
+        cpt_code = None
+        cpt_code_data = procedure.get("cpt_code", {})
+        if isinstance(cpt_code_data, dict) and cpt_code_data.get("value"):
+            cpt_code = cpt_code_data.get("value")
+        cpt_codes.append(cpt_code)
+    
+    return geocode_data, cpt_codes
+
+def _build_provider_mapping(geocode_data, cpt_codes, matches):
+    """Assemble the provider_mapping structure from per-procedure matches."""
+    provider_mapping = {
+        "status": "success",
+        "patient_location": {
+            "latitude": geocode_data.get("latitude"),
+            "longitude": geocode_data.get("longitude"),
+            "address": geocode_data.get("display_name")
+        },
+        "procedures": []
+    }
+    
+    for cpt_code, providers in zip(cpt_codes, matches):
+        procedure_mapping = {
+            "cpt_code": cpt_code,
+            "providers": providers
+        }
+        
+        provider_mapping["procedures"].append(procedure_mapping)
+    
+    return provider_mapping
 
 def add_provider_mapping_to_results(results):
     """
@@ -215,55 +1065,16 @@ def add_provider_mapping_to_results(results):
         Updated results dictionary with provider mapping data
     """
     try:
-        # Check if we have mapping data
-        if "mapping_data" not in results or results["mapping_data"].get("status") == "geocoding_failed":
-            logger.warning("No geocoding data available for provider mapping")
-            results["provider_mapping"] = {"status": "geocoding_failed"}
-            return results
-        
-        # Get geocode data
-        geocode_data = results["mapping_data"].get("geocode_data")
-        if not geocode_data:
-            logger.warning("No geocode data in mapping_data")
-            results["provider_mapping"] = {"status": "no_geocode_data"}
+        geocode_data, cpt_codes = _provider_mapping_inputs(results)
+        if geocode_data is None:
+            results["provider_mapping"] = cpt_codes
             return results
         
-        # Get coordinates
-        latitude = geocode_data.get("latitude")
-        longitude = geocode_data.get("longitude")
-        
-        # Check if we have procedures
-        extracted_data = results.get("extracted_data", {})
-        procedures = extracted_data.get("procedures", [])
-        
-        provider_mapping = {
-            "status": "success",
-            "patient_location": {
-                "latitude": latitude,
-                "longitude": longitude,
-                "address": geocode_data.get("display_name")
-            },
-            "procedures": []
-        }
-        
-        # For each procedure, find nearby providers
-        for procedure in procedures:
-            cpt_code = None
-            cpt_code_data = procedure.get("cpt_code", {})
-            if isinstance(cpt_code_data, dict) and cpt_code_data.get("value"):
-                cpt_code = cpt_code_data.get("value")
-            
-            providers = find_nearest_providers(latitude, longitude, proc_code=cpt_code)
-            
-            procedure_mapping = {
-                "cpt_code": cpt_code,
-                "providers": providers
-            }
-            
-            provider_mapping["procedures"].append(procedure_mapping)
+        # Rank providers once for the patient location, then rate them per procedure
+        matches = match_providers_for_order(geocode_data.get("latitude"), geocode_data.get("longitude"), cpt_codes)
         
         # Add to results
-        results["provider_mapping"] = provider_mapping
+        results["provider_mapping"] = _build_provider_mapping(geocode_data, cpt_codes, matches)
         
         return results
         
@@ -272,6 +1083,74 @@ def add_provider_mapping_to_results(results):
         results["provider_mapping"] = {"status": "error", "message": str(e)}
         return results
 
+def add_provider_mapping_to_results_bulk(results_list):
+    """
+    Add provider mapping data to many order results with one bulk provider search.
+    
+    Args:
+        results_list: List of order processing results dictionaries
+        
+    Returns:
+        The same list, with provider_mapping set on every results dictionary
+    """
+    pending = []
+    for results in results_list:
+        try:
+            geocode_data, cpt_codes = _provider_mapping_inputs(results)
+        except Exception as e:
+            logger.error(f"Error reading provider mapping inputs: {str(e)}")
+            results["provider_mapping"] = {"status": "error", "message": str(e)}
+            continue
+        if geocode_data is None:
+            results["provider_mapping"] = cpt_codes
+        else:
+            pending.append((results, geocode_data, cpt_codes))
+    
+    if not pending:
+        return results_list
+    
+    matches = find_nearest_providers_bulk(
+        [geocode_data.get("latitude") for _, geocode_data, _ in pending],
+        [geocode_data.get("longitude") for _, geocode_data, _ in pending],
+        [cpt_codes for _, _, cpt_codes in pending]
+    )
+    
+    for (results, geocode_data, cpt_codes), order_matches in zip(pending, matches):
+        results["provider_mapping"] = _build_provider_mapping(geocode_data, cpt_codes, order_matches)
+    
+    return results_list
+
+def remap_results_directory(results_dir):
+    """
+    Recompute provider mapping for every saved order result in a directory.
+    
+    Args:
+        results_dir: Directory containing *_results.json files
+        
+    Returns:
+        Number of results files rewritten
+    """
+    results_dir = Path(results_dir)
+    paths = sorted(results_dir.glob("*_results.json"))
+    logger.info(f"Found {len(paths)} results files in {results_dir}")
+    
+    loaded = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                loaded.append((path, json.load(f)))
+        except Exception as e:
+            logger.error(f"Error reading results file {path}: {str(e)}")
+    
+    add_provider_mapping_to_results_bulk([results for _, results in loaded])
+    
+    for path, results in loaded:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, default=str)
+    
+    logger.info(f"Rewrote provider mapping for {len(loaded)} results files")
+    return len(loaded)
+
 
 def test_database_connection():
     """Test the database connection and structure."""
@@ -339,5 +1218,20 @@ def test_database_connection():
         return False
 
 if __name__ == "__main__":
-    # Test database connection
-    test_database_connection()
\ No newline at end of file
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Provider mapping utilities")
+    parser.add_argument("--remap", nargs="?", const=str(config.OUTPUT_DIR), metavar="RESULTS_DIR",
+                        help="Recompute provider mapping for all results in a directory (default: config.OUTPUT_DIR)")
+    parser.add_argument("--setup", action="store_true",
+                        help="Create the indexes provider lookups use in PROVIDER_DB_PATH")
+    
+    args = parser.parse_args()
+    
+    if args.setup:
+        setup_provider_database()
+    elif args.remap:
+        remap_results_directory(args.remap)
+    else:
+        # Test database connection
+        test_database_connection()
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+SQLite R*Tree over provider coordinates for bounding-box prefiltering.
+
+The ``providers_rtree`` virtual table mirrors ``providers.lat``/``providers.lon``
+keyed by the provider rowid, and triggers keep it in sync when providers are
+inserted, updated or deleted.
+"""
+import logging
+import math
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Earth's radius in miles, shared by every provider distance calculation
+EARTH_RADIUS_MILES = 3956
+
+# A search radius of half the Earth's circumference covers the whole globe
+MAX_SEARCH_RADIUS_MILES = math.pi * EARTH_RADIUS_MILES
+
+# SQL predicate (on row alias {row}) accepting only coordinates that parse as numbers
+_VALID_COORDS = """
+    TRIM({row}.lat) GLOB '*[0-9]*' AND NOT TRIM({row}.lat) GLOB '*[^0-9.eE+-]*'
+    AND TRIM({row}.lon) GLOB '*[0-9]*' AND NOT TRIM({row}.lon) GLOB '*[^0-9.eE+-]*'
+"""
+
+_INSERT_ROW = """
+    INSERT OR REPLACE INTO providers_rtree (id, min_lat, max_lat, min_lon, max_lon)
+    SELECT {row}.rowid, CAST(TRIM({row}.lat) AS REAL), CAST(TRIM({row}.lat) AS REAL),
+           CAST(TRIM({row}.lon) AS REAL), CAST(TRIM({row}.lon) AS REAL)
+"""
+
+RTREE_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS providers_rtree
+    USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS providers_rtree_insert AFTER INSERT ON providers
+    WHEN {_VALID_COORDS.format(row="NEW")}
+    BEGIN
+        {_INSERT_ROW.format(row="NEW")};
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS providers_rtree_update AFTER UPDATE ON providers
+    BEGIN
+        DELETE FROM providers_rtree WHERE id = OLD.rowid;
+        {_INSERT_ROW.format(row="NEW")} WHERE {_VALID_COORDS.format(row="NEW")};
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS providers_rtree_delete AFTER DELETE ON providers
+    BEGIN
+        DELETE FROM providers_rtree WHERE id = OLD.rowid;
+    END
+    """,
+]
+
+def create_provider_rtree(conn, rebuild=False):
+    """
+    Create the providers R*Tree and its sync triggers, populating it if new.
+
+    Args:
+        conn: Writable SQLite connection to the provider database
+        rebuild: Repopulate the R*Tree from providers even if it already exists
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='providers_rtree'")
+    exists = cursor.fetchone() is not None
+
+    for statement in RTREE_SCHEMA:
+        cursor.execute(statement)
+
+    if rebuild or not exists:
+        cursor.execute("DELETE FROM providers_rtree")
+        cursor.execute(_INSERT_ROW.format(row="providers") + " FROM providers WHERE " + _VALID_COORDS.format(row="providers"))
+        logger.info(f"Populated providers_rtree with {cursor.rowcount} providers")
+
+    conn.commit()
+
+def has_provider_rtree(cursor):
+    """
+    Whether the providers R*Tree exists (created by create_provider_rtree).
+
+    Args:
+        cursor: Cursor on the provider database; read-only is enough
+
+    Returns:
+        True if the providers_rtree table exists
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'providers_rtree'")
+    return cursor.fetchone() is not None
+
+def bounding_box(latitude, longitude, radius_miles):
+    """
+    Latitude/longitude box containing every point within a radius of a location.
+
+    Args:
+        latitude: Center latitude in degrees
+        longitude: Center longitude in degrees
+        radius_miles: Search radius in miles
+
+    Returns:
+        Tuple (min_lat, max_lat, min_lon, max_lon) in degrees
+    """
+    angular = radius_miles / EARTH_RADIUS_MILES
+    dlat = math.degrees(angular)
+    min_lat = latitude - dlat
+    max_lat = latitude + dlat
+
+    # Near a pole, or once the circle is large, every longitude is in range
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+
+    dlon = math.degrees(math.asin(min(1.0, math.sin(angular) / math.cos(math.radians(latitude)))))
+    min_lon = longitude - dlon
+    max_lon = longitude + dlon
+
+    # Crossing the antimeridian: fall back to the full longitude range
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, -180.0, 180.0
+
+    return min_lat, max_lat, min_lon, max_lon
@@ -0,0 +1,271 @@
+"""
+Compiled, memory-mappable snapshot of geocoded provider records.
+
+The snapshot directory next to the provider database holds one
+subdirectory per compiled version and a ``current.json`` pointer naming the
+version in use. Each version holds:
+
+- ``lat_rad.npy``/``lon_rad.npy``/``cos_lat.npy``: coordinates in radians
+- ``lat.npy``/``lon.npy``: coordinates in degrees
+- ``ids.npy``: provider PrimaryKey values as fixed-width strings
+- ``tins.npy``: cleaned 9-digit TINs (empty when the TIN is invalid)
+- ``records.bin``/``offsets.npy``: UTF-8 JSON per provider and its byte offsets
+- ``attr_*.npy``: normalized (trimmed, upper-case) values of filterable columns
+- ``meta.json``: format version and the database fingerprint it was built from
+
+Arrays are loaded with ``mmap_mode='r'`` so worker processes share the pages
+instead of each parsing the database. A snapshot whose fingerprint no longer
+matches the database (file mtime, size or schema) is treated as missing.
+
+A new version is written next to the old ones and published by atomically
+replacing the pointer, so a version is never renamed or deleted while a
+reader may still have it mapped (which Windows refuses). Superseded versions
+are deleted on later compiles once nothing holds them open.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Bump whenever the on-disk layout changes
+SNAPSHOT_VERSION = 3
+
+# Pointer file naming the snapshot version in use
+POINTER_FILE = "current.json"
+
+# Unfinished versions older than this (seconds) are left over from failed compiles
+ABANDONED_VERSION_AGE = 3600
+
+def normalize_attribute(value):
+    """Normalize a provider column value for case- and whitespace-insensitive filtering."""
+    return str(value).strip().upper() if value is not None else ''
+
+def _attribute_file(column):
+    return "attr_" + "".join(ch if ch.isalnum() else "_" for ch in column) + ".npy"
+
+def snapshot_dir_for(db_path):
+    """Snapshot directory that belongs to a database file."""
+    db_path = Path(db_path)
+    return db_path.with_name(db_path.stem + ".snapshot")
+
+def db_fingerprint(db_path, cursor):
+    """
+    Fingerprint a database so snapshots can detect that it changed.
+
+    Args:
+        db_path: Path to the database file
+        cursor: Cursor on that database, used to read the schema
+
+    Returns:
+        Dictionary with the file's mtime, size and a hash of its schema
+    """
+    stat = os.stat(db_path)
+    cursor.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name")
+    schema = json.dumps(cursor.fetchall())
+    return {
+        "db_mtime_ns": stat.st_mtime_ns,
+        "db_size": stat.st_size,
+        "schema_hash": hashlib.sha1(schema.encode("utf-8")).hexdigest()
+    }
+
+class SnapshotRecords(Sequence):
+    """Read-only sequence of provider dictionaries decoded lazily from the snapshot."""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("snapshot record index out of range")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return json.loads(bytes(self._blob[start:end]).decode("utf-8"))
+
+class ProviderSnapshot:
+    """Memory-mapped provider arrays plus lazily decoded provider records."""
+
+    def __init__(self, path, meta):
+        self.path = Path(path)
+        self.meta = meta
+
+        def load(name):
+            return np.load(self.path / name, mmap_mode='r')
+
+        self.lat = load("lat.npy")
+        self.lon = load("lon.npy")
+        self.lat_rad = load("lat_rad.npy")
+        self.lon_rad = load("lon_rad.npy")
+        self.cos_lat = load("cos_lat.npy")
+        self.ids = load("ids.npy")
+        self.tins = load("tins.npy")
+        offsets = load("offsets.npy")
+        blob_path = self.path / "records.bin"
+        # np.memmap cannot map an empty file
+        if blob_path.stat().st_size:
+            blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+        else:
+            blob = np.zeros(0, dtype=np.uint8)
+        self.records = SnapshotRecords(blob, offsets)
+        self.attributes = {column: load(_attribute_file(column)) for column in meta.get("attributes", [])}
+
+    def __len__(self):
+        return len(self.records)
+
+    def matches(self, fingerprint):
+        """Whether this snapshot was built from a database with this fingerprint."""
+        return all(self.meta.get(key) == value for key, value in fingerprint.items())
+
+def _read_pointer(snapshot_dir):
+    """Name of the version the pointer file points at, or None if there is none."""
+    try:
+        with open(Path(snapshot_dir) / POINTER_FILE, 'r') as f:
+            return json.load(f).get("snapshot")
+    except (OSError, ValueError):
+        return None
+
+def _write_pointer(snapshot_dir, version):
+    """Atomically point the snapshot directory at a version."""
+    fd, tmp_path = tempfile.mkstemp(prefix=POINTER_FILE + ".", suffix=".tmp", dir=snapshot_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({"snapshot": version}, f)
+    for attempt in range(5):
+        try:
+            os.replace(tmp_path, Path(snapshot_dir) / POINTER_FILE)
+            return
+        except PermissionError:
+            # Windows refuses while another process is reading the pointer
+            if attempt == 4:
+                os.remove(tmp_path)
+                raise
+            time.sleep(0.1)
+
+def _prune_versions(snapshot_dir, keep):
+    """Delete superseded versions (and files from the old single-directory layout)."""
+    current = _read_pointer(snapshot_dir)
+    now = time.time()
+    for entry in Path(snapshot_dir).iterdir():
+        if entry.name in (keep, current) or entry.name.startswith(POINTER_FILE):
+            continue
+        if entry.is_dir():
+            # Unfinished versions may still be being written by another process
+            if not (entry / "meta.json").exists() and now - entry.stat().st_mtime < ABANDONED_VERSION_AGE:
+                continue
+            # Fails while a reader has the files mapped on Windows; retried on the next compile
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            try:
+                entry.unlink()
+            except OSError:
+                pass
+
+def compile_snapshot(snapshot_dir, records, fingerprint, attribute_columns=()):
+    """
+    Write a snapshot of provider records.
+
+    The snapshot is written to a new version directory and published by
+    replacing the pointer file, so readers never see a half-written snapshot
+    and versions already mapped by readers are left in place.
+
+    Args:
+        snapshot_dir: Target snapshot directory
+        records: Provider dictionaries with float 'lat'/'lon' and 'clean_tin'
+        fingerprint: Fingerprint of the database the records came from
+        attribute_columns: Columns to store as normalized arrays for filtering
+
+    Returns:
+        Path to the new version directory
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    version_dir = Path(tempfile.mkdtemp(prefix="v", dir=snapshot_dir))
+
+    try:
+        lat = np.array([r['lat'] for r in records], dtype=np.float64)
+        lon = np.array([r['lon'] for r in records], dtype=np.float64)
+        lat_rad = np.radians(lat)
+        np.save(version_dir / "lat.npy", lat)
+        np.save(version_dir / "lon.npy", lon)
+        np.save(version_dir / "lat_rad.npy", lat_rad)
+        np.save(version_dir / "lon_rad.npy", np.radians(lon))
+        np.save(version_dir / "cos_lat.npy", np.cos(lat_rad))
+        np.save(version_dir / "ids.npy", np.array([str(r.get('PrimaryKey', '')) for r in records], dtype=np.str_))
+        np.save(version_dir / "tins.npy", np.array([r.get('clean_tin') or '' for r in records], dtype='S9'))
+
+        offsets = np.zeros(len(records) + 1, dtype=np.int64)
+        with open(version_dir / "records.bin", 'wb') as f:
+            position = 0
+            for i, record in enumerate(records):
+                encoded = json.dumps(record, default=str).encode("utf-8")
+                f.write(encoded)
+                position += len(encoded)
+                offsets[i + 1] = position
+        np.save(version_dir / "offsets.npy", offsets)
+
+        for column in attribute_columns:
+            values = [normalize_attribute(r.get(column)) for r in records]
+            np.save(version_dir / _attribute_file(column), np.array(values, dtype=np.str_))
+
+        # Written last: a version without meta.json is unfinished
+        meta = dict(fingerprint, version=SNAPSHOT_VERSION, count=len(records),
+                    attributes=list(attribute_columns))
+        with open(version_dir / "meta.json", 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        _write_pointer(snapshot_dir, version_dir.name)
+    except Exception:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+
+    logger.info(f"Compiled provider snapshot with {len(records)} providers: {version_dir}")
+    _prune_versions(snapshot_dir, keep=version_dir.name)
+    return version_dir
+
+def load_snapshot(snapshot_dir, fingerprint):
+    """
+    Load a snapshot if it exists and matches the database fingerprint.
+
+    Args:
+        snapshot_dir: Snapshot directory
+        fingerprint: Current fingerprint of the database
+
+    Returns:
+        ProviderSnapshot, or None if missing, unreadable or stale
+    """
+    version = _read_pointer(snapshot_dir)
+    if version is None:
+        return None
+    version_dir = Path(snapshot_dir) / version
+
+    try:
+        with open(version_dir / "meta.json", 'r') as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            logger.info(f"Provider snapshot has an old format: {version_dir}")
+            return None
+        snapshot = ProviderSnapshot(version_dir, meta)
+    except Exception as e:
+        logger.warning(f"Could not read provider snapshot {version_dir}: {str(e)}")
+        return None
+
+    if not snapshot.matches(fingerprint):
+        logger.info(f"Provider snapshot is stale: {version_dir}")
+        return None
+    return snapshot
@@ -0,0 +1,152 @@
+"""
+Per-host request rate limiting shared by threads and processes.
+
+Each host has a minimum interval between requests. A caller reserves the next
+free slot for the host and sleeps only until that slot, so a request made long
+after the previous one goes out immediately while bursts are spaced out.
+Slots are reserved in a small SQLite file inside an immediate transaction, so
+worker processes on the same machine share one schedule per host.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+from referrals import config
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rate_limits (
+        host TEXT PRIMARY KEY,
+        next_at REAL NOT NULL
+    )
+"""
+
+class RateLimiter:
+    """Reserve request slots per host so no host is called more often than its interval."""
+
+    def __init__(self, db_path=None, intervals=None, default_interval=0.0, busy_timeout=30):
+        """
+        Set up the limiter.
+
+        Args:
+            db_path: Optional SQLite file used to share slots between processes;
+                without it slots are only shared between threads
+            intervals: Dictionary of host to minimum seconds between requests
+            default_interval: Interval for hosts not listed in intervals
+            busy_timeout: Seconds to wait for another process's reservation
+        """
+        self.db_path = Path(db_path) if db_path else None
+        self.intervals = dict(intervals or {})
+        self.default_interval = default_interval
+        self.busy_timeout = busy_timeout
+        self._next_at = {}
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def interval_for(self, host):
+        """Minimum seconds between requests to a host."""
+        return self.intervals.get(host.lower(), self.default_interval)
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=self.busy_timeout,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute(RATE_LIMIT_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _reserve_shared(self, host, now, interval):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT next_at FROM rate_limits WHERE host = ?", (host,)).fetchone()
+            slot = max(now, row[0]) if row else now
+            conn.execute("INSERT OR REPLACE INTO rate_limits (host, next_at) VALUES (?, ?)",
+                         (host, slot + interval))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return slot
+
+    def reserve(self, host):
+        """
+        Reserve the next request slot for a host without waiting for it.
+
+        Args:
+            host: Host name
+
+        Returns:
+            Time (as time.time()) at which the request may be sent
+        """
+        host = host.lower()
+        interval = self.interval_for(host)
+        now = time.time()
+        if interval <= 0:
+            return now
+
+        with self._lock:
+            slot = None
+            if self.db_path is not None:
+                try:
+                    slot = self._reserve_shared(host, now, interval)
+                except sqlite3.Error as e:
+                    logger.warning(f"Shared rate limit unavailable for {host}, limiting in-process only: {str(e)}")
+            if slot is None:
+                slot = max(now, self._next_at.get(host, now))
+            # Keep the local schedule too, in case the shared one becomes unavailable
+            self._next_at[host] = max(self._next_at.get(host, 0.0), slot + interval)
+        return slot
+
+    def wait(self, host):
+        """
+        Block until a request to a host is allowed.
+
+        Args:
+            host: Host name
+
+        Returns:
+            Seconds spent waiting
+        """
+        delay = self.reserve(host) - time.time()
+        if delay > 0:
+            logger.debug(f"Rate limiting {host}: waiting {delay:.2f}s")
+            time.sleep(delay)
+            return delay
+        return 0.0
+
+    def wait_for_url(self, url):
+        """Block until a request to the host of a URL is allowed."""
+        return self.wait(urlparse(url).hostname or "")
+
+# Process-wide limiter, created on first use
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """
+    Get the process-wide rate limiter configured from config.RATE_LIMITS.
+
+    Returns:
+        RateLimiter shared by every caller in this process
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(
+                config.RATE_LIMIT_DB,
+                intervals=config.RATE_LIMITS,
+                default_interval=config.RATE_LIMIT_DEFAULT_INTERVAL
+            )
+        return _rate_limiter
+
+def wait_for_url(url):
+    """Block until the process-wide limiter allows a request to a URL."""
+    return get_rate_limiter().wait_for_url(url)
@@ -0,0 +1,86 @@
+"""
+Tests for the canonical address form used as the geocode cache key, and for
+the address parser behind structured geocoding queries.
+"""
+from address_normalizer import address_cache_key, canonicalize_address, is_unit_identifier, parse_address
+from referrals.geocoding_client import preprocess_address
+
+def test_spellings_of_one_address_share_a_key():
+    assert address_cache_key("123 Main St, Tampa FL 33601") == \
+        address_cache_key("123 MAIN STREET , Tampa, Fla 33601-1234, USA")
+
+def test_unit_designators_are_keyed_as_hash():
+    expected = "123 MAIN ST # 200 TAMPA FL 33601"
+    assert canonicalize_address("123 Main St Suite 200, Tampa, FL 33601") == expected
+    assert canonicalize_address("123 Main St Ste. #200, Tampa, FL 33601") == expected
+    assert canonicalize_address("123 Main St #200, Tampa, FL 33601") == expected
+    assert canonicalize_address("123 Main St Unit C, Tampa, FL 33601") == "123 MAIN ST # C TAMPA FL 33601"
+
+def test_designator_words_in_street_names_are_kept():
+    assert canonicalize_address("10 Unit Rd, Austin, TX 78701") == "10 UNIT RD AUSTIN TX 78701"
+    assert canonicalize_address("10 Suite Rd, Austin, TX 78701") == "10 SUITE RD AUSTIN TX 78701"
+    assert canonicalize_address("10 Building Rd, Austin, TX 78701") == "10 BUILDING RD AUSTIN TX 78701"
+    keys = {address_cache_key(f"10 {word} Rd, Austin, TX 78701") for word in ("Unit", "Suite", "Building", "Main")}
+    assert len(keys) == 4
+
+def test_florida_is_not_a_floor():
+    assert canonicalize_address("123 Main St, Tampa, FL") == "123 MAIN ST TAMPA FL"
+    assert canonicalize_address("123 Main St FL 33601") == "123 MAIN ST FL 33601"
+    assert canonicalize_address("123 Main St, Tampa, FL 33601, FL 3") == "123 MAIN ST TAMPA FL 33601 # 3"
+    assert canonicalize_address("77 W Wacker Dr, Fl 3, Chicago, IL 60601") == \
+        canonicalize_address("77 West Wacker Drive Floor 3, Chicago, Illinois 60601")
+
+def test_unit_identifiers():
+    for token in ("200", "4B", "B-2", "C"):
+        assert is_unit_identifier(token)
+    for token in ("Rd", "Ln", "Street", "Main", "AB"):
+        assert not is_unit_identifier(token)
+
+def test_parse_address_components():
+    assert parse_address("123 Main Street Suite 5, Tampa, Fla 33601") == {
+        "street": "123 Main Street", "unit": "5", "city": "Tampa", "state": "FL", "zip": "33601"
+    }
+    assert parse_address("5 Oak Ave Unit C, Tampa FL 33601-1234, USA") == {
+        "street": "5 Oak Ave", "unit": "C", "city": "Tampa", "state": "FL", "zip": "33601"
+    }
+    assert parse_address("350 Fifth Ave, Apt. #4B, New York, New York 10118") == {
+        "street": "350 Fifth Ave", "unit": "4B", "city": "New York", "state": "NY", "zip": "10118"
+    }
+
+def test_parse_address_keeps_designator_street_names():
+    parsed = parse_address("200 Building Ln, Orlando, FL 32801")
+    assert parsed["street"] == "200 Building Ln"
+    assert parsed["unit"] is None
+    parsed = parse_address("10 Unit Rd, Apt 3, Austin, TX 78701")
+    assert (parsed["street"], parsed["unit"], parsed["city"]) == ("10 Unit Rd", "3", "Austin")
+
+def test_parse_address_splits_unit_from_city_segment():
+    assert parse_address("500 W Madison, Suite 1200 Chicago IL 60661") == {
+        "street": "500 W Madison", "unit": "1200", "city": "Chicago", "state": "IL", "zip": "60661"
+    }
+
+def test_parse_address_knows_every_unit_designator():
+    assert parse_address("1 Main St, Lot 5, Tampa FL") == {
+        "street": "1 Main St", "unit": "5", "city": "Tampa", "state": "FL", "zip": None
+    }
+    assert parse_address("12 Oak St Dept 7, Charleston, WV")["unit"] == "7"
+    assert parse_address("1 Pine Rd Space 12, Mesa, AZ 85201")["street"] == "1 Pine Rd"
+
+def test_parse_address_prefers_multi_word_state_names():
+    assert parse_address("123 Main St, West Virginia") == {
+        "street": "123 Main St", "unit": None, "city": None, "state": "WV", "zip": None
+    }
+    assert parse_address("9 Elm St, Charleston, West Virginia 25301")["city"] == "Charleston"
+    parsed = parse_address("9 Elm St, Virginia Beach, VA")
+    assert (parsed["city"], parsed["state"]) == ("Virginia Beach", "VA")
+
+def test_parse_address_partial():
+    assert parse_address("123 Main St, Tampa, FL") == {
+        "street": "123 Main St", "unit": None, "city": "Tampa", "state": "FL", "zip": None
+    }
+    assert parse_address("") == {"street": None, "unit": None, "city": None, "state": None, "zip": None}
+
+def test_preprocess_address_removes_units_only():
+    assert preprocess_address("10 Unit Rd, Apt 3, Austin, TX") == "10 Unit Rd, Austin, TX"
+    assert preprocess_address("123 Main St Suite 200, Tampa, Fla 33601") == "123 Main St, Tampa, FL 33601"
+    assert preprocess_address("5 Oak Ave #4B, Tampa, FL") == "5 Oak Ave, Tampa, FL"
@@ -0,0 +1,72 @@
+"""
+Tests for the vectorized distance engine against the scalar calculate_distance reference.
+"""
+import random
+import numpy as np
+from distance_engine import DistanceEngine
+from provider_mapping_simple import calculate_distance
+
+# One centimeter expressed in miles
+CENTIMETER_MILES = 0.01 / 1609.344
+
+def _random_points(count, seed):
+    rng = random.Random(seed)
+    lats = [rng.uniform(-80, 80) for _ in range(count)]
+    lons = [rng.uniform(-180, 180) for _ in range(count)]
+    return lats, lons
+
+def test_distances_from_single_patient():
+    lats, lons = _random_points(500, seed=1)
+    engine = DistanceEngine(lats, lons)
+    patient_lat, patient_lon = 27.9506, -82.4572  # Tampa, FL
+
+    distances = engine.distances_from(patient_lat, patient_lon)
+
+    for i in range(len(lats)):
+        expected = calculate_distance(patient_lat, patient_lon, lats[i], lons[i])
+        assert abs(distances[i] - expected) < CENTIMETER_MILES
+
+def test_distance_matrix_many_patients():
+    lats, lons = _random_points(200, seed=2)
+    patient_lats, patient_lons = _random_points(25, seed=3)
+    engine = DistanceEngine(lats, lons)
+
+    matrix = engine.distance_matrix(patient_lats, patient_lons)
+
+    assert matrix.shape == (25, 200)
+    for p in range(25):
+        for i in range(200):
+            expected = calculate_distance(patient_lats[p], patient_lons[p], lats[i], lons[i])
+            assert abs(matrix[p, i] - expected) < CENTIMETER_MILES
+
+def test_nearest_matches_full_sort():
+    lats, lons = _random_points(1000, seed=4)
+    engine = DistanceEngine(lats, lons)
+    patient_lats, patient_lons = _random_points(10, seed=5)
+
+    indices, distances = engine.nearest_many(patient_lats, patient_lons, k=5)
+
+    for p in range(10):
+        ranked = sorted(range(len(lats)),
+                        key=lambda i: calculate_distance(patient_lats[p], patient_lons[p], lats[i], lons[i]))
+        assert list(indices[p]) == ranked[:5]
+        assert np.all(np.diff(distances[p]) >= 0)
+
+def test_nearest_with_k_larger_than_provider_count():
+    engine = DistanceEngine([27.95, 28.54], [-82.46, -81.38])
+
+    indices, distances = engine.nearest(27.95, -82.46, k=3)
+
+    assert list(indices) == [0, 1]
+    assert distances[0] < CENTIMETER_MILES
+
+def test_nearest_many_chunked_matches_unchunked():
+    lats, lons = _random_points(300, seed=6)
+    patient_lats, patient_lons = _random_points(37, seed=7)
+    engine = DistanceEngine(lats, lons)
+
+    full_indices, full_distances = engine.nearest_many(patient_lats, patient_lons, k=4)
+    chunk_indices, chunk_distances = engine.nearest_many(patient_lats, patient_lons, k=4, chunk_size=8)
+
+    assert np.array_equal(full_indices, chunk_indices)
+    assert np.array_equal(full_distances, chunk_distances)
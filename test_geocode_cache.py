@@ -0,0 +1,116 @@
+"""
+Tests for the SQLite geocode cache: expiry, the in-memory LRU tier, the legacy
+JSON import and concurrent access from several connections.
+"""
+import json
+import os
+import threading
+
+import pytest
+
+from referrals import geocode_cache
+from referrals.geocode_cache import GeocodeCache, SECONDS_PER_DAY
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(geocode_cache.time, "time", fake.time)
+    return fake
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = GeocodeCache(tmp_path / "cache.db", ttl_days=1)
+    cache.set("default", {"lat": 1})
+    cache.set("short", {"lat": 2}, ttl=60)
+
+    clock.now += 59
+    assert cache.get("short") == {"lat": 2}
+    clock.now += 1
+    assert cache.get("short") is None
+    assert cache.get("default") == {"lat": 1}
+
+    clock.now += SECONDS_PER_DAY
+    assert cache.get("default") is None
+    # Expired entries are also invisible to a fresh process, then purged
+    assert GeocodeCache(tmp_path / "cache.db").get("default") is None
+    assert cache.purge_expired() == 2
+
+def test_lru_keeps_most_recently_used_entries(tmp_path):
+    cache = GeocodeCache(tmp_path / "cache.db", lru_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert list(cache._lru) == ["a", "c"]
+    # Evicted from memory only; SQLite still answers and the entry comes back into the LRU
+    assert cache.get("b") == 2
+    assert list(cache._lru) == ["c", "b"]
+
+def test_delete_removes_entry_from_both_tiers(tmp_path):
+    cache = GeocodeCache(tmp_path / "cache.db")
+    cache.set("a", 1)
+    cache.delete("a")
+    assert "a" not in cache._lru
+    assert cache.get("a") is None
+
+def _write_legacy(cache_dir, key, value, age_seconds=0):
+    path = cache_dir / f"{key}.json"
+    path.write_text(json.dumps(value))
+    if age_seconds:
+        mtime = path.stat().st_mtime - age_seconds
+        os.utime(path, (mtime, mtime))
+    return path
+
+def test_legacy_json_import_runs_once(tmp_path):
+    legacy_dir = tmp_path / "legacy"
+    legacy_dir.mkdir()
+    _write_legacy(legacy_dir, "fresh", {"lat": 1})
+    _write_legacy(legacy_dir, "kept", {"lat": 2})
+    _write_legacy(legacy_dir, "stale", {"lat": 3}, age_seconds=2 * SECONDS_PER_DAY)
+    (legacy_dir / "broken.json").write_text("{not json")
+
+    cache = GeocodeCache(tmp_path / "cache.db", ttl_days=1)
+    cache.set("kept", {"lat": 20})
+    assert cache.import_json_dir(legacy_dir) == 2
+    assert cache.get("fresh") == {"lat": 1}
+    # Existing entries win over legacy files, and expired files are skipped
+    assert cache.get("kept") == {"lat": 20}
+    assert cache.get("stale") is None
+
+    # The cache_meta flag stops later imports, in this process or another
+    _write_legacy(legacy_dir, "later", {"lat": 4})
+    assert cache.import_json_dir(legacy_dir) == 0
+    assert GeocodeCache(tmp_path / "cache.db").import_json_dir(legacy_dir) == 0
+    assert cache.get("later") is None
+
+def test_concurrent_writers_share_one_database(tmp_path):
+    db_path = tmp_path / "cache.db"
+    # One cache per worker, like separate processes each opening the file
+    caches = [GeocodeCache(db_path, lru_size=0) for _ in range(4)]
+    errors = []
+
+    def work(n, cache):
+        try:
+            for i in range(50):
+                cache.set(f"{n}:{i}", {"n": n, "i": i})
+                assert cache.get(f"{(n + 1) % 4}:0") in (None, {"n": (n + 1) % 4, "i": 0})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(n, cache)) for n, cache in enumerate(caches)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    reader = GeocodeCache(db_path)
+    assert reader._connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert all(reader.get(f"{n}:{i}") == {"n": n, "i": i} for n in range(4) for i in range(50))
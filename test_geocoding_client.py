@@ -0,0 +1,137 @@
+"""
+Tests for geocode_address and geocode_zipcode caching, against a stand-in backend.
+"""
+import pytest
+
+from referrals import config, geocode_cache, geocoder_backends, geocoding_client
+from referrals.geocode_cache import GeocodeCache, SECONDS_PER_DAY
+
+class FakeBackend:
+    """Records every call; finds any address containing "Main St" and every ZIP code.
+
+    Set ``error`` to make every call raise it, like a timeout or connection failure.
+    """
+
+    name = "fake"
+
+    def __init__(self):
+        self.calls = []
+        self.error = None
+
+    def _result(self, query):
+        if self.error:
+            raise self.error
+        return {"latitude": 27.95, "longitude": -82.46, "display_name": query,
+                "address_components": {"city": "Tampa"}, "importance": 0.5}
+
+    def search(self, query, api_key=None):
+        self.calls.append(("search", query))
+        return self._result(query) if "Main St" in query else None
+
+    def search_structured(self, street=None, city=None, state=None, postalcode=None, api_key=None):
+        self.calls.append(("structured", street, city, state, postalcode))
+        return self._result(street) if street and "Main St" in street else None
+
+    def search_postcode(self, zipcode, api_key=None):
+        self.calls.append(("postcode", zipcode))
+        return self._result(zipcode)
+
+@pytest.fixture
+def backend(monkeypatch, tmp_path):
+    fake = FakeBackend()
+    monkeypatch.setattr(geocoding_client, "_geocode_cache", GeocodeCache(tmp_path / "geocode.db"))
+    monkeypatch.setattr(geocoding_client, "get_geocoder_backend", lambda: fake)
+    # Keep ZIP lookups on the backend rather than the offline gazetteer
+    monkeypatch.setattr(geocoding_client, "geocode_zip_offline", lambda zipcode, original_address=None: None)
+    return fake
+
+def test_cached_address_results_are_copies(backend):
+    first = geocoding_client.geocode_address("123 Main St, Tampa, FL")
+    first["latitude"] = 0.0
+    second = geocoding_client.geocode_address("123 Main St, Tampa, FL")
+    second["mapping"] = "added by a caller"
+    third = geocoding_client.geocode_address("123 Main St, Tampa, FL")
+
+    assert third["latitude"] == 27.95
+    assert "mapping" not in third
+    assert third is not second
+    assert len(backend.calls) == 1
+
+def test_cached_zip_results_are_copies(backend):
+    first = geocoding_client.geocode_zipcode("33601")
+    first["latitude"] = 0.0
+    second = geocoding_client.geocode_zipcode("33601")
+    second["latitude"] = 1.0
+    third = geocoding_client.geocode_zipcode("33601")
+
+    assert third["latitude"] == 27.95
+    assert backend.calls == [("postcode", "33601")]
+
+def test_structured_query_replaces_preprocessed_stage(backend):
+    assert geocoding_client.geocode_address("9 Elm St Suite 5, Tampa, Fla") is None
+    assert [call[0] for call in backend.calls] == ["structured", "search", "search"]
+    assert backend.calls[-1] == ("search", "Tampa, Fla")
+
+def test_preprocessed_stage_runs_without_structured_query(backend):
+    # No city or ZIP to structure, so the free-text cleanup is the only way to drop the unit
+    assert geocoding_client.geocode_address("9 Elm St Suite 5") is None
+    assert backend.calls == [("search", "9 Elm St Suite 5"), ("search", "9 Elm St")]
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+def test_not_found_is_cached_until_ttl_expires(backend, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(geocode_cache.time, "time", clock.time)
+
+    assert geocoding_client.geocode_address("9 Elm St, Tampa, FL") is None
+    attempts = len(backend.calls)
+    assert attempts > 0
+
+    clock.now += config.GEOCODE_NEGATIVE_CACHE_EXPIRY * SECONDS_PER_DAY - 1
+    assert geocoding_client.geocode_address("9 Elm St, Tampa, FL") is None
+    assert len(backend.calls) == attempts
+
+    clock.now += 1
+    assert geocoding_client.geocode_address("9 Elm St, Tampa, FL") is None
+    assert len(backend.calls) == 2 * attempts
+
+def test_transport_errors_are_never_cached(backend):
+    backend.error = ConnectionError("connection reset")
+    assert geocoding_client.geocode_address("123 Main St, Tampa, FL") is None
+    assert geocoding_client.geocode_address("123 Main St, Tampa, FL") is None
+    assert geocoding_client.geocode_zipcode("33601") is None
+    assert len(backend.calls) == 3
+
+    backend.error = None
+    assert geocoding_client.geocode_address("123 Main St, Tampa, FL")["latitude"] == 27.95
+    assert geocoding_client.geocode_zipcode("33601")["latitude"] == 27.95
+
+def test_gazetteer_backend_and_offline_zip_share_result_shape(monkeypatch):
+    centroid = {"latitude": 27.95, "longitude": -82.46, "city": "Tampa", "state": "Florida", "state_code": "FL"}
+
+    class FakeGazetteer:
+        def lookup(self, zipcode):
+            return centroid
+
+    monkeypatch.setattr(geocoder_backends, "get_gazetteer", lambda: FakeGazetteer())
+    monkeypatch.setattr(geocoding_client, "lookup_zip", lambda zipcode: centroid)
+
+    backend_result = geocoder_backends.GazetteerBackend().search_postcode("33601")
+    offline_result = geocoding_client.geocode_zip_offline("33601", "1 Main St, Tampa, FL 33601")
+    assert backend_result.pop("importance") == 0
+    assert offline_result.pop("original_address") == "1 Main St, Tampa, FL 33601"
+    assert backend_result == offline_result
+    assert offline_result["display_name"] == "Tampa, Florida 33601, USA"
+
+def test_backends_must_implement_search_and_reverse():
+    class SearchOnly(geocoder_backends.GeocoderBackend):
+        def search(self, query, api_key=None):
+            return None
+
+    with pytest.raises(TypeError):
+        SearchOnly()
@@ -0,0 +1,71 @@
+"""
+Tests for the per-host circuit breaker's closed, open and half-open transitions.
+"""
+import pytest
+
+from referrals import http_client
+from referrals.http_client import CircuitBreaker
+
+class FakeClock:
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(http_client.time, "monotonic", fake.monotonic)
+    return fake
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+    assert breaker.allow()
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    clock.now += 59
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    # Only one trial request at a time
+    assert not breaker.allow()
+
+def test_successful_trial_closes_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow()
+    assert breaker.allow()
+
+def test_failed_trial_reopens_for_full_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 60
+    assert breaker.allow()
+    # A single failure is enough to reopen while half-open
+    breaker.record_failure()
+    assert breaker.is_open
+    clock.now += 59
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
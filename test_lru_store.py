@@ -0,0 +1,49 @@
+"""
+Tests for the size-bounded, least-recently-used file store.
+"""
+import os
+
+from referrals.lru_store import LRUDirectoryStore
+
+def _files(store):
+    return sorted(os.path.relpath(path, store.cache_dir) for path in store._stored_files())
+
+def _age(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+def test_write_evicts_least_recently_used_past_limit(tmp_path):
+    store = LRUDirectoryStore(tmp_path / "store", max_bytes=320)
+    for i, name in enumerate(["a", "b", "c"]):
+        _age(store.write(store.cache_dir / f"{name}.png", b"x" * 100), 100 + i)
+    assert _files(store) == ["a.png", "b.png", "c.png"]
+
+    store.write(store.cache_dir / "d.png", b"x" * 100)
+
+    # Down to at most 90% of the limit, oldest first; the file just written is kept
+    assert _files(store) == ["c.png", "d.png"]
+    assert store._size == 200
+
+def test_touch_updates_recency(tmp_path):
+    store = LRUDirectoryStore(tmp_path / "store", max_bytes=250)
+    a = store.write(store.cache_dir / "a.png", b"x" * 100)
+    b = store.write(store.cache_dir / "b.png", b"x" * 100)
+    _age(a, 100)
+    _age(b, 200)
+
+    assert store.touch(a)
+    store.write(store.cache_dir / "c.png", b"x" * 100)
+
+    assert _files(store) == ["a.png", "c.png"]
+    assert not store.touch(b)
+
+def test_only_files_with_the_suffix_are_managed(tmp_path):
+    store = LRUDirectoryStore(tmp_path / "store", max_bytes=150)
+    notes = store.cache_dir / "notes.txt"
+    notes.parent.mkdir(parents=True)
+    notes.write_bytes(b"x" * 1000)
+    _age(notes, 1)
+
+    store.write(store.cache_dir / "a.png", b"x" * 100)
+
+    assert notes.exists()
+    assert _files(store) == ["a.png"]
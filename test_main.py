@@ -0,0 +1,73 @@
+"""
+Tests for processing many orders on the order worker pool.
+"""
+import threading
+import time
+
+import pytest
+
+import config
+import main
+
+ORDER_IDS = ["A100", "B200", "C300", "D400", "E500", "F600", "G700", "H800"]
+
+class ConcurrencyProbe:
+    """Counts how many calls are running at once."""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.active -= 1
+
+@pytest.fixture
+def orders(monkeypatch, tmp_path):
+    """Stub the services around main.process_order; order B200's documents cannot be read."""
+    for order_id in ORDER_IDS:
+        (tmp_path / order_id).mkdir()
+    monkeypatch.setattr(config, "INPUT_DIR", tmp_path)
+    probe = ConcurrencyProbe()
+    mapped = []
+
+    def process_order_folder(order_folder):
+        with probe:
+            # Later orders finish first, so completion order differs from input order
+            time.sleep(0.01 * (len(ORDER_IDS) - ORDER_IDS.index(order_folder.name)))
+            if order_folder.name == "B200":
+                raise RuntimeError("Document AI unavailable")
+            return {"order_id": order_folder.name, "documents": [{"content": "text"}]}
+
+    def save_results(order_id, order_data, api_request, llm_response, add_mapping=True):
+        assert not add_mapping
+        return {"order_id": order_id}
+
+    monkeypatch.setattr(main, "initialize_documentai", lambda: None)
+    monkeypatch.setattr(main, "process_order_folder", process_order_folder)
+    monkeypatch.setattr(main, "format_llm_request", lambda order_data: order_data)
+    monkeypatch.setattr(main, "call_llm_api", lambda api_request: api_request)
+    monkeypatch.setattr(main, "save_results", save_results)
+    monkeypatch.setattr(main, "add_mapping_to_saved_results", mapped.extend)
+    monkeypatch.setattr(main, "wait_for_background_maps", lambda: None)
+    return probe, mapped
+
+@pytest.mark.parametrize("workers, configured", [(None, 1), (None, 3), (4, 1)])
+def test_order_pool_keeps_order_and_isolates_failures(orders, monkeypatch, workers, configured):
+    probe, mapped = orders
+    monkeypatch.setattr(config, "ORDER_WORKERS", configured)
+
+    main.process_all_orders(workers=workers)
+
+    cap = workers or configured
+    assert 1 <= probe.peak <= cap
+    if cap > 1:
+        assert probe.peak > 1
+    # Every order but the failed one is mapped, in folder order
+    assert [results["order_id"] for results in mapped] == [o for o in ORDER_IDS if o != "B200"]
@@ -0,0 +1,46 @@
+"""
+Tests for map cache keys and the per-order map links.
+"""
+import pytest
+
+from referrals import config
+from referrals.map_cache import MapCache, link_order_map, map_cache_key
+
+SPEC = dict(latitude=27.950575, longitude=-82.457178, zoom=14, width=600, height=400,
+            markers=[(27.950575, -82.457178, "red")], source="tiles:https://tiles.example/{z}/{x}/{y}.png")
+
+@pytest.mark.parametrize("change", [
+    {"latitude": 27.951},
+    {"longitude": -82.458},
+    {"zoom": 15},
+    {"width": 800},
+    {"height": 300},
+    {"markers": [(27.950575, -82.457178, "blue")]},
+    {"markers": []},
+    {"source": "staticmap:https://staticmap.example/"},
+])
+def test_key_changes_with_spec(change):
+    assert map_cache_key(**dict(SPEC, **change)) != map_cache_key(**SPEC)
+
+def test_key_ignores_changes_below_coordinate_precision():
+    nudged = dict(SPEC, latitude=SPEC["latitude"] + 10 ** -(config.MAP_CACHE_COORD_DECIMALS + 2))
+    assert map_cache_key(**nudged) == map_cache_key(**SPEC)
+    reordered = dict(SPEC, markers=[(28.0, -82.0, "blue")] + SPEC["markers"])
+    swapped = dict(SPEC, markers=SPEC["markers"] + [(28.0, -82.0, "blue")])
+    assert map_cache_key(**reordered) == map_cache_key(**swapped)
+
+def test_order_map_follows_the_cached_image(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "MAPS_DIR", tmp_path / "maps")
+    cache = MapCache(tmp_path / "map_cache", max_bytes=10 * 1024 * 1024)
+    old_key = map_cache_key(**SPEC)
+    new_key = map_cache_key(**dict(SPEC, latitude=28.1))
+    assert cache.get(old_key) is None
+
+    order_path = link_order_map(cache.put(old_key, b"old map"), "A100")
+    assert cache.get(old_key) == cache.path(old_key)
+    assert order_path.read_bytes() == b"old map"
+
+    # A corrected address gets its own image and the order's file is replaced
+    link_order_map(cache.put(new_key, b"new map"), "A100")
+    assert order_path.read_bytes() == b"new map"
+    assert cache.get(old_key).read_bytes() == b"old map"
@@ -0,0 +1,150 @@
+"""
+Tests for OCR of an order's documents on the OCR worker pool, and that mapping
+many saved orders together never costs one order's failure the others.
+"""
+import json
+import threading
+import time
+
+import pytest
+
+import config
+import geocoding_client
+import process
+from referrals.geocode_cache import GeocodeCache
+
+ADDRESSES = {
+    "A100": "100 Good St, Tampa, FL",
+    "B200": "200 Broken St, Tampa, FL",
+    "C300": "300 Good Ave, Orlando, FL",
+}
+
+class FakeBackend:
+    """Finds every address except those on Broken St, where the service errors out."""
+
+    name = "fake"
+
+    def search(self, query, api_key=None):
+        if "Broken" in query:
+            raise RuntimeError("geocoder exploded")
+        return {"latitude": 28.0, "longitude": -82.5, "display_name": query,
+                "address_components": {}, "importance": 0.5}
+
+    def search_structured(self, street=None, city=None, state=None, postalcode=None, api_key=None):
+        return self.search(", ".join(part for part in (street, city, state) if part), api_key)
+
+def _saved_results(addresses):
+    return [
+        {
+            "order_id": order_id,
+            "extracted_data": {"patient_info": {"patient_address": {"value": address}}, "procedures": []}
+        }
+        for order_id, address in addresses.items()
+    ]
+
+def _stub_provider_mapping(results):
+    geocode_data = (results.get("mapping_data") or {}).get("geocode_data")
+    results["provider_mapping"] = {"status": "success" if geocode_data else "geocoding_failed"}
+    return results
+
+@pytest.fixture
+def mapping_env(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "ENABLE_GEOCODING", True)
+    monkeypatch.setattr(config, "OUTPUT_DIR", tmp_path / "output")
+    # Leave maps pending and never render them
+    monkeypatch.setattr(config, "MAP_GENERATION_MODE", "background")
+    monkeypatch.setattr(process, "queue_static_map", lambda *args, **kwargs: None)
+    monkeypatch.setattr(geocoding_client, "_geocode_cache", GeocodeCache(tmp_path / "geocode.db"))
+    monkeypatch.setattr(geocoding_client, "get_geocoder_backend", lambda: FakeBackend())
+    monkeypatch.setattr(process, "add_provider_mapping_to_results", _stub_provider_mapping)
+    monkeypatch.setattr(process, "add_provider_mapping_to_results_bulk",
+                        lambda results_list: [_stub_provider_mapping(r) for r in results_list])
+    return tmp_path / "output"
+
+def _written(output_dir, order_id):
+    with open(output_dir / f"{order_id}_results.json", 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def test_backend_error_for_one_order_leaves_others_mapped(mapping_env):
+    process.add_mapping_to_saved_results(_saved_results(ADDRESSES))
+
+    for order_id in ("A100", "C300"):
+        written = _written(mapping_env, order_id)
+        assert written["mapping_data"]["geocode_data"]["latitude"] == 28.0
+        assert written["provider_mapping"]["status"] == "success"
+    failed = _written(mapping_env, "B200")
+    assert failed["mapping_data"] == {"status": "geocoding_failed"}
+    assert failed["provider_mapping"]["status"] == "geocoding_failed"
+
+def test_batch_failure_falls_back_to_mapping_each_order(mapping_env):
+    addresses = dict(ADDRESSES)
+    # An address the LLM returned as a list breaks the shared geocoding pass
+    addresses["D400"] = ["400 Odd Rd", "Tampa, FL"]
+
+    process.add_mapping_to_saved_results(_saved_results(addresses))
+
+    for order_id in ("A100", "C300"):
+        written = _written(mapping_env, order_id)
+        assert written["mapping_data"]["geocode_data"]["latitude"] == 28.0
+        assert written["provider_mapping"]["status"] == "success"
+    assert _written(mapping_env, "B200")["mapping_data"] == {"status": "geocoding_failed"}
+    assert "geocode_data" not in _written(mapping_env, "D400")["mapping_data"]
+
+def test_bulk_provider_match_failure_falls_back_per_order(mapping_env, monkeypatch):
+    def explode(results_list):
+        raise RuntimeError("provider database unavailable")
+    monkeypatch.setattr(process, "add_provider_mapping_to_results_bulk", explode)
+
+    process.add_mapping_to_saved_results(_saved_results(ADDRESSES))
+
+    for order_id in ("A100", "C300"):
+        assert _written(mapping_env, order_id)["provider_mapping"]["status"] == "success"
+
+class ConcurrencyProbe:
+    """Counts how many calls are running at once."""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self.active -= 1
+
+@pytest.mark.parametrize("max_workers", [1, 2, 8])
+def test_ocr_pool_keeps_file_order_within_cap(monkeypatch, tmp_path, max_workers):
+    order_folder = tmp_path / "input" / "A100"
+    order_folder.mkdir(parents=True)
+    names = [f"doc{i}.pdf" for i in range(6)]
+    for name in names:
+        (order_folder / name).write_bytes(b"%PDF")
+    monkeypatch.setattr(config, "OCR_DIR", tmp_path / "ocr")
+    (tmp_path / "ocr").mkdir()
+    monkeypatch.setattr(config, "OCR_MAX_WORKERS", max_workers)
+    probe = ConcurrencyProbe()
+
+    def extract_text(file_path):
+        with probe:
+            # Later files finish first, so completion order differs from file order
+            time.sleep(0.01 * (len(names) - names.index(file_path.name)))
+            return f"text of {file_path.name}"
+
+    monkeypatch.setattr(process, "get_documentai_client", lambda: None)
+    monkeypatch.setattr(process, "extract_text", extract_text)
+
+    order_data = process.process_order_folder(order_folder)
+
+    assert 1 <= probe.peak <= max_workers
+    if max_workers > 1:
+        assert probe.peak > 1
+    assert [doc["file_name"] for doc in order_data["documents"]] == names
+    for doc in order_data["documents"]:
+        assert doc["content"] == f"text of {doc['file_name']}"
+        with open(doc["ocr_path"], 'r', encoding='utf-8') as f:
+            assert f.read() == doc["content"]
@@ -0,0 +1,126 @@
+"""
+Tests that every nearest-provider search mode returns what the brute-force scan returns.
+"""
+import random
+import sqlite3
+
+import pytest
+
+import provider_mapping_simple as pms
+
+PATIENTS = [
+    (27.9506, -82.4572),   # Tampa, FL
+    (47.6062, -122.3321),  # Seattle, WA
+    (61.2181, -149.9003),  # Anchorage, AK: far from all but one provider
+]
+
+FILTERS = [
+    {},
+    {"state": "GA"},
+    {"status": "Active", "provider_type": "PT"},
+    {"network": "in"},
+    {"max_distance": 150},
+    {"proc_code": "73721", "require_rate": True},
+    {"state": "fl", "proc_code": "73721", "require_rate": True, "max_distance": 400},
+]
+
+def _build_provider_db(path, count=600, seed=7):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE providers (
+            PrimaryKey INTEGER, [DBA Name Billing Name] TEXT, TIN TEXT, State TEXT, Status TEXT,
+            [Provider Type] TEXT, [Provider Network] TEXT, City TEXT, lat TEXT, lon TEXT,
+            Email TEXT, [Fax Number] TEXT, Phone TEXT, Website TEXT
+        )
+    """)
+    conn.execute("CREATE TABLE ppo (TIN TEXT, proc_cd TEXT, rate TEXT)")
+    rows = []
+    for i in range(count):
+        rows.append((
+            i, f"Provider {i}", f"{100000000 + i}", rng.choice(["FL", "GA", "TX", "WA"]),
+            rng.choice(["Active", "inactive "]), rng.choice(["Imaging", "PT", "\tPT", "Imaging\u00a0"]), rng.choice(["In", "Out"]),
+            f"City {i}", str(rng.uniform(25, 48)), str(rng.uniform(-124, -70)), "", "", "", ""
+        ))
+    # Only provider in Alaska, and one without a name that must never be returned
+    rows.append((count, "Anchorage Imaging", "123456789", "AK", "Active", "Imaging", "In",
+                 "Anchorage", "61.2", "-149.9", "", "", "", ""))
+    rows.append((count + 1, "", "123456780", "FL", "Active", "PT", "In",
+                 "Tampa", "27.95", "-82.45", "", "", "", ""))
+    conn.executemany("INSERT INTO providers VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+    conn.executemany("INSERT INTO ppo VALUES (?,?,?)",
+                     [(f"{100000000 + i}", "73721", str(100 + i % 50)) for i in range(0, count, 3)])
+    conn.commit()
+    conn.close()
+
+def _use_provider_db(mp, db_path):
+    mp.setattr(pms, "PROVIDER_DB_PATH", str(db_path))
+    # Start from empty process-wide caches; the monkeypatch puts the real ones back afterwards
+    for name in ("_provider_db", "_provider_records", "_provider_index", "_distance_engine",
+                 "_provider_attributes", "_sharded_provider_index", "_provider_snapshot",
+                 "_provider_fingerprint", "_rate_index_ready", "_provider_rtree_ready"):
+        mp.setattr(pms, name, None)
+
+@pytest.fixture(scope="module")
+def provider_db(tmp_path_factory):
+    db_path = tmp_path_factory.mktemp("providers") / "providers.db"
+    _build_provider_db(str(db_path))
+    pms.setup_provider_database(str(db_path))
+    with pytest.MonkeyPatch.context() as mp:
+        _use_provider_db(mp, db_path)
+        yield db_path
+        if pms._provider_db is not None:
+            pms._provider_db.close()
+
+@pytest.fixture
+def unindexed_provider_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "providers.db"
+    _build_provider_db(str(db_path))
+    _use_provider_db(monkeypatch, db_path)
+    yield db_path
+    if pms._provider_db is not None:
+        pms._provider_db.close()
+
+def _schema(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT type, name FROM sqlite_master ORDER BY type, name").fetchall()
+    finally:
+        conn.close()
+
+def _keys(providers):
+    return [p["PrimaryKey"] for p in providers]
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("search_mode", ["kdtree", "numpy", "rtree", "sharded"])
+def test_search_modes_match_scan(provider_db, search_mode, filters):
+    for latitude, longitude in PATIENTS:
+        expected = pms.find_nearest_providers(latitude, longitude, limit=5, search_mode="scan", **filters)
+        actual = pms.find_nearest_providers(latitude, longitude, limit=5, search_mode=search_mode, **filters)
+        assert _keys(actual) == _keys(expected)
+        assert [p["distance_miles"] for p in actual] == [p["distance_miles"] for p in expected]
+
+def test_scan_skips_unnamed_providers(provider_db):
+    nearest = pms.find_nearest_providers(27.95, -82.45, limit=1, search_mode="scan")
+    assert nearest and nearest[0]["DBA Name Billing Name"]
+
+def test_lookups_never_change_the_database(unindexed_provider_db):
+    schema = _schema(unindexed_provider_db)
+    mtime = unindexed_provider_db.stat().st_mtime_ns
+    for search_mode in ("scan", "kdtree", "numpy", "rtree", "sharded"):
+        pms.find_nearest_providers(27.95, -82.45, proc_code="73721", limit=3, search_mode=search_mode)
+    assert _schema(unindexed_provider_db) == schema
+    assert unindexed_provider_db.stat().st_mtime_ns == mtime
+    assert not pms.provider_rtree_available()
+    assert not pms.rate_index_available()
+
+@pytest.mark.parametrize("search_mode", ["rtree", "sharded"])
+def test_search_modes_without_setup_match_scan(unindexed_provider_db, search_mode):
+    for latitude, longitude in PATIENTS:
+        expected = pms.find_nearest_providers(latitude, longitude, limit=5, search_mode="scan", state="GA")
+        actual = pms.find_nearest_providers(latitude, longitude, limit=5, search_mode=search_mode, state="GA")
+        assert _keys(actual) == _keys(expected)
+
+def test_setup_creates_indexes(provider_db):
+    assert pms.provider_rtree_available()
+    assert pms.rate_index_available()
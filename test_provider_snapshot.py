@@ -0,0 +1,108 @@
+"""
+Tests that provider snapshots are rebuilt when the database they were compiled from changes.
+"""
+import os
+import sqlite3
+
+import pytest
+
+import provider_mapping_simple as pms
+from referrals.provider_snapshot import POINTER_FILE, compile_snapshot, db_fingerprint, load_snapshot, snapshot_dir_for
+from test_provider_search import _build_provider_db, _use_provider_db
+
+PROVIDER_COUNT = 20
+
+class FakeClock:
+    def __init__(self, now=5000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+def _fingerprint(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return db_fingerprint(db_path, conn.cursor())
+    finally:
+        conn.close()
+
+def _add_provider(db_path, key):
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO providers VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                 (key, f"Provider {key}", "987654321", "FL", "Active", "PT", "In",
+                  "Tampa", "27.9", "-82.4", "", "", "", ""))
+    conn.commit()
+    conn.close()
+
+def _touch(db_path, seconds=10):
+    stat = os.stat(db_path)
+    os.utime(db_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 1_000_000_000))
+
+def _grow(db_path):
+    # Restore the mtime so only the size tells the databases apart
+    stat = os.stat(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO ppo VALUES (?,?,?)", ("987654321", "99999", "1" * 8000))
+    conn.commit()
+    conn.close()
+    os.utime(db_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+def _change_schema(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE VIEW active_providers AS SELECT * FROM providers WHERE Status = 'Active'")
+    conn.commit()
+    conn.close()
+
+@pytest.fixture
+def provider_db(tmp_path):
+    db_path = tmp_path / "providers.db"
+    _build_provider_db(str(db_path), count=PROVIDER_COUNT)
+    return db_path
+
+@pytest.mark.parametrize("change, key", [
+    (_touch, "db_mtime_ns"),
+    (_grow, "db_size"),
+    (_change_schema, "schema_hash"),
+])
+def test_database_change_invalidates_snapshot(provider_db, change, key):
+    snapshot_dir = snapshot_dir_for(provider_db)
+    fingerprint = _fingerprint(provider_db)
+    records = [{"PrimaryKey": 1, "lat": 27.9, "lon": -82.4, "clean_tin": "123456789"}]
+    compile_snapshot(snapshot_dir, records, fingerprint)
+    assert len(load_snapshot(snapshot_dir, fingerprint)) == 1
+
+    change(provider_db)
+    changed = _fingerprint(provider_db)
+    assert changed[key] != fingerprint[key]
+    assert load_snapshot(snapshot_dir, changed) is None
+
+@pytest.mark.parametrize("snapshot_enabled", [True, False])
+def test_records_reload_after_check_interval(provider_db, monkeypatch, snapshot_enabled):
+    _use_provider_db(monkeypatch, provider_db)
+    monkeypatch.setattr(pms.config, "PROVIDER_SNAPSHOT_ENABLED", snapshot_enabled)
+    monkeypatch.setattr(pms, "_provider_checked_at", 0.0)
+    clock = FakeClock()
+    monkeypatch.setattr(pms.time, "monotonic", clock.monotonic)
+    interval = pms.config.PROVIDER_SNAPSHOT_CHECK_INTERVAL
+
+    records = pms.get_provider_records()
+    # The builder's unnamed provider is never loaded
+    assert len(records) == PROVIDER_COUNT + 1
+    first_snapshot = pms._provider_snapshot
+    assert (first_snapshot is not None) == snapshot_enabled
+
+    _add_provider(provider_db, 1000)
+    clock.now += interval - 1
+    assert pms.get_provider_records() is records
+
+    clock.now += 1
+    reloaded = pms.get_provider_records()
+    assert len(reloaded) == PROVIDER_COUNT + 2
+    if snapshot_enabled:
+        assert pms._provider_snapshot.path != first_snapshot.path
+        assert (snapshot_dir_for(provider_db) / POINTER_FILE).exists()
+        assert not first_snapshot.path.exists()
+
+    # Nothing changed since, so the next check keeps the same records
+    clock.now += interval
+    assert pms.get_provider_records() is reloaded
@@ -0,0 +1,51 @@
+"""
+Tests for per-host request slot spacing in the rate limiter.
+"""
+import pytest
+
+from referrals import rate_limiter
+from referrals.rate_limiter import RateLimiter
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "time", fake.time)
+    return fake
+
+def test_burst_is_spaced_by_interval(clock):
+    limiter = RateLimiter(intervals={"geo.example": 1.0})
+    slots = [limiter.reserve("geo.example") for _ in range(4)]
+    assert slots == [1000.0, 1001.0, 1002.0, 1003.0]
+
+def test_request_after_quiet_period_goes_out_immediately(clock):
+    limiter = RateLimiter(intervals={"geo.example": 1.0})
+    limiter.reserve("geo.example")
+    clock.now += 5
+    assert limiter.reserve("geo.example") == clock.now
+
+def test_hosts_are_limited_independently(clock):
+    limiter = RateLimiter(intervals={"geo.example": 1.0}, default_interval=0.5)
+    assert limiter.reserve("GEO.example") == 1000.0
+    assert limiter.reserve("geo.example") == 1001.0
+    assert limiter.reserve("tiles.example") == 1000.0
+    assert limiter.reserve("tiles.example") == 1000.5
+    assert limiter.reserve("other.example") == 1000.0
+
+def test_unlimited_host_is_never_delayed(clock):
+    limiter = RateLimiter()
+    assert [limiter.reserve("free.example") for _ in range(3)] == [1000.0] * 3
+
+def test_limiters_sharing_a_database_share_the_schedule(clock, tmp_path):
+    db_path = tmp_path / "rate_limits.db"
+    first = RateLimiter(db_path, intervals={"geo.example": 1.0})
+    second = RateLimiter(db_path, intervals={"geo.example": 1.0})
+    assert first.reserve("geo.example") == 1000.0
+    assert second.reserve("geo.example") == 1001.0
+    assert first.reserve("geo.example") == 1002.0
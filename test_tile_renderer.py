@@ -0,0 +1,102 @@
+"""
+Tests for the tile renderer's lookup order, offline misses and tile cache eviction.
+"""
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from referrals import tile_renderer
+from referrals.tile_renderer import MissingTilesError, TileCache, TileRenderer
+
+def _png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (tile_renderer.TILE_SIZE, tile_renderer.TILE_SIZE), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+RED = _png((255, 0, 0))
+GREEN = _png((0, 255, 0))
+BLUE = _png((0, 0, 255))
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+@pytest.fixture
+def tile_server(monkeypatch):
+    """Serves a blue tile for every request and records the URLs."""
+    requested = []
+
+    def fake_get(url, **kwargs):
+        requested.append(url)
+        return FakeResponse(BLUE)
+
+    monkeypatch.setattr(tile_renderer, "http_get", fake_get)
+    return requested
+
+def _write_tile(tile_dir, zoom, x, y, data):
+    path = tile_dir / str(zoom) / str(x) / f"{y}.png"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+def _pixel(image, x, y):
+    # Pixel inside tile (x, y) of a map rendered by _render_world
+    return image.getpixel((x * tile_renderer.TILE_SIZE + 10, y * tile_renderer.TILE_SIZE + 10))
+
+def _render_world(renderer, **kwargs):
+    # Zoom 1 centered on 0, 0: exactly the four tiles of the world
+    size = 2 * tile_renderer.TILE_SIZE
+    return renderer.render(0, 0, zoom=1, width=size, height=size, attribution=False, **kwargs)
+
+def test_tile_lookup_order(tmp_path, tile_server):
+    tile_dir = tmp_path / "tiles"
+    cache = TileCache(tmp_path / "cache", max_bytes=10 * 1024 * 1024)
+    _write_tile(tile_dir, 1, 0, 0, RED)
+    cache.put(1, 0, 0, GREEN)
+    cache.put(1, 1, 0, GREEN)
+    renderer = TileRenderer(tile_url="https://tiles.example/{z}/{x}/{y}.png", cache=cache, tile_dir=tile_dir)
+
+    image = _render_world(renderer)
+
+    # The local tile directory wins over the cache, and the cache over the server
+    assert _pixel(image, 0, 0) == (255, 0, 0)
+    assert _pixel(image, 1, 0) == (0, 255, 0)
+    assert _pixel(image, 0, 1) == (0, 0, 255)
+    assert sorted(tile_server) == ["https://tiles.example/1/0/1.png", "https://tiles.example/1/1/1.png"]
+    # Downloaded tiles are cached, so the next render needs no requests
+    assert cache.get(1, 0, 1) == BLUE
+    _render_world(renderer)
+    assert len(tile_server) == 2
+
+def test_offline_miss_raises(tmp_path, tile_server):
+    cache = TileCache(tmp_path / "cache", max_bytes=10 * 1024 * 1024)
+    cache.put(1, 0, 0, GREEN)
+    renderer = TileRenderer(tile_url="https://tiles.example/{z}/{x}/{y}.png", cache=cache, offline=True)
+
+    with pytest.raises(MissingTilesError) as excinfo:
+        _render_world(renderer)
+    assert (excinfo.value.missing, excinfo.value.total) == (3, 4)
+    assert tile_server == []
+
+    image = _render_world(renderer, allow_missing=True)
+    assert _pixel(image, 0, 0) == (0, 255, 0)
+    assert _pixel(image, 1, 1) == tile_renderer.PLACEHOLDER_COLOR
+
+def test_tile_cache_evicts_least_recently_used(tmp_path):
+    cache = TileCache(tmp_path / "cache", max_bytes=int(2.5 * len(RED)))
+    cache.put(1, 0, 0, RED)
+    cache.put(1, 0, 1, RED)
+    # Make the write order unambiguous, then use the older tile again
+    os.utime(cache._path(1, 0, 0), (100, 100))
+    os.utime(cache._path(1, 0, 1), (200, 200))
+    assert cache.get(1, 0, 0) == RED
+
+    cache.put(1, 1, 0, RED)
+
+    assert cache.get(1, 0, 1) is None
+    assert cache.get(1, 0, 0) == RED
+    assert cache.get(1, 1, 0) == RED
@@ -0,0 +1,253 @@
+"""
+Static map renderer that composes maps from slippy-map tiles with Pillow.
+
+Tiles are looked up in this order:
+
+1. a local tile directory laid out as ``{z}/{x}/{y}.png`` (config.MAP_TILE_DIR),
+   for fully offline rendering
+2. the on-disk tile cache (config.MAP_TILE_CACHE_DIR), kept under a size
+   limit by evicting the least recently used tiles
+3. the tile server (config.MAP_TILE_URL), unless config.MAP_TILES_OFFLINE
+
+Once an area's tiles are cached, rendering a map there needs no network call.
+"""
+import io
+import logging
+import math
+import threading
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+
+from referrals import config
+from referrals.http_client import http_get
+from referrals.lru_store import LRUDirectoryStore
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.0511287798  # Web Mercator limit
+PLACEHOLDER_COLOR = (229, 227, 223)
+MARKER_COLORS = {
+    "red": (220, 40, 40),
+    "blue": (40, 90, 220),
+    "green": (40, 160, 70)
+}
+ATTRIBUTION = "© OpenStreetMap contributors"
+
+class MissingTilesError(Exception):
+    """Raised by TileRenderer.render when some of a map's tiles could not be loaded."""
+
+    def __init__(self, missing, total):
+        super().__init__(f"{missing} of {total} map tiles unavailable")
+        self.missing = missing
+        self.total = total
+
+def lonlat_to_pixel(lat, lon, zoom):
+    """
+    Global Web Mercator pixel coordinates of a location.
+
+    Args:
+        lat: Latitude in degrees
+        lon: Longitude in degrees
+        zoom: Zoom level
+
+    Returns:
+        Tuple (x, y) in pixels from the top-left of the world at this zoom
+    """
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    scale = TILE_SIZE * (1 << zoom)
+    x = (lon + 180.0) / 360.0 * scale
+    lat_rad = math.radians(lat)
+    y = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * scale
+    return x, y
+
+class TileCache(LRUDirectoryStore):
+    """On-disk tile store with least-recently-used eviction above a size limit."""
+
+    def __init__(self, cache_dir, max_bytes):
+        """
+        Set up the cache.
+
+        Args:
+            cache_dir: Directory for cached tiles
+            max_bytes: Size above which the least recently used tiles are evicted
+        """
+        super().__init__(cache_dir, max_bytes, suffix=".png", label="tiles")
+
+    def _path(self, zoom, x, y):
+        return self.cache_dir / str(zoom) / str(x) / f"{y}.png"
+
+    def get(self, zoom, x, y):
+        """Cached tile bytes, or None on a miss."""
+        path = self._path(zoom, x, y)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        self.touch(path)
+        return data
+
+    def put(self, zoom, x, y, data):
+        """Store tile bytes, evicting old tiles if the cache grew past its limit."""
+        self.write(self._path(zoom, x, y), data)
+
+class TileRenderer:
+    """Render static maps from a local tile directory, a tile cache and a tile server."""
+
+    def __init__(self, tile_url=None, cache=None, tile_dir=None, offline=False):
+        """
+        Set up the renderer.
+
+        Args:
+            tile_url: Tile URL template with {z}, {x} and {y}
+            cache: Optional TileCache
+            tile_dir: Optional local {z}/{x}/{y}.png tile directory checked first
+            offline: Never fetch tiles from the network
+        """
+        self.tile_url = tile_url
+        self.cache = cache
+        self.tile_dir = Path(tile_dir) if tile_dir else None
+        self.offline = offline
+        self._placeholder = Image.new("RGB", (TILE_SIZE, TILE_SIZE), PLACEHOLDER_COLOR)
+
+    def _tile_bytes(self, zoom, x, y):
+        if self.tile_dir is not None:
+            local_path = self.tile_dir / str(zoom) / str(x) / f"{y}.png"
+            if local_path.exists():
+                return local_path.read_bytes()
+
+        if self.cache is not None:
+            data = self.cache.get(zoom, x, y)
+            if data is not None:
+                return data
+
+        if self.offline or not self.tile_url:
+            return None
+
+        response = http_get(self.tile_url.format(z=zoom, x=x, y=y))
+        response.raise_for_status()
+        data = response.content
+        if self.cache is not None:
+            self.cache.put(zoom, x, y, data)
+        return data
+
+    def tile(self, zoom, x, y):
+        """
+        Get one tile as an image.
+
+        Args:
+            zoom: Zoom level
+            x: Tile column (wrapped around the antimeridian)
+            y: Tile row
+
+        Returns:
+            PIL Image of TILE_SIZE x TILE_SIZE pixels (a blank placeholder for
+            rows beyond the poles), or None if the tile is unavailable
+        """
+        count = 1 << zoom
+        if not 0 <= y < count:
+            return self._placeholder
+        x %= count
+        try:
+            data = self._tile_bytes(zoom, x, y)
+        except Exception as e:
+            logger.warning(f"Could not get map tile {zoom}/{x}/{y}: {str(e)}")
+            return None
+        if data is None:
+            logger.warning(f"Map tile {zoom}/{x}/{y} not available offline")
+            return None
+        try:
+            return Image.open(io.BytesIO(data)).convert("RGB")
+        except Exception as e:
+            logger.warning(f"Unreadable map tile {zoom}/{x}/{y}: {str(e)}")
+            return None
+
+    def render(self, latitude, longitude, zoom=14, width=600, height=400, markers=None, attribution=True,
+               allow_missing=False):
+        """
+        Render a map centered on a location.
+
+        Args:
+            latitude: Latitude for map center
+            longitude: Longitude for map center
+            zoom: Zoom level (1-19)
+            width: Map width in pixels
+            height: Map height in pixels
+            markers: Optional list of (latitude, longitude, color) markers
+            attribution: Draw the tile attribution in the corner
+            allow_missing: Draw unavailable tiles blank instead of raising
+
+        Returns:
+            PIL Image
+
+        Raises:
+            MissingTilesError: If any tile was unavailable and allow_missing is False
+        """
+        center_x, center_y = lonlat_to_pixel(latitude, longitude, zoom)
+        left = center_x - width / 2.0
+        top = center_y - height / 2.0
+
+        image = Image.new("RGB", (width, height), PLACEHOLDER_COLOR)
+        first_col, last_col = int(math.floor(left / TILE_SIZE)), int(math.floor((left + width - 1) / TILE_SIZE))
+        first_row, last_row = int(math.floor(top / TILE_SIZE)), int(math.floor((top + height - 1) / TILE_SIZE))
+        missing = 0
+        total = 0
+        for col in range(first_col, last_col + 1):
+            for row in range(first_row, last_row + 1):
+                total += 1
+                tile = self.tile(zoom, col, row)
+                if tile is None:
+                    missing += 1
+                    continue
+                offset = (int(round(col * TILE_SIZE - left)), int(round(row * TILE_SIZE - top)))
+                image.paste(tile, offset)
+        if missing and not allow_missing:
+            # An incomplete map must not be cached or shown as the order's map
+            raise MissingTilesError(missing, total)
+
+        draw = ImageDraw.Draw(image)
+        for marker_lat, marker_lon, color in markers or []:
+            x, y = lonlat_to_pixel(marker_lat, marker_lon, zoom)
+            x, y = x - left, y - top
+            fill = MARKER_COLORS.get(color, MARKER_COLORS["red"])
+            draw.ellipse((x - 8, y - 8, x + 8, y + 8), fill=fill, outline=(255, 255, 255), width=2)
+
+        if attribution:
+            font = ImageFont.load_default()
+            text_box = draw.textbbox((0, 0), ATTRIBUTION, font=font)
+            text_width, text_height = text_box[2] - text_box[0], text_box[3] - text_box[1]
+            origin = (width - text_width - 6, height - text_height - 6)
+            draw.rectangle((origin[0] - 3, origin[1] - 2, width, height), fill=(255, 255, 255))
+            draw.text(origin, ATTRIBUTION, fill=(60, 60, 60), font=font)
+
+        return image
+
+# Process-wide renderer, created on first use
+_tile_renderer = None
+_tile_renderer_lock = threading.Lock()
+
+def get_tile_renderer():
+    """
+    Get the process-wide renderer configured from config.
+
+    Returns:
+        TileRenderer shared by every caller in this process
+    """
+    global _tile_renderer
+    with _tile_renderer_lock:
+        if _tile_renderer is None:
+            cache = TileCache(config.MAP_TILE_CACHE_DIR, config.MAP_TILE_CACHE_MAX_MB * 1024 * 1024)
+            _tile_renderer = TileRenderer(
+                tile_url=config.MAP_TILE_URL,
+                cache=cache,
+                tile_dir=config.MAP_TILE_DIR,
+                offline=config.MAP_TILES_OFFLINE
+            )
+        return _tile_renderer
+
+def render_static_map(latitude, longitude, zoom=14, width=600, height=400, markers=None):
+    """Render a map with the process-wide renderer. See TileRenderer.render."""
+    return get_tile_renderer().render(latitude, longitude, zoom, width, height, markers)
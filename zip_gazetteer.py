@@ -0,0 +1,232 @@
+"""
+Offline US ZIP code centroid gazetteer.
+
+Build it once from either public source:
+
+- GeoNames postal codes (``US.txt`` from download.geonames.org/export/zip/),
+  which includes city and state names
+- Census ZCTA gazetteer (``*_Gaz_zcta_national.txt``), coordinates only
+
+    python zip_gazetteer.py US.txt
+
+The result is a small SQLite table that is read fully into memory on first
+lookup, so resolving a ZIP code costs a dictionary lookup instead of network
+round trips.
+"""
+import argparse
+import csv
+import logging
+import re
+import sqlite3
+import threading
+from pathlib import Path
+
+from referrals import config
+from referrals.distance_engine import DistanceEngine
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+GAZETTEER_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS zip_centroids (
+        zip TEXT PRIMARY KEY,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        city TEXT,
+        state TEXT,
+        state_code TEXT
+    ) WITHOUT ROWID
+"""
+
+ZIP_PATTERN = re.compile(r'^\d{5}$')
+
+def _read_geonames(f):
+    # country, postal code, place, admin1 name, admin1 code, admin2 name, admin2 code,
+    # admin3 name, admin3 code, latitude, longitude, accuracy
+    for row in csv.reader(f, delimiter='\t'):
+        if len(row) < 11 or row[0] != 'US':
+            continue
+        yield row[1], float(row[9]), float(row[10]), row[2], row[3], row[4]
+
+def _read_zcta(f):
+    reader = csv.reader(f, delimiter='\t')
+    header = [column.strip().upper() for column in next(reader)]
+    geoid, lat, lon = header.index('GEOID'), header.index('INTPTLAT'), header.index('INTPTLONG')
+    for row in reader:
+        if len(row) > max(geoid, lat, lon):
+            yield row[geoid].strip(), float(row[lat]), float(row[lon]), None, None, None
+
+def build_gazetteer(source_path, db_path=None):
+    """
+    Build (or rebuild) the gazetteer table from a GeoNames or Census ZCTA file.
+
+    Args:
+        source_path: GeoNames US.txt or Census ZCTA gazetteer file
+        db_path: Output SQLite file (defaults to config.ZIP_GAZETTEER_DB)
+
+    Returns:
+        Number of ZIP codes written
+    """
+    db_path = Path(db_path or config.ZIP_GAZETTEER_DB)
+    with open(source_path, 'r', encoding='utf-8') as f:
+        first_line = f.readline()
+        f.seek(0)
+        reader = _read_zcta if first_line.upper().startswith('GEOID') else _read_geonames
+        rows = {}
+        for row in reader(f):
+            # GeoNames can list a ZIP more than once; keep the first entry
+            if ZIP_PATTERN.match(row[0]) and row[0] not in rows:
+                rows[row[0]] = row
+
+    conn = sqlite3.connect(str(db_path))
+    try:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS zip_centroids")
+            conn.execute(GAZETTEER_SCHEMA)
+            conn.executemany("INSERT INTO zip_centroids VALUES (?, ?, ?, ?, ?, ?)", rows.values())
+    finally:
+        conn.close()
+
+    logger.info(f"Built ZIP gazetteer with {len(rows)} ZIP codes: {db_path}")
+    return len(rows)
+
+class ZipGazetteer:
+    """In-memory view of the ZIP centroid table."""
+
+    def __init__(self, db_path):
+        """
+        Load the gazetteer.
+
+        Args:
+            db_path: SQLite file written by build_gazetteer
+        """
+        conn = sqlite3.connect(Path(db_path).absolute().as_uri() + "?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT zip, latitude, longitude, city, state, state_code FROM zip_centroids"
+            ).fetchall()
+        finally:
+            conn.close()
+        self._zips = {row[0]: row[1:] for row in rows}
+        self._zip_list = None
+        self._engine = None
+        self._engine_lock = threading.Lock()
+        logger.info(f"Loaded ZIP gazetteer with {len(self._zips)} ZIP codes")
+
+    def __len__(self):
+        return len(self._zips)
+
+    def lookup(self, zipcode):
+        """
+        Look up a ZIP code centroid.
+
+        Args:
+            zipcode: 5-digit ZIP code
+
+        Returns:
+            Dictionary with latitude, longitude, city, state and state_code, or None if unknown
+        """
+        row = self._zips.get(zipcode)
+        if row is None:
+            return None
+        latitude, longitude, city, state, state_code = row
+        return {
+            "latitude": latitude,
+            "longitude": longitude,
+            "city": city,
+            "state": state,
+            "state_code": state_code
+        }
+
+    def nearest(self, latitude, longitude):
+        """
+        Find the ZIP code whose centroid is closest to a location.
+
+        Args:
+            latitude: Latitude in degrees
+            longitude: Longitude in degrees
+
+        Returns:
+            Tuple (zipcode, centroid dictionary as returned by lookup), or None if empty
+        """
+        with self._engine_lock:
+            if self._engine is None:
+                self._zip_list = list(self._zips)
+                self._engine = DistanceEngine([self._zips[z][0] for z in self._zip_list],
+                                              [self._zips[z][1] for z in self._zip_list])
+        indices, _ = self._engine.nearest(latitude, longitude, k=1)
+        if not len(indices):
+            return None
+        zipcode = self._zip_list[indices[0]]
+        return zipcode, self.lookup(zipcode)
+
+# Process-wide gazetteer, loaded on first use (False when unavailable)
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+def get_gazetteer():
+    """
+    Get the process-wide gazetteer.
+
+    Returns:
+        ZipGazetteer, or None if config.ZIP_GAZETTEER_DB has not been built
+    """
+    global _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            db_path = Path(config.ZIP_GAZETTEER_DB)
+            try:
+                _gazetteer = ZipGazetteer(db_path) if db_path.exists() else False
+            except sqlite3.Error as e:
+                logger.error(f"Error loading ZIP gazetteer: {str(e)}")
+                _gazetteer = False
+            if not _gazetteer:
+                logger.info(f"No ZIP gazetteer at {db_path}; ZIP codes will be geocoded online")
+        return _gazetteer or None
+
+def lookup_zip(zipcode):
+    """
+    Look up a ZIP code centroid in the process-wide gazetteer.
+
+    Args:
+        zipcode: 5-digit ZIP code
+
+    Returns:
+        Dictionary with latitude, longitude, city, state and state_code, or None
+    """
+    gazetteer = get_gazetteer()
+    return gazetteer.lookup(zipcode) if gazetteer else None
+
+def centroid_result(zipcode, centroid):
+    """
+    Build a geocoding result for a ZIP code centroid.
+
+    Args:
+        zipcode: 5-digit ZIP code
+        centroid: Dictionary as returned by lookup_zip
+
+    Returns:
+        Dictionary with latitude, longitude, display_name and address_components
+    """
+    city = centroid["city"] or ""
+    state = centroid["state"] or ""
+    place = ", ".join(part for part in (city, f"{state} {zipcode}".strip()) if part)
+    return {
+        "latitude": centroid["latitude"],
+        "longitude": centroid["longitude"],
+        "display_name": f"{place}, USA",
+        "address_components": {
+            "city": city,
+            "state": state,
+            "postcode": zipcode,
+            "country": "USA"
+        }
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline ZIP code centroid gazetteer")
+    parser.add_argument("source", help="GeoNames US.txt or Census ZCTA gazetteer file")
+    parser.add_argument("--db", help="Output database (defaults to config.ZIP_GAZETTEER_DB)")
+    args = parser.parse_args()
+    build_gazetteer(args.source, args.db)